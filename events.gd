@@ -86,6 +86,10 @@ signal rap_turn_changed(is_player_turn: bool, round_idx: int, bar_idx: int)
 # Example payload: { "rhyme": 0.62, "onbeat": 0.71, "variety": 0.48, "complete": 0.9, "total": 0.64, "rank": "B" }
 signal rap_player_scored(round_idx: int, judge: Dictionary)
 
+# Live judge snapshot while the player's window is still open (throttled by the server, ~2/s).
+# Same keys as rap_player_scored's judge, scored on what has been rapped so far.
+signal rap_player_progress(round_idx: int, judge: Dictionary)
+
 # Final outcome after all rounds. You can put totals/rank/rewards in result.
 signal rap_battle_ended(npc: Node, result: Dictionary)
 
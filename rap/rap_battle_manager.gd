@@ -23,6 +23,7 @@ class_name RapBattleManager
 
 @onready var count_label: Label = $RapHUD/CountLabel
 @onready var turn_label: Label  = $RapHUD/TurnLabel
+var live_meter: ProgressBar                  # built in _ready; filled by rap_player_progress
 
 # ───────── State ─────────
 var round_idx: int = 0
@@ -39,6 +40,8 @@ var player_disabled: bool = false
 func _enter_tree() -> void:
 	if Events and not Events.is_connected("rap_player_scored", Callable(self, "_on_player_scored")):
 		Events.rap_player_scored.connect(_on_player_scored)
+	if Events and not Events.is_connected("rap_player_progress", Callable(self, "_on_player_progress")):
+		Events.rap_player_progress.connect(_on_player_progress)
 
 func _ready() -> void:
 	# If VoiceReceiver stored a bpm/instrumental in SceneTree meta, use it; then clear.
@@ -59,6 +62,7 @@ func _ready() -> void:
 	# HUD prep
 	count_label.visible = false
 	turn_label.visible = false
+	_build_live_meter()
 
 	# Assign instrumental stream
 	if instrumental:
@@ -188,6 +192,8 @@ func _do_player_turn() -> void:
 		waiting_for_judge = true
 		print("[RAP] Opening listen window for", float(listen_window_ms) / 1000.0, "seconds")
 		voice.call_deferred("start_listen_window", listen_window_ms, bpm, bars_per_turn, round_idx)
+		live_meter.value = 0.0
+		live_meter.visible = true
 
 		# Wait for 'freestyle_final' with a small cushion for server processing
 		var max_wait := (listen_window_ms / 1000.0) + 1.5
@@ -201,6 +207,7 @@ func _do_player_turn() -> void:
 			waiting_for_judge = false
 			player_total += 0.3
 			await _show_round_score({"rhyme":0.1,"onbeat":0.2,"variety":0.2,"complete":0.4,"total":0.3,"rank":"D"})
+		live_meter.visible = false
 	else:
 		push_warning("VoiceReceiver missing or no start_listen_window – neutral score applied.")
 		await get_tree().create_timer(listen_window_ms / 1000.0).timeout
@@ -214,6 +221,14 @@ func _do_player_turn() -> void:
 
 	turn_label.visible = false
 
+func _on_player_progress(round_i: int, judge: Dictionary) -> void:
+	if not battle_running or not waiting_for_judge or round_i != round_idx:
+		return
+	var total := clampf(float(judge.get("total", 0.0)), 0.0, 1.0)
+	# ease towards the new score so ~2 updates/s still read as a smooth meter
+	create_tween().tween_property(live_meter, "value", total * 100.0, 0.3)
+	turn_label.text = "%s  %d%%" % [str(judge.get("rank", "?")), int(round(total * 100.0))]
+
 func _on_player_scored(round_i: int, judge: Dictionary) -> void:
 	if not battle_running or round_i != round_idx:
 		return
@@ -223,6 +238,16 @@ func _on_player_scored(round_i: int, judge: Dictionary) -> void:
 	await _show_round_score(judge)
 
 # ───────── UI helpers ─────────
+func _build_live_meter() -> void:
+	live_meter = ProgressBar.new()
+	live_meter.min_value = 0.0
+	live_meter.max_value = 100.0
+	live_meter.show_percentage = false
+	live_meter.custom_minimum_size = Vector2(160, 10)
+	live_meter.position = turn_label.position + Vector2(0, turn_label.size.y + 4)
+	live_meter.visible = false
+	hud.add_child(live_meter)
+
 func _show_round_score(judge: Dictionary) -> void:
 	var r: String = str(judge.get("rank", "?"))
 	var total_percent: int = int(round(100.0 * float(judge.get("total", 0.0))))
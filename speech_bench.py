@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""Headless latency / throughput benchmark for speech_server.
+
+Replays a corpus of 16 kHz mono WAV or raw s16le PCM files through the same
+VoiceSession decode path the websocket server uses, with no audio device,
+and reports per mode:
+
+  latency   end-of-utterance → `final` / `freestyle_final` (ms, p50/p95/p99)
+  progress  `freestyle_progress` messages seen (not counted as results)
+  block     decode cost per BLOCKSIZE block (ms, p50/p95/p99)
+  rtf       decode wall time / audio time
+  cpu, rss  process CPU seconds and peak resident memory
+
+--lang replays through that language's model (loaded from vosk_models/ like
+the server does on first use); the report lists each loaded model's load
+time and memory.
+
+--json also includes the server's metrics snapshot (counters and
+per-stage utterance trace histograms).
+
+--checks runs built-in regression checks that need no corpus (a sustained
+noise step must not leave the VAD stuck in "speech"; streamed audio must
+keep its capture times across a long loss or a client clock jump; the
+incremental freestyle judge must match judging the window in one go).
+
+--resampler RATE[xCH] times the capture resampler (speech_resample) on
+synthetic blocks of that native format instead of, or as well as, a corpus.
+
+Audio is fed as fast as it decodes and stamped on a virtual clock, so
+latency = (audio time from last voiced block to the block that produced the
+message) + (wall time spent inside that block's decode).
+
+    python speech_bench.py corpus/ --mode both --json
+    python speech_bench.py corpus/ --max-rtf 0.3 --max-latency-p95-ms 900   # exit 1 on regression
+    python speech_bench.py --resampler 48000x2 44100x2
+    python speech_bench.py --checks
+    python speech_bench.py corpus/de/ --lang de --mode command
+"""
+import os, sys, json, glob, math, argparse, tempfile
+import numpy as np
+from time import perf_counter, process_time
+from typing import Optional, Dict, Any, List
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import speech_server as ss
+from speech_resample import Resampler
+from speech_judge import FreestyleJudge, judge_freestyle
+
+AUDIO_EXTS = (".wav", ".raw", ".pcm")
+FINAL_TYPES = ("final", "freestyle_final")     # freestyle_progress is interim, not a result
+
+# =========================
+# Helpers
+# =========================
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile; 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    xs = sorted(values)
+    k = max(0, min(len(xs) - 1, math.ceil(p / 100.0 * len(xs)) - 1))
+    return xs[k]
+
+def summarize(values_ms: List[float]) -> Dict[str, float]:
+    return {
+        "n": len(values_ms),
+        "p50": round(percentile(values_ms, 50), 3),
+        "p95": round(percentile(values_ms, 95), 3),
+        "p99": round(percentile(values_ms, 99), 3),
+        "max": round(max(values_ms), 3) if values_ms else 0.0,
+    }
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(rss / (1024.0 * 1024.0) if sys.platform == "darwin" else rss / 1024.0, 1)
+
+def find_corpus(paths: List[str]) -> List[str]:
+    files: List[str] = []
+    for p in paths:
+        if os.path.isdir(p):
+            for ext in AUDIO_EXTS:
+                files.extend(glob.glob(os.path.join(p, "**", "*" + ext), recursive=True))
+        else:
+            files.append(p)
+    return sorted(files)
+
+# =========================
+# Replay
+# =========================
+def replay_file(path: str, mode: str, tail_sec: float = 1.5, lang: str = ss.MODEL_DEFAULT_LANG) -> Dict[str, Any]:
+    """Run one file through a fresh VoiceSession and collect timings."""
+    blocks = list(ss.pcm_blocks(path))
+    audio_sec = len(blocks) * ss.BLOCK_SEC
+    blocks += [bytes(ss.BLOCKSIZE * 2)] * int(tail_sec / ss.BLOCK_SEC)
+
+    model = ss.registry.load(ss.registry.model_lang(lang))
+    pool = model.pool
+    pair = pool.checkout()
+    if pair is None:
+        raise RuntimeError("recognizer pool exhausted")
+
+    clock = [0.0]
+    block_t0 = [0.0]
+    latencies: List[float] = []
+    messages: List[Dict[str, Any]] = []
+    session = None
+
+    def emit(obj: Dict[str, Any]):
+        now = clock[0]
+        typ = obj.get("type")
+        eou = session.window_deadline if typ == "freestyle_final" else session.last_voice_time
+        if typ in FINAL_TYPES and eou is not None:
+            latencies.append(((now - eou) + (perf_counter() - block_t0[0])) * 1000.0)
+        messages.append(obj)
+        if obj.get("id") is not None:
+            session.on_sent(obj["id"])      # no socket here: "sent" = emitted
+
+    session = ss.VoiceSession(pair, emit, clock=lambda: clock[0], model=model, lang=lang)
+    try:
+        if mode == "freestyle":
+            session.handle_control({"type": "listen_window", "ms": int(audio_sec * 1000)})
+        else:
+            session.handle_control({"type": "set_mode", "mode": "command"})
+
+        costs: List[float] = []
+        for i, block in enumerate(blocks):
+            clock[0] = (i + 1) * ss.BLOCK_SEC
+            block_t0[0] = perf_counter()
+            session.decode_block(clock[0], block)
+            costs.append((perf_counter() - block_t0[0]) * 1000.0)
+        session.close()
+    finally:
+        pool.checkin(pair)
+
+    return {
+        "file": path,
+        "audio_sec": audio_sec,
+        "fed_sec": len(blocks) * ss.BLOCK_SEC,
+        "block_ms": costs,
+        "latency_ms": latencies,
+        "messages": messages,
+    }
+
+def bench_mode(files: List[str], mode: str, lang: str = ss.MODEL_DEFAULT_LANG) -> Dict[str, Any]:
+    cpu0, wall0 = process_time(), perf_counter()
+    block_ms: List[float] = []
+    latency_ms: List[float] = []
+    fed_sec = 0.0
+    progress = 0
+    texts = []
+    for path in files:
+        r = replay_file(path, mode, lang=lang)
+        block_ms += r["block_ms"]
+        latency_ms += r["latency_ms"]
+        fed_sec += r["fed_sec"]
+        progress += sum(1 for m in r["messages"] if m.get("type") == "freestyle_progress")
+        texts.append({"file": os.path.basename(path),
+                      "out": [m.get("text", "") for m in r["messages"] if m.get("type") in FINAL_TYPES]})
+    decode_sec = sum(block_ms) / 1000.0
+    return {
+        "mode": mode,
+        "lang": lang,
+        "files": len(files),
+        "audio_sec": round(fed_sec, 2),
+        "latency_ms": summarize(latency_ms),
+        "progress": progress,
+        "block_ms": summarize(block_ms),
+        "rtf": round(decode_sec / fed_sec, 4) if fed_sec else 0.0,
+        "cpu_sec": round(process_time() - cpu0, 3),
+        "wall_sec": round(perf_counter() - wall0, 3),
+        "peak_rss_mb": peak_rss_mb(),
+        "outputs": texts,
+    }
+
+# =========================
+# Resampler
+# =========================
+def bench_resampler(spec: str, seconds: float = 30.0) -> Dict[str, Any]:
+    """Per-block cost of resampling `spec` ("48000x2") to BLOCKSIZE 16 kHz blocks."""
+    rate_s, _, ch_s = spec.lower().partition("x")
+    rate, channels = int(rate_s), int(ch_s or 1)
+    frames = Resampler.block_for(rate, ss.SAMPLE_RATE, ss.BLOCKSIZE)
+    if frames is None:
+        raise ValueError(f"{rate} Hz doesn't divide into {ss.BLOCKSIZE}-sample blocks")
+    r = Resampler(rate, ss.SAMPLE_RATE, channels, frames)
+    rng = np.random.default_rng(0)
+    blocks = [rng.integers(-8000, 8000, frames * channels, dtype="int16").tobytes() for _ in range(8)]
+    n = max(1, int(seconds / ss.BLOCK_SEC))
+    costs: List[float] = []
+    for i in range(n):
+        t0 = perf_counter()
+        r.process(blocks[i % len(blocks)])
+        costs.append((perf_counter() - t0) * 1000.0)
+    return {"format": spec, **r.stats(), "block_ms": summarize(costs),
+            "rtf": round(sum(costs) / 1000.0 / (n * ss.BLOCK_SEC), 5)}
+
+# =========================
+# Regression checks
+# =========================
+def check_vad_noise_step(seconds: float = 60.0, rms: float = 800.0) -> Dict[str, Any]:
+    """Quiet room, then a sustained step up in noise (fan, traffic): the VAD
+    must fall back to unvoiced instead of calling the noise speech forever."""
+    vad = ss.FrameVAD(ss.SAMPLE_RATE, ss.VAD_FRAME_MS, ss.VAD_THRESHOLD_DB,
+                      min_speech_db=ss.VAD_MIN_SPEECH_DB, hangover_ms=ss.VAD_HANGOVER_MS)
+    rng = np.random.default_rng(0)
+    def block(level):
+        return (rng.standard_normal(ss.BLOCKSIZE) * level).astype(np.int16).tobytes()
+    for _ in range(int(5.0 / ss.BLOCK_SEC)):
+        vad.process(block(30.0))
+    voiced = [vad.process(block(rms)) for _ in range(int(seconds / ss.BLOCK_SEC))]
+    tail = voiced[-int(10.0 / ss.BLOCK_SEC):]
+    settle = next((i for i in range(len(voiced)) if not any(voiced[i:])), None)
+    return {
+        "check": "vad_noise_step",
+        "ok": not any(tail),
+        "voiced_blocks": sum(voiced),
+        "settle_sec": round(settle * ss.BLOCK_SEC, 2) if settle is not None else None,
+        "noise_db": round(vad.noise_db, 1),
+    }
+
+def check_stream_gap(frame_ms: int = 20, gap_sec: float = 2.0, jump_sec: float = 3.0) -> Dict[str, Any]:
+    """Client-streamed audio with a loss too long to fill with silence, then a
+    jump in client time on contiguous seq: the blocks after each must still be
+    stamped at their capture time, not late by the gap."""
+    src = ss.ClientAudioSource()
+    sub = src.subscribe()
+    dur = frame_ms / 1000.0
+    pcm = bytes(int(dur * ss.SAMPLE_RATE) * 2)
+    state = {"seq": 0, "t": 0.0}
+    clock = [0.0]
+    def send(sec):
+        for _ in range(int(round(sec / dur))):
+            clock[0] = state["t"] + dur + 0.05          # every frame arrives 50 ms after capture
+            src.feed(ss.AUDIO_FRAME_HEADER.pack(state["seq"], state["t"]) + pcm)
+            state["seq"] += 1
+            state["t"] += dur
+    expected: List[float] = []
+    def segment(start, sec):
+        n = int(round(sec / ss.BLOCK_SEC))
+        expected.extend(start + (i + 1) * ss.BLOCK_SEC + 0.05 for i in range(n))
+    real_monotonic = ss.monotonic
+    ss.monotonic = lambda: clock[0]
+    try:
+        segment(0.0, 1.0)
+        send(1.0)
+        state["seq"] += int(round(gap_sec / dur))        # lost in transit
+        state["t"] += gap_sec
+        segment(state["t"], 1.0)
+        send(1.0)
+        state["t"] += jump_sec                           # client clock jump, no loss
+        segment(state["t"], 1.0)
+        send(1.0)
+    finally:
+        ss.monotonic = real_monotonic
+    stamps = []
+    while (item := sub.pop(timeout=0.0)) is not None:
+        stamps.append(item[1])
+    err = max((abs(a - b) for a, b in zip(stamps, expected)), default=None)
+    return {
+        "check": "stream_gap",
+        "ok": len(stamps) == len(expected) and err is not None and err < 1e-3,
+        "blocks": len(stamps),
+        "max_err_ms": round(err * 1000.0, 1) if err is not None else None,
+        "frames_lost": src.frames_lost,
+    }
+
+def check_judge_incremental(bpm: float = 92.0, chunk_words: int = 5) -> Dict[str, Any]:
+    """FreestyleJudge fed chunk by chunk (as the server does, one Vosk final
+    at a time) must score a window exactly like judging it in one go."""
+    lyric = ("i got the flow that you never gonna stop "
+             "climbing to the top while the beat goes drop "
+             "mic in my hand and the crowd goes wild "
+             "spitting every line like a storm in style").split()
+    beat = 60.0 / bpm
+    timed, t = [], 0.25
+    for i, w in enumerate(lyric):
+        timed.append((w, t, t + beat * 0.4))
+        t += beat * (1.5 if (i + 1) % 9 == 0 else 0.5)   # a pause after each line
+    window = t + beat
+    grid = "eighth"
+    chunks = [timed[i:i + chunk_words] for i in range(0, len(timed), chunk_words)]
+    mismatched = []
+    for with_times in (True, False):
+        judge = FreestyleJudge(window, bpm, grid)
+        for c in chunks:
+            judge.add(" ".join(w for w, _, _ in c), c if with_times else None)
+        whole = judge_freestyle(" ".join(lyric), timed if with_times else [], window, bpm, grid)
+        if judge.result() != whole:
+            mismatched.append({"timed": with_times, "incremental": judge.result(), "whole": whole})
+    return {
+        "check": "judge_incremental",
+        "ok": not mismatched,
+        "chunks": len(chunks),
+        "mismatched": mismatched,
+    }
+
+CHECKS = [check_vad_noise_step, check_stream_gap, check_judge_incremental]
+
+# =========================
+# CLI
+# =========================
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Replay a corpus through speech_server and report latency/throughput.")
+    ap.add_argument("corpus", nargs="*", help="audio files or directories (searched recursively)")
+    ap.add_argument("--mode", choices=["command", "freestyle", "both"], default="both")
+    ap.add_argument("--lang", default=ss.MODEL_DEFAULT_LANG,
+                    help="language to replay as (loads its model from vosk_models/ if it has one)")
+    ap.add_argument("--json", action="store_true", help="print the report as JSON")
+    ap.add_argument("--resampler", nargs="+", metavar="RATE[xCH]", default=[],
+                    help="also time the capture resampler for these native formats, e.g. 48000x2")
+    ap.add_argument("--checks", action="store_true",
+                    help="also run the built-in regression checks (exit 1 if one fails)")
+    ap.add_argument("--log-level", default="WARNING", help="speech_server console log level")
+    ap.add_argument("--max-rtf", type=float, help="fail if real-time factor exceeds this")
+    ap.add_argument("--max-latency-p95-ms", type=float, help="fail if p95 end-of-utterance latency exceeds this")
+    ap.add_argument("--max-block-p99-ms", type=float, help="fail if p99 per-block decode cost exceeds this")
+    args = ap.parse_args(argv)
+    ss.setup_logging(args.log_level)
+    # replays miss phrases too; keep them out of the repo's unmatched_phrases.*
+    scratch = tempfile.TemporaryDirectory(prefix="speech_bench_")
+    ss.unmatched_log = ss.UnmatchedLog(os.path.join(scratch.name, "unmatched_phrases.txt"),
+                                       os.path.join(scratch.name, "unmatched_phrases.json"))
+
+    report: Dict[str, Any] = {"blocksize": ss.BLOCKSIZE, "sample_rate": ss.SAMPLE_RATE, "results": []}
+    if args.resampler:
+        report["resampler"] = [bench_resampler(spec) for spec in args.resampler]
+    if args.checks:
+        report["checks"] = [check() for check in CHECKS]
+
+    files = find_corpus(args.corpus)
+    if args.corpus and not files:
+        print("No audio files found in corpus.", file=sys.stderr)
+        return 2
+    if not files and not args.resampler and not args.checks:
+        print("Nothing to do: give a corpus, --resampler and/or --checks.", file=sys.stderr)
+        return 2
+
+    if files:
+        ss.loader.load()
+        if ss.loader.state != "ready":
+            print(f"Model failed to load: {ss.loader.error}", file=sys.stderr)
+            return 2
+        modes = ["command", "freestyle"] if args.mode == "both" else [args.mode]
+        report["startup"] = ss.loader.phases
+        try:
+            report["results"] = [bench_mode(files, m, args.lang) for m in modes]
+        except RuntimeError as e:      # unknown language, or its model doesn't fit the budget
+            print(f"Language {args.lang}: {e}", file=sys.stderr)
+            return 2
+        report["models"] = ss.registry.stats()
+        report["metrics"] = ss.metrics.snapshot()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for c in report.get("checks", []):
+            print(f"[check {c['check']}] {'ok' if c['ok'] else 'FAIL'} {c}")
+        for r in report.get("resampler", []):
+            print(f"[resample {r['format']}] ratio={r['ratio']} taps={r['taps']} "
+                  f"delay={r['delay_ms']}ms rtf={r['rtf']}")
+            print(f"    block ms    {r['block_ms']}")
+        if files:
+            print(f"startup ms  {report['startup']}")
+            for lang, m in report["models"]["loaded"].items():
+                print(f"model [{lang}] {m['dir']} load={m['load_ms']}ms rss=+{m['rss_mb']}MB phrases={m['phrases']}")
+        for r in report["results"]:
+            print(f"[{r['mode']}/{r['lang']}] files={r['files']} audio={r['audio_sec']}s rtf={r['rtf']} "
+                  f"cpu={r['cpu_sec']}s rss={r['peak_rss_mb']}MB progress={r['progress']}")
+            print(f"    latency ms  {r['latency_ms']}")
+            print(f"    block ms    {r['block_ms']}")
+
+    failed = [f"check {c['check']} failed: {c}" for c in report.get("checks", []) if not c["ok"]]
+    for r in report["results"]:
+        if args.max_rtf is not None and r["rtf"] > args.max_rtf:
+            failed.append(f"{r['mode']}: rtf {r['rtf']} > {args.max_rtf}")
+        if args.max_latency_p95_ms is not None and r["latency_ms"]["p95"] > args.max_latency_p95_ms:
+            failed.append(f"{r['mode']}: latency p95 {r['latency_ms']['p95']} > {args.max_latency_p95_ms}")
+        if args.max_block_p99_ms is not None and r["block_ms"]["p99"] > args.max_block_p99_ms:
+            failed.append(f"{r['mode']}: block p99 {r['block_ms']['p99']} > {args.max_block_p99_ms}")
+    ss.unmatched_log.stop()
+    scratch.cleanup()
+    for f in failed:
+        print("❌ " + f, file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
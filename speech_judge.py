@@ -0,0 +1,323 @@
+"""Freestyle judging for speech_server.
+
+Scores one listen window from the recognized text plus Vosk's per-word
+timestamps (already mapped to seconds from the window start), the bpm and
+the beat grid the client sent with `listen_window`. FreestyleJudge keeps
+rolling counters as chunks land, so progress snapshots and the final score
+never re-scan the window; rhyme uses O(1) key lookups from speech_rhyme.
+"""
+import re, collections
+from typing import List, Dict, Any, Tuple, Optional
+from speech_rhyme import RhymeIndex, rhyme_index, tail_vowels, TAIL_MAX
+
+# (word, start, end) in seconds from the start of the listen window
+TimedWord = Tuple[str, float, float]
+
+GRID_STEPS = {"quarter": 1, "eighth": 2, "triplet": 3, "sixteenth": 4}   # grid lines per beat
+
+WORDS_PER_BEAT_TARGET = 1.5        # rap-rate sweet spot (≈2.3 wps at 92 bpm)
+WINDOW_USED_FULL      = 0.75       # rapping through 75% of the window = full "complete" credit
+
+# lines: Vosk emits no punctuation, so bars are cut at pauses (or every bar of beats)
+LINE_GAP_SEC        = 0.30         # a pause this long always ends a line...
+LINE_GAP_BEATS      = 0.5          # ...as does one of half a beat, if that's longer
+LINE_MAX_BEATS      = 4.0          # and no line runs past one 4/4 bar
+LINE_FALLBACK_WORDS = 8            # no timestamps: chunk into lines of this many words
+
+# rhyme sub-scores
+END_ASSONANCE   = 0.5              # line ends share only the final vowel (slant rhyme)
+RHYME_END_W      = 0.60
+RHYME_INTERNAL_W = 0.25
+RHYME_MULTI_W    = 0.15
+
+STOP_WORDS = frozenset("a an the and or but i you he she we they it me my your to of in on at for is are was be "
+                       "that this with so do no yo uh um".split())
+
+# weighted total. You can tweak these. Keep simple and readable.
+RHYME_W    = 0.35
+ONBEAT_W   = 0.20
+VARIETY_W  = 0.20
+COMPLETE_W = 0.25
+
+# =========================
+# Text helpers
+# =========================
+_RE_WORD = re.compile(r"[a-zA-Zøæåäöáéíóúýčšžñß’']+", re.UNICODE)
+
+def tokenize_words(text: str) -> List[str]:
+    return [m.group(0).lower() for m in _RE_WORD.finditer(text or "")]
+
+def split_lines_for_rap(text: str) -> List[str]:
+    # split by newline or natural pauses (.,!?)
+    raw_lines = re.split(r"[ \t]*[\n\r]+|[.!?]+", text or "")
+    return [ln.strip() for ln in raw_lines if ln.strip()]
+
+def clamp01(x: float) -> float:
+    return max(0.0, min(1.0, x))
+
+def rank_from_total(score: float) -> str:
+    if score >= 0.90: return "S"
+    if score >= 0.75: return "A"
+    if score >= 0.60: return "B"
+    if score >= 0.45: return "C"
+    return "D"
+
+# =========================
+# Rhyme helpers
+# =========================
+def _phrase_tail(keys: List[tuple]) -> List[int]:
+    """Vowels at the end of a line across word boundaries, last first."""
+    out: List[int] = []
+    for _, tail, _ in reversed(keys):
+        out.extend(tail_vowels(tail))
+        if len(out) >= TAIL_MAX:
+            break
+    return out[:TAIL_MAX]
+
+def _shared(a: List[int], b: List[int]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+def _line_end(line: List[str], keys: List[tuple]) -> tuple:
+    """(word, rime, last vowel, phrase tail) for a line's end rhyme."""
+    tail = _phrase_tail(keys[-TAIL_MAX:])
+    return line[-1], keys[-1][0], tail[0] if tail else 0, tail
+
+def _end_score(end: tuple, prev: "collections.deque") -> Tuple[float, float]:
+    """Best end rhyme against the two lines before (AABB / ABAB) and its multi-syllable credit."""
+    w, rime, vowel, tail = end
+    best = best_multi = 0.0
+    for pw, prime, pvowel, ptail in prev:
+        if pw == w:
+            continue                           # repeating a word isn't a rhyme
+        if prime == rime:
+            score = 1.0
+        elif vowel and pvowel == vowel:
+            score = END_ASSONANCE
+        else:
+            continue
+        best = max(best, score)
+        best_multi = max(best_multi, clamp01((_shared(tail, ptail) - 1) / 2.0))
+    return best, best_multi
+
+def _internal(line: List[str], keys: List[tuple]) -> Tuple[int, int]:
+    """(content words rhyming with another word in the line, content words), line end excluded."""
+    seen: Dict[int, set] = collections.defaultdict(set)
+    for w, k in zip(line, keys):
+        if w not in STOP_WORDS and k[2]:
+            seen[k[0]].add(w)
+    hits = content = 0
+    for w, k in zip(line[:-1], keys[:-1]):
+        if w in STOP_WORDS or not k[2]:
+            continue
+        content += 1
+        if len(seen[k[0]]) > 1:
+            hits += 1
+    return hits, content
+
+# =========================
+# Judge
+# =========================
+class FreestyleJudge:
+    """Rolling judge for one listen window.
+
+    add() folds in each Vosk final chunk as it lands: words go into the
+    variety set, timed words into the timing counters and the current line,
+    and a line's rhyme/internal scores are settled once when it closes. So
+    result() only has to look at the open line, which a bar caps:
+
+      lines      cut at pauses (or every bar of beats); without timestamps,
+                 every LINE_FALLBACK_WORDS words
+      rhyme      end: line ends rhyming with one of the two lines before
+                 internal: share of content words rhyming inside their line
+                 multi: syllables the end rhymes carry beyond the last one
+      timing     wps over the span rapped, onset alignment to the grid
+                 (0.5 ≈ random), window fraction covered by words and
+                 short (< 1 beat) gaps
+    """
+
+    def __init__(self, window_sec: float, bpm: float, grid: str, index: Optional[RhymeIndex] = None):
+        self.window_sec = window_sec
+        self.bpm = bpm
+        self.index = index or rhyme_index
+        self.beat_sec = 60.0 / max(1.0, bpm)
+        self.step = self.beat_sec / GRID_STEPS.get(grid, 2)
+        self.line_gap = max(LINE_GAP_SEC, LINE_GAP_BEATS * self.beat_sec)
+        self.line_max = LINE_MAX_BEATS * self.beat_sec
+
+        # words / variety
+        self.words: List[str] = []
+        self.word_set: set = set()
+        # punctuation lines, for the no-timestamp on-beat proxy
+        self.text_lines = 0
+        self.text_line_words = 0
+
+        # timing
+        self.timed = False
+        self.on_words = 0                  # timed words inside the window
+        self.err_sum = 0.0
+        self.covered = 0.0
+        self.first_start: Optional[float] = None
+        self.prev_end: Optional[float] = None
+
+        # lines and rhyme
+        self.line: List[str] = []
+        self.line_keys: List[tuple] = []
+        self.line_start = 0.0
+        self.line_last_end = 0.0
+        self.ends: "collections.deque" = collections.deque(maxlen=2)
+        self.n_lines = 0
+        self.end_sum = 0.0
+        self.multi_sum = 0.0
+        self.internal_hits = 0
+        self.content_total = 0
+
+    # ----- feeding -----
+    def add(self, text: str, timed: Optional[List[TimedWord]] = None):
+        """One final chunk: its text and (word, start, end) in window seconds."""
+        toks = tokenize_words(text)
+        self.words.extend(toks)
+        self.word_set.update(toks)
+        self._add_text_lines(text, len(toks))
+        if timed:
+            self.timed = True
+            for w, start, end in timed:
+                self._add_timed(w.lower(), start, end)
+        else:
+            for w in toks:
+                self._push(w)
+                if len(self.line) >= LINE_FALLBACK_WORDS:
+                    self._close_line()
+
+    def _add_text_lines(self, text: str, n_words: int):
+        parts = split_lines_for_rap(text)
+        if self.text_lines == 0 and n_words:
+            self.text_lines = 1
+        # chunks join with spaces, so only punctuation inside a chunk starts a line
+        extra = max(0, len(parts) - 1)
+        self.text_lines += extra
+        self.text_line_words += n_words
+
+    def _add_timed(self, w: str, start: float, end: float):
+        if self.line and (start - self.line_last_end >= self.line_gap or start - self.line_start >= self.line_max):
+            self._close_line()
+        if not self.line:
+            self.line_start = start
+        self._push(w)
+        self.line_last_end = end
+
+        if start < 0.0 or start > self.window_sec:
+            return
+        end = min(end, self.window_sec)
+        self.on_words += 1
+        if self.first_start is None:
+            self.first_start = start
+        # onset distance to the nearest grid line, 0 (on the line) .. 1 (halfway between)
+        off = start % self.step
+        self.err_sum += min(off, self.step - off) / (self.step / 2.0)
+        self.covered += max(0.0, end - start)
+        if self.prev_end is not None and 0.0 < start - self.prev_end < self.beat_sec:
+            self.covered += start - self.prev_end
+        self.prev_end = end
+
+    def _push(self, w: str):
+        self.line.append(w)
+        self.line_keys.append(self.index.lookup(w))
+
+    def _close_line(self):
+        hits, content = _internal(self.line, self.line_keys)
+        self.internal_hits += hits
+        self.content_total += content
+        end = _line_end(self.line, self.line_keys)
+        if self.ends:
+            e, m = _end_score(end, self.ends)
+            self.end_sum += e
+            self.multi_sum += m
+        self.ends.append(end)
+        self.n_lines += 1
+        self.line = []
+        self.line_keys = []
+
+    # ----- scoring -----
+    def rhyme_scores(self) -> Dict[str, float]:
+        end_sum, multi_sum, n_lines = self.end_sum, self.multi_sum, self.n_lines
+        hits, content = self.internal_hits, self.content_total
+        if self.line:                      # the open line counts as if it closed now
+            h, c = _internal(self.line, self.line_keys)
+            hits += h
+            content += c
+            if self.ends:
+                e, m = _end_score(_line_end(self.line, self.line_keys), self.ends)
+                end_sum += e
+                multi_sum += m
+            n_lines += 1
+        pairs = max(1, n_lines - 1)
+        return {
+            "end": end_sum / pairs if n_lines >= 2 else 0.0,
+            "internal": clamp01(2.0 * hits / content) if content else 0.0,
+            "multi": multi_sum / pairs if n_lines >= 2 else 0.0,
+            "lines": n_lines,
+        }
+
+    def timing(self) -> Dict[str, float]:
+        if not self.on_words:
+            return {"wps": 0.0, "alignment": 0.0, "used": 0.0}
+        span = max(self.step, self.prev_end - self.first_start)
+        return {
+            "wps": self.on_words / span,
+            "alignment": 1.0 - self.err_sum / self.on_words,
+            "used": clamp01(self.covered / max(1e-6, self.window_sec)),
+        }
+
+    def result(self) -> Dict[str, Any]:
+        """The `judge` dict for `freestyle_final` (or a progress snapshot so far)."""
+        word_count = len(self.words)
+        uniq_ratio = (len(self.word_set) / word_count) if word_count else 0.0
+        rs = self.rhyme_scores()
+        rhyme = clamp01(rs["end"] * RHYME_END_W + rs["internal"] * RHYME_INTERNAL_W + rs["multi"] * RHYME_MULTI_W)
+
+        if self.timed and self.window_sec > 0:
+            t = self.timing()
+            # on-beat: onset alignment (rescaled so random timing ≈ 0) blended with
+            # how close the rate is to the target words-per-beat
+            target_wps = (self.bpm / 60.0) * WORDS_PER_BEAT_TARGET
+            rate = clamp01(1.0 - abs(t["wps"] - target_wps) / target_wps)
+            onbeat = clamp01(0.6 * clamp01((t["alignment"] - 0.5) / 0.5) + 0.4 * rate)
+            # completion: how much of the window they actually rapped through
+            completion = clamp01(t["used"] / WINDOW_USED_FULL)
+        else:
+            # no word timings: fall back to text structure
+            t = {"wps": 0.0, "alignment": 0.0, "used": 0.0}
+            avg_line_len = self.text_line_words / max(1, self.text_lines)
+            onbeat = clamp01((avg_line_len / 8.0))  # 8 words per line considered "on-beat" sweet spot
+            completion = clamp01(word_count / 24.0)  # 24+ words ≈ full credit for a short (2-bar) turn
+
+        total = (rhyme * RHYME_W) + (onbeat * ONBEAT_W) + (uniq_ratio * VARIETY_W) + (completion * COMPLETE_W)
+        total = clamp01(total)
+
+        return {
+            "rhyme": round(rhyme, 3),
+            "rhyme_end": round(rs["end"], 3),
+            "rhyme_internal": round(rs["internal"], 3),
+            "rhyme_multi": round(rs["multi"], 3),
+            "lines": rs["lines"],
+            "onbeat": round(onbeat, 3),
+            "variety": round(uniq_ratio, 3),
+            "complete": round(completion, 3),
+            "total": round(total, 3),
+            "rank": rank_from_total(total),
+            "wps": round(t["wps"], 2),
+            "alignment": round(t["alignment"], 3),
+            "window_used": round(t["used"], 3),
+        }
+
+def judge_freestyle(text: str, timed: List[TimedWord], window_sec: float,
+                    bpm: float, grid: str, index: Optional[RhymeIndex] = None) -> Dict[str, Any]:
+    """Judge a whole window at once (same scores as feeding FreestyleJudge chunk by chunk)."""
+    judge = FreestyleJudge(window_sec, bpm, grid, index)
+    judge.add(text, timed)
+    return judge.result()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""Concurrent-session load test for client-streamed audio.
+
+Each simulated game instance opens `ws://…/?audio=stream` and streams corpus
+files in real time as binary AUDIO_FRAME_HEADER frames (plus a second of
+silence after each clip), exactly as a remote client would. The session
+count ramps through --ramp; for each step it reports:
+
+  latency   end of a clip's audio → its `final` (ms, p50/p95; early
+            commits can land before the clip ends, so values may be < 0)
+  load      server decode load (≈ cores busy) at the end of the step
+  dropped   audio blocks the server's decoders lost to lag
+  rejected  sessions refused by admission control
+
+A step "keeps up" when nothing was dropped or rejected, every session's
+decode backlog stayed within --max-depth blocks and p95 latency is under
+--max-latency-ms. The largest such step is the host's real-time capacity.
+
+    python speech_server.py --client-audio --max-sessions 64 --stats-port 8799 &
+    python speech_loadtest.py corpus/ --ramp 1 2 4 8 16 32 --seconds 20
+"""
+import sys, json, asyncio, argparse
+from time import perf_counter
+from typing import Optional, Dict, Any, List
+
+import websockets
+
+import speech_server as ss
+from speech_bench import find_corpus, summarize
+
+FRAME_SEC = 0.1                    # client frame length (Godot sends ~100 ms chunks)
+TAIL_SEC = 1.0                     # silence after each clip so the command endpoints
+
+# =========================
+# One simulated client
+# =========================
+async def run_client(url: str, clips: List[bytes], seconds: float, offset: int) -> Dict[str, Any]:
+    """Stream clips round-robin for `seconds`; returns latencies and the server's session stats."""
+    out: Dict[str, Any] = {"latency_ms": [], "finals": 0, "clips": 0, "rejected": False, "stats": None}
+    try:
+        ws = await websockets.connect(url, max_size=None)
+    except (OSError, websockets.InvalidHandshake):
+        out["rejected"] = True
+        return out
+
+    spans: List[tuple] = []            # (start, end) of each clip's audio
+    finals: List[float] = []
+    stats_reply: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    async def reader():
+        async for msg in ws:
+            data = json.loads(msg)
+            typ = data.get("type")
+            if typ == "final":
+                finals.append(perf_counter())
+            elif typ == "stats" and not stats_reply.done():
+                stats_reply.set_result(data)
+
+    read_task = asyncio.ensure_future(reader())
+    frame_bytes = int(FRAME_SEC * ss.SAMPLE_RATE) * 2
+    silence = bytes(int(TAIL_SEC * ss.SAMPLE_RATE) * 2)
+    t0 = perf_counter()
+    sent_sec = 0.0
+    seq = 0
+    i = offset
+    try:
+        while sent_sec < seconds and not read_task.done():
+            pcm = clips[i % len(clips)]
+            i += 1
+            start = perf_counter()
+            for part, is_clip in ((pcm, True), (silence, False)):
+                for off in range(0, len(part), frame_bytes):
+                    chunk = part[off:off + frame_bytes]
+                    header = ss.AUDIO_FRAME_HEADER.pack(seq, t0 + sent_sec)
+                    await ws.send(header + chunk)
+                    seq += 1
+                    sent_sec += len(chunk) / (2.0 * ss.SAMPLE_RATE)
+                    delay = t0 + sent_sec - perf_counter()   # real-time pacing
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                if is_clip:
+                    spans.append((start, perf_counter()))
+        await ws.send(json.dumps({"type": "stats"}))
+        out["stats"] = await asyncio.wait_for(stats_reply, 5.0)
+    except (websockets.ConnectionClosed, asyncio.TimeoutError):
+        out["rejected"] = out["rejected"] or read_task.done()
+    finally:
+        read_task.cancel()
+        await ws.close()
+
+    # a final belongs to the clip whose audio (plus tail) was streaming when it came in
+    out["clips"] = len(spans)
+    out["finals"] = len(finals)
+    for f in finals:
+        for start, end in spans:
+            if start <= f < end + TAIL_SEC:
+                out["latency_ms"].append((f - end) * 1000.0)
+                break
+    return out
+
+# =========================
+# Ramp
+# =========================
+async def run_step(url: str, clips: List[bytes], n: int, seconds: float,
+                   max_depth: int, max_latency_ms: float) -> Dict[str, Any]:
+    results = await asyncio.gather(*(run_client(url, clips, seconds, k) for k in range(n)))
+    latency: List[float] = []
+    dropped = depth = 0
+    load = 0.0
+    rejected = 0
+    for r in results:
+        latency += r["latency_ms"]
+        if r["rejected"] or r["stats"] is None:
+            rejected += 1
+            continue
+        audio = r["stats"]["session"]["audio"]
+        if audio["max_depth"] > max_depth:
+            print(f"  session backlog {audio}", file=sys.stderr)
+        dropped += audio["dropped"]
+        depth = max(depth, audio["max_depth"])
+        load = max(load, float(r["stats"]["gauges"].get("decode_load", 0.0)))
+    lat = summarize(latency)
+    kept_up = (rejected == 0 and dropped == 0 and depth <= max_depth
+               and (lat["n"] == 0 or lat["p95"] <= max_latency_ms))
+    return {
+        "sessions": n,
+        "finals": sum(r["finals"] for r in results),
+        "clips": sum(r["clips"] for r in results),
+        "latency_ms": lat,
+        "load": round(load, 3),
+        "max_depth": depth,
+        "dropped": dropped,
+        "rejected": rejected,
+        "kept_up": kept_up,
+    }
+
+# =========================
+# CLI
+# =========================
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Ramp concurrent streaming sessions against speech_server --client-audio.")
+    ap.add_argument("corpus", nargs="+", help="16 kHz mono WAV / raw PCM files or directories")
+    ap.add_argument("--url", default=f"ws://localhost:{ss.PORT}", help="speech server websocket URL")
+    ap.add_argument("--ramp", type=int, nargs="+", default=[1, 2, 4, 8], metavar="N",
+                    help="concurrent session counts to try, in order")
+    ap.add_argument("--seconds", type=float, default=15.0, help="audio streamed per session per step")
+    ap.add_argument("--max-depth", type=int, default=3, help="decode backlog (blocks) still counted as real time")
+    ap.add_argument("--max-latency-ms", type=float, default=900.0, help="p95 latency still counted as real time")
+    ap.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = ap.parse_args(argv)
+
+    files = find_corpus(args.corpus)
+    if not files:
+        print("No audio files found in corpus.", file=sys.stderr)
+        return 2
+    clips = [b"".join(ss.pcm_blocks(f)) for f in files]
+    url = args.url.rstrip("/") + "/?audio=stream"
+
+    steps = []
+    for n in args.ramp:
+        step = asyncio.run(run_step(url, clips, n, args.seconds, args.max_depth, args.max_latency_ms))
+        steps.append(step)
+        if not args.json:
+            print(f"[{n:3d} sessions] {'ok  ' if step['kept_up'] else 'FAIL'} load={step['load']} "
+                  f"depth={step['max_depth']} dropped={step['dropped']} rejected={step['rejected']} "
+                  f"finals={step['finals']}/{step['clips']} latency ms {step['latency_ms']}")
+    capacity = max((s["sessions"] for s in steps if s["kept_up"]), default=0)
+    if args.json:
+        print(json.dumps({"steps": steps, "capacity": capacity}, indent=2))
+    else:
+        print(f"real-time capacity: {capacity} sessions")
+    return 0 if capacity else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
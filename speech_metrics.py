@@ -0,0 +1,159 @@
+"""Counters, histograms and per-utterance traces for speech_server.
+
+Everything is in-process and constant-size: histograms use fixed log-spaced
+buckets, so recording is O(1) and the decode thread never allocates. The
+server exposes snapshot() over the `stats` websocket request and, when
+--stats-port is given, render_text() / snapshot() over local HTTP.
+"""
+import math, threading
+from collections import defaultdict
+from time import monotonic
+from typing import Dict, Any, Optional, List, Callable
+
+# bucket upper bounds: 0.05 .. ~100k, two per octave
+_BOUNDS = [0.05 * (2 ** (i / 2.0)) for i in range(43)]
+
+class Histogram:
+    """Fixed-bucket histogram; percentiles are bucket upper bounds (≤ 41% high)."""
+
+    __slots__ = ("counts", "n", "total", "lo", "hi")
+
+    def __init__(self):
+        self.counts = [0] * (len(_BOUNDS) + 1)
+        self.n = 0
+        self.total = 0.0
+        self.lo = math.inf
+        self.hi = -math.inf
+
+    def observe(self, v: float):
+        v = max(0.0, v)
+        if v <= _BOUNDS[0]:
+            i = 0
+        else:
+            i = min(len(_BOUNDS), int(math.ceil(2.0 * math.log2(v / _BOUNDS[0]) - 1e-9)))
+        self.counts[i] += 1
+        self.n += 1
+        self.total += v
+        self.lo = min(self.lo, v)
+        self.hi = max(self.hi, v)
+
+    def percentile(self, p: float) -> float:
+        if not self.n:
+            return 0.0
+        rank = max(1, math.ceil(p / 100.0 * self.n))
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return min(self.hi, _BOUNDS[i]) if i < len(_BOUNDS) else self.hi
+        return self.hi
+
+    def snapshot(self) -> Dict[str, float]:
+        if not self.n:
+            return {"n": 0}
+        return {
+            "n": self.n,
+            "mean": round(self.total / self.n, 3),
+            "min": round(self.lo, 3),
+            "p50": round(self.percentile(50), 3),
+            "p95": round(self.percentile(95), 3),
+            "p99": round(self.percentile(99), 3),
+            "max": round(self.hi, 3),
+        }
+
+class Metrics:
+    """Named counters, histograms and gauges (callables read at snapshot time)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, float] = defaultdict(float)
+        self.hists: Dict[str, Histogram] = defaultdict(Histogram)
+        self.gauges: Dict[str, Callable[[], Any]] = {}
+        self.started = monotonic()
+
+    def inc(self, name: str, n: float = 1):
+        with self._lock:
+            self.counters[name] += n
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            self.hists[name].observe(value)
+
+    def gauge(self, name: str, fn: Callable[[], Any]):
+        self.gauges[name] = fn
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = {k: (int(v) if float(v).is_integer() else round(v, 3)) for k, v in sorted(self.counters.items())}
+            hists = {k: h.snapshot() for k, h in sorted(self.hists.items())}
+        gauges = {}
+        for k, fn in sorted(self.gauges.items()):
+            try:
+                gauges[k] = fn()
+            except Exception as e:  # a gauge must never break stats
+                gauges[k] = f"error: {e}"
+        return {"uptime_sec": round(monotonic() - self.started, 1),
+                "counters": counters, "histograms": hists, "gauges": gauges}
+
+    def render_text(self) -> str:
+        """Prometheus-style text: one `speech_<name> value` line per sample."""
+        snap = self.snapshot()
+        lines: List[str] = [f"speech_uptime_sec {snap['uptime_sec']}"]
+        for k, v in snap["counters"].items():
+            lines.append(f"speech_{k}_total {v}")
+        for k, h in snap["histograms"].items():
+            lines.append(f"speech_{k}_count {h['n']}")
+            for q in ("p50", "p95", "p99", "max"):
+                if q in h:
+                    lines.append(f'speech_{k}{{quantile="{q}"}} {h[q]}')
+        for k, v in snap["gauges"].items():
+            if isinstance(v, (int, float)):
+                lines.append(f"speech_{k} {v}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+# =========================
+# Utterance traces
+# =========================
+class UtteranceTrace:
+    """Timestamps (session clock, seconds) of one utterance through the pipeline:
+    voiced (first speech block) → last_voiced → endpoint (final decided) →
+    decoded (result parsed) → sent (websocket write done) → ack (client echo).
+    `early`: sent from a partial before the endpoint (command early commit)."""
+
+    __slots__ = ("id", "mode", "voiced", "last_voiced", "endpoint", "decoded", "sent", "ack", "early")
+
+    def __init__(self, uid: int, mode: str, voiced: float):
+        self.id = uid
+        self.mode = mode
+        self.voiced = voiced
+        self.last_voiced = voiced
+        self.endpoint: Optional[float] = None
+        self.decoded: Optional[float] = None
+        self.sent: Optional[float] = None
+        self.ack: Optional[float] = None
+        self.early = False
+
+    def stages_ms(self) -> Dict[str, float]:
+        """Stage durations in ms for whatever has been recorded so far."""
+        out: Dict[str, float] = {}
+        def span(name, a, b):
+            if a is not None and b is not None:
+                out[name] = round(max(0.0, b - a) * 1000.0, 3)
+        span("speech_ms", self.voiced, self.last_voiced)
+        span("endpoint_ms", self.last_voiced, self.endpoint)
+        span("decode_ms", self.endpoint, self.decoded)
+        span("send_ms", self.decoded, self.sent)
+        span("ack_ms", self.sent, self.ack)
+        span("total_ms", self.last_voiced, self.sent)
+        return out
+
+    def prefix(self) -> str:
+        """Histogram name prefix: `<mode>`, or `<mode>_early` for an early commit."""
+        return f"{self.mode}_early" if self.early else self.mode
+
+    def record(self, m: Metrics = metrics):
+        """Push the stage durations into `m` as `<prefix>_<stage>` histograms."""
+        for stage, ms in self.stages_ms().items():
+            m.observe(f"{self.prefix()}_{stage}", ms)
@@ -0,0 +1,118 @@
+"""Downmix + polyphase resampling from a device's native format to 16 kHz.
+
+Lets speech_server open the mic at whatever the device runs natively (often
+48 kHz / 44.1 kHz stereo) instead of making the host API convert, which adds
+latency and on some drivers fails to open the stream at all.
+
+The rate ratio is reduced to L/M (48000→16000 is 1/3, 44100→16000 is
+160/441). With a fixed input block of N frames (N a multiple of M) every
+call produces the same number of outputs in the same phase pattern, so the
+tap index and coefficient matrices are built once and a block is: downmix
+into the work buffer, one gather, one multiply, one row-sum, round, clip.
+All buffers are preallocated; process() doesn't allocate.
+"""
+import math
+import numpy as np
+from typing import Optional
+
+FILTER_SPAN = 16                   # filter length in periods of the lower rate; more = sharper anti-alias, more CPU
+CUTOFF = 0.90                      # passband edge as a fraction of the lower Nyquist
+KAISER_BETA = 8.0
+
+def lowpass(n_taps: int, cutoff: float, beta: float = KAISER_BETA) -> np.ndarray:
+    """Kaiser-windowed sinc; cutoff in cycles/sample (0..0.5), unity DC gain."""
+    t = np.arange(n_taps) - (n_taps - 1) / 2.0
+    h = 2.0 * cutoff * np.sinc(2.0 * cutoff * t) * np.kaiser(n_taps, beta)
+    return h / h.sum()
+
+class Resampler:
+    """int16 interleaved (in_rate, channels) blocks → int16 mono out_rate blocks.
+
+    in_frames is the fixed input block size; out_frames the resulting output
+    size. Use block_for() to pick in_frames for a wanted output block.
+    """
+
+    def __init__(self, in_rate: int, out_rate: int, channels: int, in_frames: int,
+                 span: int = FILTER_SPAN):
+        g = math.gcd(in_rate, out_rate)
+        self.up, self.down = out_rate // g, in_rate // g
+        if in_frames % self.down:
+            raise ValueError(f"in_frames {in_frames} not a multiple of {self.down} ({in_rate}→{out_rate} Hz)")
+        self.in_rate, self.out_rate = in_rate, out_rate
+        self.channels = channels
+        self.in_frames = in_frames
+        self.out_frames = in_frames * self.up // self.down
+        self.passthrough = self.up == self.down
+
+        L, M = self.up, self.down
+        # taps per output sample (filter length / L), each phase reads T inputs
+        T = -(-span * max(L, M) // L) if not self.passthrough else 1
+        self.taps = T
+        if not self.passthrough:
+            # filter runs at the upsampled rate in_rate*L; cut at the lower Nyquist
+            h = lowpass(T * L, CUTOFF * 0.5 / max(L, M)) * L
+            # output r (per block) reads input j = floor(r*M/L) - k with tap (r*M % L) + k*L
+            r = np.arange(self.out_frames)
+            base = (r * M) // L + (T - 1)          # + history kept in front of the block
+            phase = (r * M) % L
+            k = np.arange(T)
+            self.idx = (base[:, None] - k[None, :]).astype(np.intp)
+            self.coef = h[phase[:, None] + k[None, :] * L].astype(np.float32)
+            self.delay_sec = (T * L - 1) / 2.0 / (in_rate * L)
+        else:
+            self.delay_sec = 0.0
+
+        # work buffers
+        self.buf = np.zeros(T - 1 + in_frames, dtype=np.float32)     # history + downmixed block
+        self.gather = np.zeros((self.out_frames, T), dtype=np.float32)
+        self.acc = np.zeros(self.out_frames, dtype=np.float32)
+        self.out = np.zeros(self.out_frames, dtype=np.int16)
+        self._mix = np.zeros(in_frames, dtype=np.float32)
+
+    @staticmethod
+    def block_for(in_rate: int, out_rate: int, out_frames: int) -> Optional[int]:
+        """Input frames that yield exactly out_frames outputs per block, or None."""
+        g = math.gcd(in_rate, out_rate)
+        up, down = out_rate // g, in_rate // g
+        if out_frames % up:
+            return None
+        return out_frames // up * down
+
+    def process(self, block) -> np.ndarray:
+        """Resample one in_frames block (bytes or int16 array); returns the shared
+        output array, valid until the next call."""
+        x = np.frombuffer(block, dtype=np.int16)
+        if len(x) != self.in_frames * self.channels:
+            raise ValueError(f"expected {self.in_frames}x{self.channels} samples, got {len(x)}")
+        T = self.taps
+        new = self.buf[T - 1:]
+        if self.channels == 1:
+            new[:] = x
+        else:
+            np.sum(x.reshape(self.in_frames, self.channels), axis=1, dtype=np.float32, out=self._mix)
+            np.multiply(self._mix, 1.0 / self.channels, out=new)
+
+        if self.passthrough:
+            y = new
+        else:
+            np.take(self.buf, self.idx, out=self.gather)
+            np.multiply(self.gather, self.coef, out=self.gather)
+            np.sum(self.gather, axis=1, out=self.acc)
+            y = self.acc
+            if T > 1:
+                self.buf[:T - 1] = self.buf[-(T - 1):]
+
+        np.rint(y, out=self.acc)
+        np.clip(self.acc, -32768.0, 32767.0, out=self.acc)
+        self.out[:] = self.acc
+        return self.out
+
+    def stats(self) -> dict:
+        return {
+            "in_rate": self.in_rate,
+            "channels": self.channels,
+            "ratio": f"{self.up}/{self.down}",
+            "in_frames": self.in_frames,
+            "taps": self.taps,
+            "delay_ms": round(self.delay_sec * 1000.0, 2),
+        }
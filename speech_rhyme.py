@@ -0,0 +1,326 @@
+"""Phonetic rhyme keys for the freestyle judge.
+
+Every word maps to
+  rime   hash of the phones from its last stressed vowel to the end ("EY T")
+  tail   its last (up to 4) vowels, 4 bits each, last vowel in the low nibble
+  nsyl   vowel count
+
+Pronunciations come from a CMUdict/Kaldi-style lexicon when one is found
+(the small en-us model ships without one; drop `lexicon.txt` or `db/en.dic`
+into the model dir, or point SPEECH_RHYME_LEXICON at a file). The lexicon is
+compiled once into an open-addressing hash table on disk and memory-mapped on
+later runs, so startup stays cheap and each lookup is a couple of probes.
+Words not in the index get keys from spelling rules, memoized per process.
+"""
+import os, re, hashlib, logging
+from typing import Optional, List, Tuple, Dict
+import numpy as np
+
+log = logging.getLogger("speech")
+
+INDEX_VERSION = 1
+_MAGIC = b"RHYMEIDX"
+_HEADER = np.dtype([("magic", "S8"), ("version", "<u4"), ("slots", "<u4"), ("words", "<u4"),
+                    ("pad", "<u4"), ("signature", "<u8")])
+_SLOT = np.dtype([("h", "<u8"), ("rime", "<u4"), ("tail", "<u2"), ("nsyl", "<u2")])
+
+LEXICON_CANDIDATES = ["lexicon.txt", os.path.join("db", "en.dic"), os.path.join("graph", "lexicon.txt")]
+
+VOWELS = ["AA", "AE", "AH", "AO", "AW", "AY", "EH", "ER", "EY", "IH", "IY", "OW", "OY", "UH", "UW"]
+_VOWEL_CODE = {v: i + 1 for i, v in enumerate(VOWELS)}     # 0 = no vowel
+TAIL_MAX = 4
+
+# (rime, tail, nsyl)
+RhymeKey = Tuple[int, int, int]
+
+def word_hash(word: str) -> int:
+    """Stable 64-bit hash (never 0: 0 marks an empty slot)."""
+    return int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little") | 1
+
+def rime_hash(phones: List[str]) -> int:
+    return int.from_bytes(hashlib.blake2b(" ".join(phones).encode("ascii"), digest_size=4).digest(), "little")
+
+def key_from_phones(phones: List[str], stress: Optional[List[int]] = None) -> RhymeKey:
+    """Rhyme key from stress-stripped phones. `stress` holds the vowel
+    indices carrying stress; without it the last vowel is used."""
+    vidx = [i for i, p in enumerate(phones) if p in _VOWEL_CODE]
+    if not vidx:
+        return rime_hash(phones[-2:]), 0, 0
+    start = vidx[-1]
+    if stress:
+        start = stress[-1]
+    tail = 0
+    for shift, i in enumerate(reversed(vidx[-TAIL_MAX:])):
+        tail |= _VOWEL_CODE[phones[i]] << (4 * shift)
+    return rime_hash(phones[start:]), tail, len(vidx)
+
+def parse_pron(tokens: List[str]) -> RhymeKey:
+    """Lexicon phones (CMU 'EY1', Kaldi 'EY1_E' both accepted) → rhyme key."""
+    phones: List[str] = []
+    stress: List[int] = []
+    for t in tokens:
+        t = t.split("_", 1)[0].upper()
+        base = t.rstrip("012")
+        if base in _VOWEL_CODE and t[-1:] in ("1", "2"):
+            stress.append(len(phones))
+        phones.append(base)
+    return key_from_phones(phones, stress)
+
+def tail_vowels(tail: int) -> List[int]:
+    """Unpack a tail into vowel codes, last vowel first."""
+    out = []
+    while tail:
+        out.append(tail & 0xF)
+        tail >>= 4
+    return out
+
+# =========================
+# Spelling fallback
+# =========================
+# ordered: longest patterns first. (spelling, phones)
+_VOWEL_RULES = [
+    ("eigh", ["EY"]), ("augh", ["AO"]), ("ough", ["AO"]), ("igh", ["AY"]),
+    ("are", ["EH", "R"]), ("ire", ["AY", "ER"]), ("ore", ["AO", "R"]), ("ure", ["UH", "R"]),
+    ("ear", ["IH", "R"]), ("eer", ["IH", "R"]), ("ere", ["IH", "R"]), ("air", ["EH", "R"]), ("our", ["AW", "ER"]),
+    ("ar", ["AA", "R"]), ("or", ["AO", "R"]), ("er", ["ER"]), ("ir", ["ER"]), ("ur", ["ER"]),
+    ("ai", ["EY"]), ("ay", ["EY"]), ("ei", ["EY"]), ("ey", ["EY"]),
+    ("ee", ["IY"]), ("ea", ["IY"]), ("ie", ["IY"]),
+    ("oa", ["OW"]), ("oe", ["OW"]), ("oo", ["UW"]), ("ou", ["AW"]), ("ow", ["OW"]),
+    ("oi", ["OY"]), ("oy", ["OY"]), ("au", ["AO"]), ("aw", ["AO"]),
+    ("ew", ["UW"]), ("ue", ["UW"]), ("ui", ["UW"]),
+]
+_SHORT = {"a": "AE", "e": "EH", "i": "IH", "o": "AA", "u": "AH", "y": "IH"}
+_LONG  = {"a": "EY", "e": "IY", "i": "AY", "o": "OW", "u": "UW", "y": "AY"}
+_CONS_RULES = [
+    ("tch", ["CH"]), ("ck", ["K"]), ("ch", ["CH"]), ("sh", ["SH"]), ("th", ["TH"]),
+    ("ph", ["F"]), ("ng", ["NG"]), ("gh", []), ("wh", ["W"]), ("qu", ["K", "W"]),
+    ("x", ["K", "S"]), ("c", ["K"]), ("q", ["K"]), ("j", ["JH"]),
+]
+_OW_AW = {"now", "how", "cow", "wow", "vow", "pow", "bow", "allow", "down", "town", "brown",
+          "clown", "crown", "gown", "drown", "frown", "crowd", "loud", "proud"}
+_RE_LETTERS = re.compile(r"[^a-z]")
+
+def _spell_stem(w: str) -> List[str]:
+    silent_e = (len(w) >= 3 and w.endswith("e") and w[-2] not in "aeiouy"
+                and any(c in "aeiouy" for c in w[:-2]))
+    if silent_e and w[-2] == "r" and w[-3] in "aeiou":
+        silent_e = False                     # care / fire / more / cure have their own rules
+    if silent_e and w.endswith("le") and w[-3] not in "aeiouy":
+        silent_e = False                     # handled below as "AH L"
+    magic = silent_e and w[-3] in "aeiouy" and (len(w) < 4 or w[-4] not in "aeiouy")
+    if silent_e:
+        w = w[:-1]
+    phones: List[str] = []
+    i, n = 0, len(w)
+    while i < n:
+        for pat, ph in _VOWEL_RULES:
+            if not w.startswith(pat, i):
+                continue
+            nxt = w[i + len(pat):i + len(pat) + 1]
+            if pat.endswith("r") and len(pat) == 2 and nxt and nxt in "raeiouy":
+                continue                     # carry / hero: not r-coloured
+            if pat == "ow" and w in _OW_AW:
+                ph = ["AW"]
+            if pat == "ie" and i + 2 == n and n <= 4:
+                ph = ["AY"]                  # die, lie, tie
+            if pat == "ey" and i + 2 == n and any(p in _VOWEL_CODE for p in phones):
+                ph = ["IY"]                  # money, honey
+            phones.extend(ph)
+            i += len(pat)
+            break
+        else:
+            ch = w[i]
+            if ch in _SHORT and not (ch == "y" and i == 0):
+                if ch == "y" and i == n - 1:
+                    phones.append("IY" if any(p in _VOWEL_CODE for p in phones) else "AY")
+                elif magic and i == n - 2:
+                    phones.append(_LONG[ch])
+                elif ch in "eo" and i == n - 1 and n <= 3:
+                    phones.append("IY" if ch == "e" else "OW")   # me, we, go, so
+                else:
+                    phones.append(_SHORT[ch])
+                i += 1
+                continue
+            if ch == "c" and w[i + 1:i + 2] in ("e", "i", "y") or (ch == "c" and silent_e and i == n - 1):
+                phones.append("S")           # soft c: dance, city
+                i += 1
+                continue
+            for pat, ph in _CONS_RULES:
+                if w.startswith(pat, i):
+                    phones.extend(ph)
+                    i += len(pat)
+                    break
+            else:
+                up = "Y" if ch == "y" else ch.upper()
+                if not phones or phones[-1] != up:
+                    phones.append(up)
+                i += 1
+    if w.endswith("le") and len(w) > 2 and w[-3] not in "aeiouy":
+        phones[-2:] = ["AH", "L"]
+    return phones
+
+def spell_phones(word: str) -> Tuple[List[str], Optional[List[int]]]:
+    """Rough letter-to-sound for out-of-lexicon words. Only the end of the
+    word matters for rhyme, so this aims at vowels and codas, not onsets."""
+    w = _RE_LETTERS.sub("", word.lower())
+    if not w:
+        return [], None
+    suffix: List[str] = []
+    if len(w) > 3 and w.endswith("s") and not w.endswith(("ss", "us", "is")):
+        w = w[:-1]
+        if w.endswith(("se", "ze", "ce", "ge", "che", "she", "xe")) or w.endswith(("x", "ch", "sh")):
+            suffix = ["IH", "Z"]
+        else:
+            suffix = ["Z"]
+        if w.endswith("ie") and len(w) > 3:
+            w = w[:-2] + "y"                 # cries → cry
+    elif len(w) > 4 and w.endswith("ing"):
+        w = w[:-3]
+        suffix = ["IH", "NG"]
+    elif len(w) > 4 and w.endswith("ed"):
+        w = w[:-2]
+        suffix = ["IH", "D"] if w.endswith(("t", "d")) else ["D"]
+        if w.endswith("i"):
+            w = w[:-1] + "y"                 # cried → cry
+    phones = _spell_stem(w)
+    if suffix == ["Z"] and phones and phones[-1] in ("S", "Z"):
+        suffix = []
+    phones += suffix
+
+    # unstressed endings: the rhyme starts on the vowel before them (flowing / going)
+    vidx = [k for k, p in enumerate(phones) if p in _VOWEL_CODE]
+    stress = None
+    if len(vidx) >= 2 and (suffix[:1] == ["IH"] or w.endswith(("er", "ire", "our", "y", "le", "en", "on", "in", "ie"))):
+        stress = [vidx[-2]]
+    return phones, stress
+
+# =========================
+# Index
+# =========================
+class RhymeIndex:
+    """word → RhymeKey, backed by a memory-mapped hash table when a lexicon is available."""
+
+    def __init__(self):
+        self.slots: Optional[np.ndarray] = None
+        self.mask = 0
+        self.source: Optional[str] = None
+        self._memo: Dict[str, RhymeKey] = {}
+
+    # ----- build / load -----
+    @staticmethod
+    def find_lexicon(model_dir: Optional[str]) -> Optional[str]:
+        env = os.environ.get("SPEECH_RHYME_LEXICON")
+        if env and os.path.exists(env):
+            return env
+        if model_dir:
+            for rel in LEXICON_CANDIDATES:
+                p = os.path.join(model_dir, rel)
+                if os.path.exists(p):
+                    return p
+        return None
+
+    @staticmethod
+    def signature(lexicon: str) -> int:
+        st = os.stat(lexicon)
+        raw = f"{INDEX_VERSION}|{os.path.abspath(lexicon)}|{st.st_size}|{st.st_mtime_ns}"
+        return word_hash(raw)
+
+    def load(self, model_dir: Optional[str], cache_path: str) -> str:
+        """Map the cached index, rebuilding it if the lexicon changed.
+        Returns "mapped", "built" or "spelling" (no lexicon found)."""
+        lexicon = self.find_lexicon(model_dir)
+        self._memo.clear()
+        if lexicon is None:
+            self.slots, self.mask, self.source = None, 0, None
+            return "spelling"
+        sig = self.signature(lexicon)
+        how = "mapped"
+        if not self._map(cache_path, sig):
+            self.build(lexicon, cache_path, sig)
+            how = "built"
+            if not self._map(cache_path, sig):
+                raise RuntimeError(f"rhyme index {cache_path} unreadable after build")
+        self.source = lexicon
+        return how
+
+    def _map(self, path: str, sig: int) -> bool:
+        try:
+            hdr = np.fromfile(path, dtype=_HEADER, count=1)
+        except (OSError, ValueError):
+            return False
+        if (len(hdr) != 1 or hdr["magic"][0] != _MAGIC or int(hdr["version"][0]) != INDEX_VERSION
+                or int(hdr["signature"][0]) != sig):
+            return False
+        n = int(hdr["slots"][0])
+        try:
+            self.slots = np.memmap(path, dtype=_SLOT, mode="r", offset=_HEADER.itemsize, shape=(n,))
+        except (OSError, ValueError):
+            return False
+        self.mask = n - 1
+        return True
+
+    @staticmethod
+    def build(lexicon: str, cache_path: str, sig: int) -> int:
+        """Compile the lexicon into the on-disk table (first pronunciation per word)."""
+        entries: Dict[str, RhymeKey] = {}
+        with open(lexicon, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if not line.strip() or line.startswith(";;;"):
+                    continue
+                parts = line.split()
+                word = re.sub(r"\(\d+\)$", "", parts[0]).lower()
+                prons = [p for p in parts[1:] if not re.match(r"^-?\d+(\.\d+)?$", p)]   # Kaldi lexiconp probs
+                if word in entries or not prons or word.startswith(("<", "[", "!")):
+                    continue
+                entries[word] = parse_pron(prons)
+
+        n = 1
+        while n < 2 * max(1, len(entries)):
+            n <<= 1
+        slots = np.zeros(n, dtype=_SLOT)
+        mask = n - 1
+        for word, (rime, tail, nsyl) in entries.items():
+            h = word_hash(word)
+            i = h & mask
+            while slots["h"][i]:
+                i = (i + 1) & mask
+            slots[i] = (h, rime, tail, min(nsyl, 0xFFFF))
+
+        hdr = np.zeros(1, dtype=_HEADER)
+        hdr[0] = (_MAGIC, INDEX_VERSION, n, len(entries), 0, sig)
+        tmp = cache_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(hdr.tobytes())
+            f.write(slots.tobytes())
+        os.replace(tmp, cache_path)
+        log.info("🎼 Rhyme index built: %d words from %s", len(entries), lexicon)
+        return len(entries)
+
+    # ----- lookup -----
+    def lookup(self, word: str) -> RhymeKey:
+        key = self._memo.get(word)
+        if key is not None:
+            return key
+        key = self._probe(word)
+        if key is None:
+            phones, stress = spell_phones(word)
+            key = key_from_phones(phones, stress) if phones else (0, 0, 0)
+        if len(self._memo) < 50_000:
+            self._memo[word] = key
+        return key
+
+    def _probe(self, word: str) -> Optional[RhymeKey]:
+        if self.slots is None:
+            return None
+        h = word_hash(word)
+        i = h & self.mask
+        while True:
+            s = self.slots[i]
+            sh = int(s["h"])
+            if sh == 0:
+                return None
+            if sh == h:
+                return int(s["rime"]), int(s["tail"]), int(s["nsyl"])
+            i = (i + 1) & self.mask
+
+rhyme_index = RhymeIndex()
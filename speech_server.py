@@ -1,11 +1,23 @@
 #!/usr/bin/env python3
-import os, sys, json, asyncio, re, math, collections
+import os, sys, json, asyncio, re, math, bisect, hashlib, collections, threading, queue, concurrent.futures, wave, argparse, time, logging, secrets, struct
+from urllib.parse import urlsplit, parse_qs
+from abc import ABC, abstractmethod
+from time import monotonic, perf_counter
+_T_SCRIPT = perf_counter()          # startup phase timing starts here
+_WALL_SCRIPT = time.time()
 import websockets
-import sounddevice as sd
-import audioop  # NOTE: deprecated in Py3.13+, fine for now
+try:
+    import sounddevice as sd
+except (ImportError, OSError):  # no PortAudio (headless box): only file/stdin input is available
+    sd = None
 from vosk import Model, KaldiRecognizer
-from time import monotonic
-from typing import Optional, Dict, Any, List
+from speech_vad import FrameVAD
+from speech_resample import Resampler
+from speech_judge import FreestyleJudge
+from speech_rhyme import rhyme_index
+from speech_metrics import metrics, UtteranceTrace
+from typing import Optional, Dict, Any, List, Iterator
+_T_IMPORTED = perf_counter()
 
 # =========================
 # Config
@@ -15,60 +27,311 @@ PORT = 8765
 
 SAMPLE_RATE = 16000
 BLOCKSIZE   = 3200                 # ~0.2s frames (more responsive)
-SILENCE_RMS = 1100                 # tweak 900–1500 depending on room noise
-END_SILENCE_SEC = 0.6              # quiet duration that forces a final (seg boundary)
+BLOCK_SEC   = BLOCKSIZE / SAMPLE_RATE
+
+INPUT_DEVICE: Optional[Any] = None  # sounddevice index or name substring; None = system default input
+CAPTURE_NATIVE = True              # open the mic at its own rate/channels and resample to 16 kHz mono here
+CAPTURE_MAX_CHANNELS = 2           # channels opened (and averaged) on multi-channel devices
+
+# client-streamed audio (?audio=stream, or every client with --client-audio): binary
+# frames of this header (uint32 seq, float64 client capture time of the first sample, s)
+# followed by s16le 16 kHz mono PCM of any length
+AUDIO_FRAME_HEADER = struct.Struct("<Id")
+CLIENT_AUDIO_ONLY = False          # no mic at all; every client streams its own audio
+AUDIO_GAP_FILL_SEC = 1.0           # lost frames up to this long are replaced with silence to keep timing
+
+# Voice activity detection (speech_vad.FrameVAD)
+VAD_FRAME_MS      = 20
+VAD_THRESHOLD_DB  = 10.0           # speech = this far above the tracked noise floor; raise in noisy rooms
+VAD_MIN_SPEECH_DB = 50.0           # ...and louder than this in absolute terms (~rms 300)
+VAD_HANGOVER_MS   = 120            # short gaps inside words still count as speech
+ENDPOINT_SILENCE_SEC = 0.25        # command mode: trailing silence that forces a final
+END_SILENCE_SEC      = 0.6         # freestyle: quiet duration that forces a segment boundary
+WINDOW_TIMER_SLACK_SEC = BLOCK_SEC + 0.1  # listen window: timer closes it this long after the deadline if audio hasn't
+VAD_FEED_SILENCE_SEC = 0.8         # after speech, keep feeding Kaldi this long, then skip silent blocks
+VAD_PREROLL_BLOCKS   = 1           # silent blocks replayed to Kaldi when speech starts, so onsets aren't clipped
+
+PARTIAL_MIN_INTERVAL_SEC = 0.25    # throttle for subscribed `partial` messages
+FREESTYLE_PROGRESS_SEC = 0.5       # throttle for `freestyle_progress` (live judge) messages; 0 = off
+CONCURRENT_COMMANDS = True         # freestyle windows keep decoding commands on a second thread
+EARLY_COMMIT_BLOCKS = 2            # command mode: send `final` once the partial names one phrase for this many blocks (0 = off)
 
 MIN_GAP_BETWEEN_FINALS = 1.5       # debounce same-final repeats from Vosk (s)
 SERVER_COOLDOWN        = 1.2       # prevent rapid-fire commands (s)
 
+GRAMMAR_CACHE_MAX = 8              # idle compiled command recognizers kept for set_grammar (LRU)
+GRAMMAR_MAX_PHRASES = 200          # cap on an ad-hoc `set_grammar` phrase list
+
+POOL_WARM = 2                      # recognizer pairs kept pre-built and idle (default-language model)
+POOL_MAX  = 4                      # cap on concurrent sessions (recognizer pairs, all languages together)
+
+# language models under vosk_models/ (vosk-model[-small]-<lang>-…); only the default loads at startup
+MODEL_DEFAULT_LANG = "en"          # also serves languages that have no model of their own (PHONETIC_COMMANDS)
+MODEL_LAZY_WARM = 1                # recognizer pairs pre-built when another language's model loads
+MODEL_RSS_BUDGET_MB = 1536.0       # evict idle language models (LRU) so a load keeps process RSS under this; 0 = no cap
+MODEL_LANG_ALIASES = {"nb": "no", "nn": "no", "sme": "se"}
+
+# admission / per-session decode budget; load = decode wall time / audio time (≈ cores busy)
+ADMIT_LOAD_FRACTION = 0.85         # admit new sessions while total load stays under this share of the cores
+ADMIT_SESSION_LOAD  = 0.15         # load assumed for a new session until the live ones say otherwise
+SESSION_LOAD_BUDGET = 0.5          # above this a session sheds partials and the mid-freestyle command lane
+SESSION_LOAD_EWMA   = 0.05         # smoothing per block (~4s to settle)
+
+MODEL_WARMUP_SEC = 1.0             # synthetic silence pushed through each warm pair after load (0 = off)
+
+RING_SLOTS = 32                    # audio blocks held for subscribers to catch up (~6.4s)
+
 UNMATCHED_LOG = os.path.join(os.path.dirname(__file__), "unmatched_phrases.txt")
+UNMATCHED_AGG = os.path.join(os.path.dirname(__file__), "unmatched_phrases.json")  # phrase → count/first/last
+UNMATCHED_KEEP_RAW     = True      # also append raw lines to UNMATCHED_LOG
+UNMATCHED_FLUSH_SEC    = 5.0       # background writer flush interval
+UNMATCHED_FLUSH_LINES  = 200       # ...or flush as soon as this many lines are pending
+UNMATCHED_MAX_BYTES    = 1_000_000 # rotate UNMATCHED_LOG past this size
+UNMATCHED_BACKUPS      = 3         # rotated copies kept: .1 (newest) … .N
+
+# compiled lexicon → rhyme-key table, memory-mapped on later runs (next to the exe when frozen)
+RHYME_CACHE = os.path.join(os.path.dirname(sys.executable if getattr(sys, "frozen", False) else __file__),
+                           "rhyme_index.bin")
+
+STATS_PORT: Optional[int] = None    # local HTTP stats endpoint (/stats JSON, /metrics text); None = off
+TRACE_INFLIGHT_MAX = 32            # sent messages remembered per session for client acks
+
+RESUME_GRACE_SEC = 10.0            # a dropped client may reattach (?resume=<token>) to its live session this long; 0 = off
+OUTBOX_DETACHED_MAX = 64           # reliable messages held for a detached session (oldest dropped past this)
+OUTBOX_FINAL_TTL_SEC = 1.0         # a command final still held this long at resume is dropped, not acted on late
+
+LOG_RATE_PER_SEC = 5.0             # console lines per message template per second
+
+# =========================
+# Logging
+# - leveled + rate-limited: console writes are a real cost on Windows terminals
+# - frozen build is quiet (WARNING) unless SPEECH_LOG_LEVEL / --log-level says otherwise
+# =========================
+log = logging.getLogger("speech")
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per message template, so a hot-path line can't flood the
+    console. The number of dropped lines is appended to the next one let through."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst if burst is not None else rate * 2
+        self._buckets: Dict[Any, list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        now = monotonic()
+        with self._lock:
+            b = self._buckets.get(record.msg)
+            if b is None:
+                b = self._buckets[record.msg] = [self.burst, now, 0]   # tokens, last, dropped
+            b[0] = min(self.burst, b[0] + (now - b[1]) * self.rate)
+            b[1] = now
+            if b[0] < 1.0:
+                b[2] += 1
+                return False
+            b[0] -= 1.0
+            dropped, b[2] = b[2], 0
+        if dropped:
+            record.msg = f"{record.msg} (+{dropped} suppressed)"
+        return True
+
+def setup_logging(level: Optional[str] = None):
+    if not level:
+        level = os.environ.get("SPEECH_LOG_LEVEL") or ("WARNING" if getattr(sys, "frozen", False) else "INFO")
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    handler.addFilter(RateLimitFilter(LOG_RATE_PER_SEC))
+    log.handlers[:] = [handler]
+    log.setLevel(level.upper())
+    log.propagate = False
+
+setup_logging()
 
 # =========================
 # Grammar (command mode)
+# - the game acts on the English command; every other phrase maps to one (COMMAND_OF)
+# - with only the English model, other languages are English-word spellings of
+#   how they sound (PHONETIC_COMMANDS); a language with its own model under
+#   vosk_models/ listens for its real phrases instead (NATIVE_COMMANDS)
 # =========================
-GRAMMAR = [
-    # English
+ENGLISH_COMMANDS = [
     "boom boom", "bad game", "this game sucks",
     "bedroom player", "boss level one", "corruption level",
     "i challenge you to a rap battle",
     "candy world", "slime world", "neutral world",
-    "play mozart", "mute sound", "summon", "pizza", "help", "kill them", "i love you", "please stop", "pretty please stop", "stop", "you're pretty", 
+    "play mozart", "mute sound", "summon", "pizza", "help", "kill them", "i love you", "please stop", "pretty please stop", "stop", "you're pretty",
+]
 
-    # Norwegian phonetics / variants
-    "dorlee spill", "detta spillet soooger", "so verom spiller",
-    "shef nivoh en", "korrup shon nivoh", "yai oodforrer dai til en rap battle",
-    "gottery verden", "sleem verden", "noytral verden",
-    "spill mozart", "demp leeden", "pawkalle",
+# The commands every PHONETIC_COMMANDS row spells, in this order
+LOCALIZED_COMMANDS = [
+    "bad game", "this game sucks", "bedroom player",
+    "boss level one", "corruption level", "i challenge you to a rap battle",
+    "candy world", "slime world", "neutral world",
+    "play mozart", "mute sound", "summon",
+]
 
+PHONETIC_COMMANDS: Dict[str, List[str]] = {
+    # Norwegian phonetics / variants
+    "no": [
+        "dorlee spill", "detta spillet soooger", "so verom spiller",
+        "shef nivoh en", "korrup shon nivoh", "yai oodforrer dai til en rap battle",
+        "gottery verden", "sleem verden", "noytral verden",
+        "spill mozart", "demp leeden", "pawkalle",
+    ],
     # Finnish phonetics
-    "huo no pelli", "tama peli on pasca", "makoo hoo one pelaya",
-    "pomo taso ooksi", "korrup shun taso", "haastan sinut rap taisteloon",
-    "karki ma il ma", "leema ma il ma", "neutrahli ma il ma",
-    "soita mozartia", "mykista aani", "kutsua",
-
-    # Sámi phonetics
-    "heyoss spelloo", "dat spelloo ee let buorre", "songut spelloo",
-    "bassi dassi okta", "korup shuvna dassi", "valdan du rahpat dakon",
-    "goddi mailbmi", "sleema mailbmi", "neutraala mailbmi",
-    "chohpa mozart", "yoga yietna", "chokket",
-
+    "fi": [
+        "huo no pelli", "tama peli on pasca", "makoo hoo one pelaya",
+        "pomo taso ooksi", "korrup shun taso", "haastan sinut rap taisteloon",
+        "karki ma il ma", "leema ma il ma", "neutrahli ma il ma",
+        "soita mozartia", "mykista aani", "kutsua",
+    ],
+    # Sámi phonetics (there is no Vosk Sámi model, so this row stays)
+    "se": [
+        "heyoss spelloo", "dat spelloo ee let buorre", "songut spelloo",
+        "bassi dassi okta", "korup shuvna dassi", "valdan du rahpat dakon",
+        "goddi mailbmi", "sleema mailbmi", "neutraala mailbmi",
+        "chohpa mozart", "yoga yietna", "chokket",
+    ],
     # German phonetics
-    "shlek tes shpeel", "dee zes shpeel ist shlekt", "shlaf tseemer shpeeler",
-    "boss level ayns", "ko rup tsee ons shtoo feh", "ikh for der uh dikh tsu rap betl",
-    "bon bon velt", "shlime velt", "noy trah le velt",
-    "shpeel mozart", "shtoom shal ten", "besh vuren",
-
+    "de": [
+        "shlek tes shpeel", "dee zes shpeel ist shlekt", "shlaf tseemer shpeeler",
+        "boss level ayns", "ko rup tsee ons shtoo feh", "ikh for der uh dikh tsu rap betl",
+        "bon bon velt", "shlime velt", "noy trah le velt",
+        "shpeel mozart", "shtoom shal ten", "besh vuren",
+    ],
     # Spanish phonetics
-    "hweh go malo", "es te hweh go a pes ta", "hoo ga dor del dor mee toh rio",
-    "nee vel he feh oo no", "nee vel de ko rup see on", "te deh sa fee oh a oo na ba tah ya de rap",
-    "moon do de dool sess", "moon do de slaym", "moon do new tral",
-    "toh ka mozart", "see len see ah el so nee do", "een vo car",
-
+    "es": [
+        "hweh go malo", "es te hweh go a pes ta", "hoo ga dor del dor mee toh rio",
+        "nee vel he feh oo no", "nee vel de ko rup see on", "te deh sa fee oh a oo na ba tah ya de rap",
+        "moon do de dool sess", "moon do de slaym", "moon do new tral",
+        "toh ka mozart", "see len see ah el so nee do", "een vo car",
+    ],
+}
+
+GRAMMAR = ENGLISH_COMMANDS + [p for row in PHONETIC_COMMANDS.values() for p in row] + [
     # Allow recognizer to decline instead of forcing a match
     "[unk]",
 ]
 _PHRASES = [p for p in GRAMMAR if p != "[unk]"]
 
+# Real phrases for languages that can have a model of their own → English command.
+# Used only when vosk_models/ has that language; the English model keeps the
+# phonetic row otherwise.
+NATIVE_COMMANDS: Dict[str, Dict[str, str]] = {
+    "no": {
+        "dårlig spill": "bad game", "dette spillet suger": "this game sucks", "soverom spiller": "bedroom player",
+        "sjef nivå en": "boss level one", "korrupsjon nivå": "corruption level",
+        "jeg utfordrer deg til en rap battle": "i challenge you to a rap battle",
+        "godteri verden": "candy world", "slim verden": "slime world", "nøytral verden": "neutral world",
+        "spill mozart": "play mozart", "demp lyden": "mute sound", "påkalle": "summon",
+        "jeg elsker deg": "i love you", "stopp": "stop", "vær så snill stopp": "please stop",
+    },
+    "fi": {
+        "huono peli": "bad game", "tämä peli on paska": "this game sucks", "makuuhuone pelaaja": "bedroom player",
+        "pomo taso yksi": "boss level one", "korruptio taso": "corruption level",
+        "haastan sinut rap taisteluun": "i challenge you to a rap battle",
+        "karkki maailma": "candy world", "lima maailma": "slime world", "neutraali maailma": "neutral world",
+        "soita mozartia": "play mozart", "mykistä ääni": "mute sound", "kutsua": "summon",
+        "minä rakastan sinua": "i love you", "seis": "stop", "lopeta": "please stop",
+    },
+    "de": {
+        "schlechtes spiel": "bad game", "dieses spiel ist schlecht": "this game sucks", "schlafzimmer spieler": "bedroom player",
+        "boss level eins": "boss level one", "korruptions stufe": "corruption level",
+        "ich fordere dich zum rap battle heraus": "i challenge you to a rap battle",
+        "bonbon welt": "candy world", "schleim welt": "slime world", "neutrale welt": "neutral world",
+        "spiel mozart": "play mozart", "stumm schalten": "mute sound", "beschwören": "summon",
+        "ich liebe dich": "i love you", "stopp": "stop", "bitte stopp": "please stop",
+    },
+    "es": {
+        "juego malo": "bad game", "este juego apesta": "this game sucks", "jugador del dormitorio": "bedroom player",
+        "nivel jefe uno": "boss level one", "nivel de corrupción": "corruption level",
+        "te desafío a una batalla de rap": "i challenge you to a rap battle",
+        "mundo de dulces": "candy world", "mundo de slime": "slime world", "mundo neutral": "neutral world",
+        "toca mozart": "play mozart", "silencia el sonido": "mute sound", "invocar": "summon",
+        "te quiero": "i love you", "para": "stop", "por favor para": "please stop",
+    },
+}
+
+# spoken phrase → the English command the game acts on (sent as `command` with each final)
+COMMAND_OF: Dict[str, str] = {
+    **{p: p for p in ENGLISH_COMMANDS},
+    **{p: c for row in PHONETIC_COMMANDS.values() for p, c in zip(row, LOCALIZED_COMMANDS)},
+    **{p: c for table in NATIVE_COMMANDS.values() for p, c in table.items()},
+}
+
+# Commands honoured mid-freestyle (CONCURRENT_COMMANDS), in any language; anything
+# else the command grammar hears over a rap is dropped as a false hit
+FREESTYLE_COMMANDS = frozenset(["stop", "please stop", "pretty please stop", "mute sound"])
+
+# Per-scene phrase sets for `set_grammar` ("all" = the full GRAMMAR above).
+# A smaller grammar means a smaller decode search and fewer false hits.
+GRAMMAR_SETS: Dict[str, List[str]] = {
+    "all": _PHRASES,
+    "combat": [
+        "boom boom", "summon", "kill them", "help", "stop", "please stop", "pretty please stop",
+        "you're pretty", "i love you",
+        "pawkalle", "kutsua", "chokket", "besh vuren", "een vo car",
+    ],
+    "travel": [
+        "bedroom player", "boss level one", "corruption level", "pizza",
+        "candy world", "slime world", "neutral world",
+        "so verom spiller", "shef nivoh en", "korrup shon nivoh", "gottery verden", "sleem verden", "noytral verden",
+        "makoo hoo one pelaya", "pomo taso ooksi", "korrup shun taso", "karki ma il ma", "leema ma il ma", "neutrahli ma il ma",
+        "songut spelloo", "bassi dassi okta", "korup shuvna dassi", "goddi mailbmi", "sleema mailbmi", "neutraala mailbmi",
+        "shlaf tseemer shpeeler", "boss level ayns", "ko rup tsee ons shtoo feh", "bon bon velt", "shlime velt", "noy trah le velt",
+        "hoo ga dor del dor mee toh rio", "nee vel he feh oo no", "nee vel de ko rup see on",
+        "moon do de dool sess", "moon do de slaym", "moon do new tral",
+    ],
+    "rap": [
+        "i challenge you to a rap battle", "yai oodforrer dai til en rap battle", "haastan sinut rap taisteloon",
+        "valdan du rahpat dakon", "ikh for der uh dikh tsu rap betl", "te deh sa fee oh a oo na ba tah ya de rap",
+        "play mozart", "spill mozart", "soita mozartia", "chohpa mozart", "shpeel mozart", "toh ka mozart",
+        "stop",
+    ],
+}
+
+class PhraseTrie:
+    """Token-level prefix trie over the command phrases."""
+
+    __slots__ = ("children", "phrase")
+
+    def __init__(self, phrases: Optional[List[str]] = None):
+        self.children: Dict[str, "PhraseTrie"] = {}
+        self.phrase: Optional[str] = None
+        for p in phrases or ():
+            self.add(p)
+
+    def add(self, phrase: str):
+        node = self
+        for tok in phrase.split():
+            node = node.children.setdefault(tok, PhraseTrie())
+        node.phrase = phrase
+
+    def node(self, text: str) -> Optional["PhraseTrie"]:
+        node = self
+        for tok in text.split():
+            node = node.children.get(tok)
+            if node is None:
+                return None
+        return node
+
+    def match(self, text: str) -> Optional[str]:
+        """Exact phrase lookup."""
+        node = self.node(text)
+        return node.phrase if node is not None else None
+
+    def resolve(self, text: str) -> Optional[str]:
+        """The phrase `text` can only end as: a complete phrase that no longer
+        phrase extends ("boom boom", "kill them"), else None."""
+        node = self.node(text)
+        if node is None or node.children:
+            return None
+        return node.phrase
+
+PHRASE_TRIE = PhraseTrie(_PHRASES)
+
 # =========================
 # PyInstaller support
 # =========================
@@ -80,42 +343,658 @@ def data_path(*parts: str) -> str:
         return os.path.join(sys._MEIPASS, *parts)
     return os.path.join(os.path.dirname(__file__), *parts)
 
-MODEL_CANDIDATES = [
-    data_path('vosk_models', 'vosk-model-small-en-us-0.15'),
-    os.path.join(os.path.dirname(sys.argv[0]), 'vosk_models', 'vosk-model-small-en-us-0.15'),
-    os.path.join(os.path.dirname(sys.argv[0]), '_internal', 'vosk_models', 'vosk-model-small-en-us-0.15'),
+MODEL_ROOTS = [
+    data_path('vosk_models'),
+    os.path.join(os.path.dirname(sys.argv[0]), 'vosk_models'),
+    os.path.join(os.path.dirname(sys.argv[0]), '_internal', 'vosk_models'),
 ]
-MODEL_DIR = next((p for p in MODEL_CANDIDATES if os.path.exists(p)), None)
-if not MODEL_DIR:
-    raise RuntimeError("Vosk model not found. Looked in:\n  " + "\n  ".join(MODEL_CANDIDATES))
+
+def unpack_ms() -> Optional[float]:
+    """Approximate PyInstaller onefile unpack time: from the bootloader
+    process start (or the _MEIPASS dir creation) to this script starting."""
+    if not hasattr(sys, "_MEIPASS"):
+        return None
+    try:
+        import psutil
+        started = psutil.Process(os.getppid()).create_time()
+    except Exception:
+        try:
+            st = os.stat(sys._MEIPASS)
+            started = getattr(st, "st_birthtime", st.st_ctime)
+        except OSError:
+            return None
+    return max(0.0, (_WALL_SCRIPT - started) * 1000.0)
 
 # =========================
-# Init recognizers
-# - recognizer_cmd: grammar-locked for exact phrases
-# - recognizer_free: open dictation for freestyle rap windows
+# Recognizer pool
+# - one shared Model per language
+# - each session checks out its own pair:
+#   cmd:  grammar-locked for exact phrases
+#   free: open dictation for freestyle rap windows
 # =========================
-print("🔧 Loading Vosk model from:", MODEL_DIR)
-model = Model(MODEL_DIR)
-recognizer_cmd  = KaldiRecognizer(model, SAMPLE_RATE, json.dumps(GRAMMAR))
-recognizer_cmd.SetMaxAlternatives(0)
-recognizer_cmd.SetWords(False)
+class TimedRecognizer:
+    """KaldiRecognizer that counts the audio fed to it. Vosk reports word
+    times on that cumulative timeline (it survives Reset), so sessions can map
+    them back to capture time even when silent blocks are skipped."""
+
+    def __init__(self, rec: KaldiRecognizer):
+        self.rec = rec
+        self.fed_sec = 0.0
+
+    def AcceptWaveform(self, data) -> bool:
+        self.fed_sec += len(data) / (2.0 * SAMPLE_RATE)
+        return self.rec.AcceptWaveform(data)
+
+    def __getattr__(self, name):
+        return getattr(self.rec, name)
+
+class RecognizerPool:
+    """Pre-warmed (cmd, free) recognizer pairs built on one shared Model.
+    checkout() hands a session a private pair; checkin() resets it and
+    returns it to the idle list. Spares are rebuilt in the background so
+    checkout normally never constructs a recognizer."""
+
+    def __init__(self, model: Model, warm: int, max_size: int, grammar: Optional[List[str]] = None):
+        self.model = model
+        self.grammar = grammar or GRAMMAR
+        self.warm = warm
+        self.max_size = max(1, max_size)
+        self._lock = threading.Lock()
+        self._idle: List[tuple] = []
+        self._created = 0
+        self._refilling = False
+
+        self.checkouts = 0
+        self.cold_checkouts = 0        # had to build a pair inline
+        self.rejected = 0              # pool at max_size
+        self.checkout_ms_total = 0.0
+        self.checkout_ms_max = 0.0
+
+        for _ in range(min(warm, self.max_size)):
+            self._idle.append(self._build())
+            self._created += 1
+
+    def _build(self) -> tuple:
+        cmd = KaldiRecognizer(self.model, SAMPLE_RATE, json.dumps(self.grammar))
+        cmd.SetMaxAlternatives(0)
+        cmd.SetWords(False)
+
+        free = KaldiRecognizer(self.model, SAMPLE_RATE)  # no grammar → free dictation
+        free.SetMaxAlternatives(0)
+        free.SetWords(True)  # per-word times feed the freestyle judge
+        return cmd, TimedRecognizer(free)
+
+    def checkout(self) -> Optional[tuple]:
+        t0 = perf_counter()
+        with self._lock:
+            pair = self._idle.pop() if self._idle else None
+            build = pair is None and self._created < self.max_size
+            if build:
+                self._created += 1
+            elif pair is None:
+                self.rejected += 1
+                return None
+        if build:
+            try:
+                pair = self._build()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        ms = (perf_counter() - t0) * 1000.0
+        with self._lock:
+            self.checkouts += 1
+            self.cold_checkouts += int(build)
+            self.checkout_ms_total += ms
+            self.checkout_ms_max = max(self.checkout_ms_max, ms)
+        self._refill()
+        return pair
+
+    def checkin(self, pair: tuple):
+        for rec in pair:
+            rec.Reset()
+        with self._lock:
+            self._idle.append(pair)
+
+    def _refill(self):
+        with self._lock:
+            if self._refilling or len(self._idle) >= self.warm or self._created >= self.max_size:
+                return
+            self._refilling = True
+            self._created += 1
+        threading.Thread(target=self._refill_one, name="vosk-pool-refill", daemon=True).start()
 
-recognizer_free = KaldiRecognizer(model, SAMPLE_RATE)  # no grammar → free dictation
-recognizer_free.SetMaxAlternatives(0)
-recognizer_free.SetWords(True)  # words true helps segmentation; not required
+    def _refill_one(self):
+        try:
+            pair = self._build()
+        except Exception as e:
+            log.error("Recognizer build error: %s", e)
+            with self._lock:
+                self._created -= 1
+                self._refilling = False
+            return
+        with self._lock:
+            self._idle.append(pair)
+            self._refilling = False
+        self._refill()
+
+    def idle_pairs(self) -> List[tuple]:
+        with self._lock:
+            return list(self._idle)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "idle": len(self._idle),
+                "created": self._created,
+                "max_size": self.max_size,
+                "checkouts": self.checkouts,
+                "cold_checkouts": self.cold_checkouts,
+                "rejected": self.rejected,
+                "checkout_ms_avg": round(self.checkout_ms_total / max(1, self.checkouts), 3),
+                "checkout_ms_max": round(self.checkout_ms_max, 3),
+            }
 
-print("🧩 Grammar:", GRAMMAR)
+# =========================
+# Grammar cache
+# - command recognizers for `set_grammar` phrase sets, compiled once
+# - idle ones are kept LRU, keyed by grammar hash; GRAMMAR_CACHE_MAX caps memory
+# =========================
+def grammar_key(phrases: List[str]) -> str:
+    return hashlib.sha1("\n".join(sorted(set(phrases))).encode("utf-8")).hexdigest()[:16]
+
+class GrammarCache:
+    """Checkout/checkin of grammar-locked KaldiRecognizers by phrase set."""
+
+    def __init__(self, model: Model, max_idle: int):
+        self.model = model
+        self.max_idle = max(0, max_idle)
+        self._lock = threading.Lock()
+        self._idle: "collections.OrderedDict[str, List[Any]]" = collections.OrderedDict()  # key → recs, LRU order
+        self._tries: Dict[str, PhraseTrie] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.build_ms_max = 0.0
+
+    def _build(self, phrases: List[str]):
+        t0 = perf_counter()
+        rec = KaldiRecognizer(self.model, SAMPLE_RATE, json.dumps(sorted(set(phrases)) + ["[unk]"]))
+        rec.SetMaxAlternatives(0)
+        rec.SetWords(False)
+        ms = (perf_counter() - t0) * 1000.0
+        with self._lock:
+            self.build_ms_max = max(self.build_ms_max, ms)
+        return rec
+
+    def checkout(self, phrases: List[str]) -> tuple:
+        """(key, recognizer, trie, cached) for this phrase set; builds on a miss."""
+        key = grammar_key(phrases)
+        with self._lock:
+            recs = self._idle.get(key)
+            rec = recs.pop() if recs else None
+            if recs is not None and not recs:
+                del self._idle[key]
+            trie = self._tries.get(key)
+            cached = rec is not None
+            if cached:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if trie is None:
+            trie = PhraseTrie(phrases)
+            with self._lock:
+                self._tries[key] = trie
+        if rec is None:
+            rec = self._build(phrases)
+        return key, rec, trie, cached
+
+    def checkin(self, key: str, rec):
+        rec.Reset()
+        with self._lock:
+            self._idle.setdefault(key, []).append(rec)
+            self._idle.move_to_end(key)
+            self._evict()
+
+    def _evict(self):
+        while sum(len(v) for v in self._idle.values()) > self.max_idle:
+            key, recs = next(iter(self._idle.items()))
+            recs.pop(0)
+            self.evictions += 1
+            if not recs:
+                del self._idle[key]
+                self._tries.pop(key, None)
+
+    def preload(self, sets: Dict[str, List[str]]):
+        """Compile one recognizer per named set so the first switch is a hit."""
+        for name, phrases in sets.items():
+            if name == "all":
+                continue                   # pool pairs already carry the full grammar
+            key = grammar_key(phrases)
+            rec = self._build(phrases)
+            with self._lock:
+                self._tries[key] = PhraseTrie(phrases)
+            self.checkin(key, rec)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "idle": sum(len(v) for v in self._idle.values()),
+                "sets": len(self._idle),
+                "max_idle": self.max_idle,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "build_ms_max": round(self.build_ms_max, 3),
+            }
+
+# =========================
+# Model registry
+# - one model per language found under vosk_models/; only MODEL_DEFAULT_LANG
+#   loads at startup, the rest the first time a session selects them
+# - a loaded model (pool, grammar cache) is shared by every session on it
+# - loads run one at a time; before one, idle models are evicted least recently
+#   used first until the new one fits MODEL_RSS_BUDGET_MB
+# =========================
+_RE_MODEL_LANG = re.compile(r"^vosk-model-(?:small-)?([a-z]{2,3})(?:-|$)")
+
+def model_language(name: str) -> Optional[str]:
+    """"vosk-model-small-en-us-0.15" → "en", "vosk-model-small-nb-0.22" → "no"."""
+    m = _RE_MODEL_LANG.match(name.lower())
+    return MODEL_LANG_ALIASES.get(m.group(1), m.group(1)) if m else None
+
+def discover_models(roots: Optional[List[str]] = None) -> Dict[str, str]:
+    """language → model dir. The first root with a language wins; small models
+    are preferred over big ones for the same language."""
+    found: Dict[str, str] = {}
+    for root in roots or MODEL_ROOTS:
+        try:
+            names = sorted(os.listdir(root), key=lambda n: ("-small-" not in n, n))
+        except OSError:
+            continue
+        for name in names:
+            path = os.path.join(root, name)
+            lang = model_language(name)
+            if lang and lang not in found and os.path.isdir(os.path.join(path, "conf")):
+                found[lang] = path
+    return found
+
+def rss_mb() -> Optional[float]:
+    """Resident set size of this process now (not the peak), or None if unknown."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1048576.0
+    except Exception:
+        pass
+    if sys.platform == "win32":              # frozen build ships without psutil
+        try:
+            import ctypes
+            from ctypes import wintypes
+
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                            ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                            ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+            c = PROCESS_MEMORY_COUNTERS()
+            c.cb = ctypes.sizeof(c)
+            proc = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(proc, ctypes.byref(c), c.cb):
+                return c.WorkingSetSize / 1048576.0
+        except (OSError, AttributeError):
+            pass
+        return None
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1048576.0
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def disk_mb(path: str) -> float:
+    """Size of a model dir; the memory estimate for a model never loaded yet."""
+    total = 0
+    for dirpath, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, f))
+            except OSError:
+                pass
+    return total / 1048576.0
+
+def grammar_sets_for(lang: str) -> Dict[str, List[str]]:
+    """GRAMMAR_SETS for a language's own model: each set keeps that language's
+    NATIVE_COMMANDS phrases for the commands in it."""
+    native = NATIVE_COMMANDS[lang]
+    sets = {"all": list(native)}
+    for name, phrases in GRAMMAR_SETS.items():
+        commands = {COMMAND_OF.get(p, p) for p in phrases}
+        keep = [p for p, c in native.items() if c in commands]
+        if name != "all" and keep:
+            sets[name] = keep
+    return sets
+
+class LanguageModel:
+    """One loaded Vosk model and everything built on it: the recognizer pool,
+    the set_grammar cache and the command phrases it listens for."""
+
+    def __init__(self, lang: str, model_dir: str, warm: int, native: List[str]):
+        self.lang = lang
+        self.model_dir = model_dir
+        if lang in NATIVE_COMMANDS:
+            self.sets = grammar_sets_for(lang)
+            self.grammar = self.sets["all"] + ["[unk]"]
+            self.trie = PhraseTrie(self.sets["all"])
+        else:
+            # phonetic rows of languages that have their own model only bloat this grammar
+            drop = {p for l in native for p in PHONETIC_COMMANDS.get(l, ())}
+            self.sets = {name: [p for p in phrases if p not in drop] for name, phrases in GRAMMAR_SETS.items()}
+            self.grammar = [p for p in GRAMMAR if p not in drop]
+            self.trie = PhraseTrie(self.sets["all"]) if drop else PHRASE_TRIE
+        self.sessions = 0                  # sessions holding a pair (pins it against eviction)
+        self.last_used = monotonic()
+        self.rss_mb: Optional[float] = None
+
+        t0 = perf_counter()
+        self.model = Model(model_dir)
+        t1 = perf_counter()
+        self.pool = RecognizerPool(self.model, warm, POOL_MAX, self.grammar)
+        t2 = perf_counter()
+        self.grammars = GrammarCache(self.model, GRAMMAR_CACHE_MAX)
+        self.grammars.preload(self.sets)
+        self.phases: Dict[str, float] = {
+            "model_load_ms": round((t1 - t0) * 1000.0, 1),
+            "grammar_compile_ms": round((t2 - t1) * 1000.0, 1),
+            "grammar_sets_ms": round((perf_counter() - t2) * 1000.0, 1),
+        }
+
+    def warmup(self, seconds: float) -> float:
+        """Push synthetic silence through the idle pairs so the first real
+        utterance doesn't pay for lazy allocations inside Kaldi. Returns ms."""
+        t0 = perf_counter()
+        silence = bytes(BLOCKSIZE * 2)
+        blocks = max(1, int(seconds / BLOCK_SEC))
+        for pair in self.pool.idle_pairs():
+            for rec in pair:
+                for _ in range(blocks):
+                    rec.AcceptWaveform(silence)
+                rec.Reset()
+        return round((perf_counter() - t0) * 1000.0, 1)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "dir": os.path.basename(self.model_dir),
+            "load_ms": round(sum(self.phases.values()), 1),
+            "phases": self.phases,
+            "rss_mb": self.rss_mb,
+            "phrases": len(self.grammar) - 1,
+            "sessions": self.sessions,
+            "idle_sec": round(monotonic() - self.last_used, 1) if not self.sessions else 0.0,
+            "pool": self.pool.stats(),
+            "grammar_cache": self.grammars.stats(),
+        }
+
+class ModelRegistry:
+    """Language → LanguageModel, loaded on first use and shared. Each load's
+    RSS growth is recorded as that model's size (loads are serialized so the
+    numbers don't mix) and is what an eviction is expected to give back."""
+
+    def __init__(self, budget_mb: float = MODEL_RSS_BUDGET_MB):
+        self.budget_mb = budget_mb
+        self.warmup_sec = 0.0
+        self.available: Dict[str, str] = {}        # language → model dir
+        self._models: "collections.OrderedDict[str, LanguageModel]" = collections.OrderedDict()  # LRU order
+        self._sizes: Dict[str, float] = {}         # measured MB per language, kept across evictions
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.sessions = 0
+        self.loads = 0
+        self.evictions = 0
+        self.over_budget = 0                       # loads refused: nothing idle left to evict
+        self._rss_warned = False
+
+    def discover(self, roots: Optional[List[str]] = None) -> Dict[str, str]:
+        self.available = discover_models(roots)
+        return self.available
+
+    def native(self) -> List[str]:
+        """Languages that have a model of their own (besides the default)."""
+        return [l for l in self.available if l in NATIVE_COMMANDS]
+
+    def languages(self) -> Dict[str, str]:
+        """Selectable languages and how each is heard: "model" or "phonetic"."""
+        out = {l: "phonetic" for l in PHONETIC_COMMANDS}
+        out[MODEL_DEFAULT_LANG] = "model"
+        out.update({l: "model" for l in self.native()})
+        return out
+
+    def model_lang(self, lang: str) -> str:
+        """The model language that serves `lang`."""
+        lang = MODEL_LANG_ALIASES.get(lang, lang)
+        if lang == MODEL_DEFAULT_LANG or lang in self.native():
+            return lang
+        if lang in PHONETIC_COMMANDS:
+            return MODEL_DEFAULT_LANG
+        raise RuntimeError(f"unknown language '{lang}'")
+
+    def get(self, lang: str) -> Optional[LanguageModel]:
+        with self._lock:
+            return self._models.get(lang)
+
+    def load(self, lang: str, warm: int = MODEL_LAZY_WARM) -> LanguageModel:
+        """The model for model language `lang`, loading it if needed (blocking,
+        seconds). Raises RuntimeError if there is none or it doesn't fit."""
+        lm = self.get(lang)
+        if lm is not None:
+            return lm
+        with self._load_lock:
+            lm = self.get(lang)
+            if lm is not None:             # loaded while we waited
+                return lm
+            model_dir = self.available.get(lang)
+            if model_dir is None:
+                raise RuntimeError(f"no Vosk model for '{lang}' under vosk_models/")
+            if lang != MODEL_DEFAULT_LANG:     # the default is never evicted, nor refused
+                self._make_room(lang, self._sizes.get(lang) or disk_mb(model_dir))
+
+            log.info("🔧 Loading Vosk model [%s] from: %s", lang, model_dir)
+            rss0 = rss_mb()
+            lm = LanguageModel(lang, model_dir, warm, self.native())
+            if self.warmup_sec > 0:
+                lm.phases["warmup_ms"] = lm.warmup(self.warmup_sec)
+            rss1 = rss_mb()
+            if rss0 is not None and rss1 is not None:
+                lm.rss_mb = round(max(0.0, rss1 - rss0), 1)
+                self._sizes[lang] = lm.rss_mb
+            with self._lock:
+                self._models[lang] = lm
+                self.loads += 1
+            if lang != MODEL_DEFAULT_LANG:     # the estimate was low: get back under budget now
+                self._make_room(lang, 0.0, strict=False)
+            metrics.observe("model_load_ms", sum(lm.phases.values()))
+            log.info("✅ Model [%s] loaded: %s, +%s MB (rss %s MB)", lang, lm.phases, lm.rss_mb,
+                     round(rss1) if rss1 is not None else "?")
+            return lm
+
+    def _make_room(self, lang: str, need_mb: float, strict: bool = True):
+        """Evict idle models other than `lang`, least recently used first, until
+        need_mb more fits. strict: RuntimeError if it can't."""
+        rss = rss_mb()
+        if self.budget_mb <= 0:
+            return
+        if rss is None:
+            if not self._rss_warned:
+                self._rss_warned = True
+                log.warning("⚠️ Can't read process memory here; model budget of %.0f MB is not enforced.",
+                            self.budget_mb)
+            return
+        while rss + need_mb > self.budget_mb:
+            with self._lock:
+                victim = next((lm for lm in self._models.values()
+                               if lm.sessions == 0 and lm.lang not in (lang, MODEL_DEFAULT_LANG)), None)
+                if victim is None:
+                    if not strict:
+                        return
+                    self.over_budget += 1
+                    raise RuntimeError(f"model memory budget: {rss:.0f} MB in use, [{lang}] needs "
+                                       f"~{need_mb:.0f} MB, budget {self.budget_mb:.0f} MB")
+                del self._models[victim.lang]
+                self.evictions += 1
+            freed, name = victim.rss_mb or 0.0, victim.lang
+            del victim                     # last reference: Vosk frees the model here
+            now = rss_mb()
+            # the allocator may keep freed pages mapped; trust the measured size then
+            rss = min(now, rss - freed) if now is not None else rss - freed
+            metrics.inc("model_evictions")
+            log.info("♻️ Evicted idle model [%s] (~%.0f MB) to fit [%s]", name, freed, lang)
+
+    def checkout(self, lang: str, new_session: bool = True) -> Optional[tuple]:
+        """(LanguageModel, recognizer pair) for a session on `lang`, or None at
+        the POOL_MAX session cap. new_session=False moves an existing session
+        (set_language) and doesn't count against the cap."""
+        target = self.model_lang(lang)
+        while True:
+            lm = self.load(target)
+            with self._lock:
+                if self._models.get(target) is not lm:
+                    continue               # evicted between load and here; load again
+                if new_session and self.sessions >= POOL_MAX:
+                    return None
+                lm.sessions += 1
+                self.sessions += int(new_session)
+                self._models.move_to_end(target)
+            break
+        pair = lm.pool.checkout()
+        if pair is None:
+            self.checkin(lm, None, new_session)
+            return None
+        return lm, pair
+
+    def checkin(self, lm: LanguageModel, pair: Optional[tuple], end_session: bool = True):
+        if pair is not None:
+            lm.pool.checkin(pair)
+        with self._lock:
+            lm.sessions -= 1
+            lm.last_used = monotonic()
+            self.sessions -= int(end_session)
+
+    def stats(self) -> Dict[str, Any]:
+        rss = rss_mb()
+        with self._lock:
+            models = list(self._models.values())
+            out = {
+                "rss_mb": round(rss, 1) if rss is not None else None,
+                "budget_mb": self.budget_mb,
+                "sessions": self.sessions,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "over_budget": self.over_budget,
+                "available": {l: os.path.basename(d) for l, d in sorted(self.available.items())},
+            }
+        out["loaded"] = {lm.lang: lm.stats() for lm in models}
+        return out
+
+registry = ModelRegistry()
 
-# Default sounddevice format
-sd.default.samplerate = SAMPLE_RATE
-sd.default.channels   = 1
+# =========================
+# Model loader
+# - the default language's model is loaded after the websocket port is bound,
+#   so clients can connect immediately and get {"type":"status","state":"loading"|"ready"}
+# =========================
+class ModelLoader:
+    """Discovers the models and loads the default language's (plus the rhyme
+    index) at startup, timing each phase."""
+
+    def __init__(self):
+        self.state = "loading"             # "loading" | "ready" | "error"
+        self.error: Optional[str] = None
+        self.model_dir: Optional[str] = None
+        self.model: Optional[Model] = None
+        self.phases: Dict[str, Optional[float]] = {
+            "unpack_ms": unpack_ms(),
+            "import_ms": round((_T_IMPORTED - _T_SCRIPT) * 1000.0, 1),
+        }
+        self._done = threading.Event()
+        self._waiters: List[tuple] = []    # (loop, asyncio.Event) to wake when done
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self) -> Optional[RecognizerPool]:
+        lm = registry.get(MODEL_DEFAULT_LANG)
+        return lm.pool if lm is not None else None
+
+    @property
+    def grammars(self) -> Optional[GrammarCache]:
+        lm = registry.get(MODEL_DEFAULT_LANG)
+        return lm.grammars if lm is not None else None
+
+    def load(self, warmup_sec: float = MODEL_WARMUP_SEC):
+        """Blocking load; safe to call from a worker thread."""
+        try:
+            t0 = perf_counter()
+            registry.discover()
+            self.phases["discover_ms"] = round((perf_counter() - t0) * 1000.0, 1)
+            if MODEL_DEFAULT_LANG not in registry.available:
+                raise RuntimeError("Vosk model not found. Looked in:\n  " + "\n  ".join(MODEL_ROOTS))
+            log.info("🌐 Models: %s", {l: os.path.basename(d) for l, d in registry.available.items()})
+            registry.warmup_sec = warmup_sec
+            lm = registry.load(MODEL_DEFAULT_LANG, POOL_WARM)
+            self.model_dir, self.model = lm.model_dir, lm.model
+            self.phases.update(lm.phases)
+            log.debug("🧩 Grammar: %s", lm.grammar)
+            t3 = perf_counter()
+            try:
+                how = rhyme_index.load(self.model_dir, RHYME_CACHE)
+                log.info("🎼 Rhyme keys: %s%s", how, f" ({rhyme_index.source})" if rhyme_index.source else "")
+            except Exception as e:  # judging still works on spelling rules
+                log.warning("⚠️ Rhyme index unavailable, using spelling rules: %s", e)
+            self.phases["rhyme_index_ms"] = round((perf_counter() - t3) * 1000.0, 1)
+            self.phases["ready_ms"] = round((perf_counter() - _T_SCRIPT) * 1000.0, 1)
+            metrics.gauge("models", registry.stats)
+            self.state = "ready"
+            log.info("✅ Model ready: %s", self.phases)
+        except Exception as e:
+            self.state = "error"
+            self.error = str(e)
+            log.error("❌ Model load failed: %s", e)
+        finally:
+            self._done.set()
+            with self._lock:
+                waiters, self._waiters = self._waiters, []
+            for loop, ev in waiters:
+                loop.call_soon_threadsafe(ev.set)
+
+    def start_background(self, loop: asyncio.AbstractEventLoop, warmup_sec: float = MODEL_WARMUP_SEC):
+        loop.run_in_executor(None, self.load, warmup_sec)
+
+    async def wait_ready(self) -> bool:
+        if not self._done.is_set():
+            ev = asyncio.Event()
+            with self._lock:
+                if not self._done.is_set():
+                    self._waiters.append((asyncio.get_running_loop(), ev))
+                else:
+                    ev.set()
+            await ev.wait()
+        return self.state == "ready"
+
+    def status(self) -> Dict[str, Any]:
+        msg: Dict[str, Any] = {"type": "status", "state": self.state, "startup": self.phases}
+        if self.state == "ready":
+            msg["languages"] = registry.languages()
+        if self.error:
+            msg["error"] = self.error
+        return msg
+
+loader = ModelLoader()
 
 # =========================
 # Text helpers
 # =========================
 _RE_REPEAT = re.compile(r'\b(\w+)(\s+\1){2,}\b', re.IGNORECASE)
 _RE_WS = re.compile(r'\s+')
-_RE_WORD = re.compile(r"[a-zA-Zøæåäöáéíóúýčšžñß’']+", re.UNICODE)
 
 def normalize_final(text: str) -> str:
     t = (text or "").lower().strip()
@@ -125,367 +1004,1786 @@ def normalize_final(text: str) -> str:
     t = _RE_WS.sub(" ", t)
     return t.strip()
 
-def pick_phrase(text: str) -> Optional[str]:
-    return text if text in _PHRASES else None
+def pick_phrase(text: str, trie: Optional[PhraseTrie] = None) -> Optional[str]:
+    return (trie or PHRASE_TRIE).match(text)
 
-def tokenize_words(text: str) -> List[str]:
-    return [m.group(0).lower() for m in _RE_WORD.finditer(text or "")]
+# =========================
+# Unmatched phrase log
+# - decode path only enqueues; a background thread batches the disk writes
+# - aggregated JSON (phrase → count, first/last seen) is what grammar tuning reads
+# =========================
+class UnmatchedLog:
+    """Batched, rotating writer for phrases the grammar didn't match."""
+
+    def __init__(self, raw_path: str, agg_path: str, keep_raw: bool = UNMATCHED_KEEP_RAW):
+        self.raw_path = raw_path
+        self.agg_path = agg_path
+        self.keep_raw = keep_raw
+        self._q: "queue.SimpleQueue[Optional[tuple]]" = queue.SimpleQueue()
+        self._agg: Dict[str, Dict[str, Any]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._agg_lock = threading.Lock()
+        self.written = 0
+        self.rotations = 0
+        self.errors = 0
+
+    def log(self, text: str):
+        """Non-blocking; safe from any thread. No file I/O here: the writer
+        thread loads the aggregate itself (start() is normally called at boot)."""
+        self._q.put((text, time.time()))
+        if self._thread is None:
+            self.start()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="unmatched-log", daemon=True)
+            self._thread.start()
 
-def last_letters(word: str, n: int) -> str:
-    w = re.sub(r"[^a-zA-Zøæåäöáéíóúýčšžñß’']", "", word.lower())
-    return w[-n:] if len(w) >= n else w
+    def stop(self):
+        if self._thread is not None:
+            self._q.put(None)
+            self._thread.join(timeout=5.0)
 
-def rhyme_density(lines: List[str]) -> float:
-    """Very simple rhyme score: use last word of each non-empty line,
-    check how many share the same 2–3 letter suffix."""
-    ends = []
-    for ln in lines:
-        ws = tokenize_words(ln)
-        if not ws:
-            continue
-        last = ws[-1]
-        # choose 3 letters if possible, else 2, else 1
-        suf = last_letters(last, 3) if len(last) >= 5 else last_letters(last, 2)
-        if suf:
-            ends.append(suf)
-    if len(ends) < 2:
-        return 0.0
-    freq = collections.Counter(ends)
-    dominant = freq.most_common(1)[0][1]
-    return dominant / max(1, len(ends))
-
-def split_lines_for_rap(text: str) -> List[str]:
-    # split by newline or natural pauses (.,!?)
-    raw_lines = re.split(r"[ \t]*[\n\r]+|[.!?]+", text or "")
-    return [ln.strip() for ln in raw_lines if ln.strip()]
-
-def clamp01(x: float) -> float:
-    return max(0.0, min(1.0, x))
-
-def rank_from_total(score: float) -> str:
-    if score >= 0.90: return "S"
-    if score >= 0.75: return "A"
-    if score >= 0.60: return "B"
-    if score >= 0.45: return "C"
-    return "D"
+    def _load_agg(self):
+        """Writer thread, before the first flush."""
+        try:
+            with open(self.agg_path, "r", encoding="utf-8") as f:
+                agg = json.load(f)
+            with self._agg_lock:
+                self._agg = agg
+            return
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log.warning("Unmatched log: bad aggregate file, starting fresh: %s", e)
+            return
+        # first run: seed counts from the existing raw log so history isn't lost
+        agg: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(self.raw_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    phrase = line.strip()
+                    if phrase:
+                        e = agg.setdefault(phrase, {"count": 0, "first": None, "last": None})
+                        e["count"] += 1
+        except OSError:
+            pass
+        with self._agg_lock:
+            self._agg = agg
+
+    def _run(self):
+        self._load_agg()
+        pending: List[tuple] = []
+        deadline = monotonic() + UNMATCHED_FLUSH_SEC
+        running = True
+        while running:
+            try:
+                item = self._q.get(timeout=max(0.0, deadline - monotonic()))
+                if item is None:
+                    running = False
+                else:
+                    pending.append(item)
+            except queue.Empty:
+                pass
+            if pending and (not running or len(pending) >= UNMATCHED_FLUSH_LINES or monotonic() >= deadline):
+                self._flush(pending)
+                pending = []
+            if monotonic() >= deadline:
+                deadline = monotonic() + UNMATCHED_FLUSH_SEC
+
+    def _flush(self, batch: List[tuple]):
+        with self._agg_lock:
+            for text, ts in batch:
+                stamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(ts))
+                e = self._agg.setdefault(text, {"count": 0, "first": stamp, "last": stamp})
+                e["count"] += 1
+                e["first"] = e["first"] or stamp
+                e["last"] = stamp
+            data = json.dumps(self._agg, ensure_ascii=False, sort_keys=True)
+        try:
+            tmp = self.agg_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp, self.agg_path)
+
+            if self.keep_raw:
+                self._rotate_if_needed()
+                with open(self.raw_path, "a", encoding="utf-8") as f:
+                    f.write("".join(text + "\n" for text, _ in batch))
+            self.written += len(batch)
+        except Exception as e:
+            self.errors += 1
+            log.error("Unmatched log write error: %s", e)
+
+    def _rotate_if_needed(self):
+        try:
+            if os.path.getsize(self.raw_path) < UNMATCHED_MAX_BYTES:
+                return
+        except OSError:
+            return
+        for i in range(UNMATCHED_BACKUPS - 1, 0, -1):
+            src = f"{self.raw_path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.raw_path}.{i + 1}")
+        os.replace(self.raw_path, f"{self.raw_path}.1")
+        self.rotations += 1
+
+    def top(self, n: int = 20) -> List[tuple]:
+        """Most frequent unmatched phrases, for grammar tuning."""
+        with self._agg_lock:
+            items = sorted(self._agg.items(), key=lambda kv: kv[1]["count"], reverse=True)
+        return [(k, v["count"]) for k, v in items[:n]]
+
+unmatched_log = UnmatchedLog(UNMATCHED_LOG, UNMATCHED_AGG)
 
 def log_unmatched(text: str):
-    try:
-        with open(UNMATCHED_LOG, "a", encoding="utf-8") as f:
-            f.write(text + "\n")
-    except Exception:
-        pass
+    unmatched_log.log(text)
 
 # =========================
-# Client session handler
+# Audio pipeline
+# - one CaptureService owns the mic; its callback only copies blocks into a
+#   preallocated broadcast ring
+# - every session subscribes with its own cursor and decodes on its own thread
 # =========================
-async def handle_client(websocket):
-    print("🟢 Client connected.")
-    loop = asyncio.get_running_loop()
+class BroadcastRing:
+    """Single-writer, many-reader ring of fixed-size int16 blocks.
+    The writer never waits for readers: a reader that falls a whole ring
+    behind is skipped forward to the oldest block still held, and the
+    blocks it missed are counted on its Subscriber."""
+
+    def __init__(self, slots: int, block_bytes: int):
+        self.slots = slots
+        self.block_bytes = block_bytes
+        self._buf = bytearray(slots * block_bytes)
+        self._view = memoryview(self._buf)
+        self._sizes = [0] * slots
+        self._stamps = [0.0] * slots
+        self._head = 0                 # blocks written
+        self._cond = threading.Condition()
+        self._subs: List["Subscriber"] = []
+        self.blocks = 0
+
+    def push(self, data, stamp: float):
+        src = memoryview(data).cast("B")
+        n = min(len(src), self.block_bytes)
+        with self._cond:
+            i = self._head % self.slots
+            off = i * self.block_bytes
+            self._view[off:off + n] = src[:n]
+            self._sizes[i] = n
+            self._stamps[i] = stamp
+            self._head += 1
+            self.blocks += 1
+            self._cond.notify_all()
+
+    def subscribe(self) -> "Subscriber":
+        sub = Subscriber(self)
+        with self._cond:
+            self._subs.append(sub)
+        return sub
+
+    def unsubscribe(self, sub: "Subscriber"):
+        with self._cond:
+            if sub in self._subs:
+                self._subs.remove(sub)
+            self._cond.notify_all()
+
+    def wait_for_room(self, timeout: float) -> bool:
+        """Block until there is a subscriber and every subscriber has a free slot.
+        Only lossless sources (fast file replay) call this; the mic never waits."""
+        def room():
+            return bool(self._subs) and all(self._head - s._cursor < self.slots for s in self._subs)
+        with self._cond:
+            return self._cond.wait_for(room, timeout)
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+class Subscriber:
+    """A reader cursor into a BroadcastRing. pop() returns a memoryview into
+    the ring (no copy); call still_valid(seq) after using it to make sure the
+    writer did not lap the slot in the meantime."""
+
+    def __init__(self, ring: BroadcastRing):
+        self.ring = ring
+        self._cursor = ring._head      # start at live audio
+        self.blocks = 0                # blocks delivered
+        self.dropped = 0               # blocks lost to lag (reader too slow)
+        self.underruns = 0             # waited a whole timeout with no audio
+        self.max_depth = 0
+
+    def depth(self) -> int:
+        return self.ring._head - self._cursor
+
+    def pop(self, timeout: float) -> Optional[tuple]:
+        """Return (view, stamp, seq) or None if nothing arrived in time."""
+        ring = self.ring
+        with ring._cond:
+            if ring._head == self._cursor:
+                if not ring._cond.wait_for(lambda: ring._head != self._cursor, timeout):
+                    self.underruns += 1
+                    return None
+            depth = ring._head - self._cursor
+            if depth > ring.slots:
+                self.dropped += depth - ring.slots
+                self._cursor = ring._head - ring.slots
+                depth = ring.slots
+            self.max_depth = max(self.max_depth, depth)
+            seq = self._cursor
+            i = seq % ring.slots
+            off = i * ring.block_bytes
+            view = ring._view[off:off + ring._sizes[i]]
+            stamp = ring._stamps[i]
+            self._cursor += 1
+            self.blocks += 1
+            ring._cond.notify_all()    # a lossless writer may be waiting for room
+            return view, stamp, seq
+
+    def still_valid(self, seq: int) -> bool:
+        # under the lock: the writer bumps _head only after filling the slot,
+        # so a lapping write still in progress would otherwise pass
+        with self.ring._cond:
+            return self.ring._head - seq <= self.ring.slots
+
+    def wake(self):
+        self.ring.wake()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "blocks": self.blocks,
+            "depth": self.depth(),
+            "max_depth": self.max_depth,
+            "dropped": self.dropped,
+            "underruns": self.underruns,
+        }
 
-    # --- state
-    mode: str = "command"          # "command" | "freestyle"
-    active_rec = recognizer_cmd
-    last_final_text = ""
-    last_final_time = 0.0
-    last_sent_time  = 0.0
-    silence_start   = None
-
-    # freestyle window state
-    window_deadline: Optional[float] = None
-    freestyle_buffer: List[str] = []
-    freestyle_finalized: bool = False
-    cur_partial: str = ""
-
-    def switch_mode(m: str):
-        nonlocal mode, active_rec, freestyle_buffer, window_deadline, freestyle_finalized, cur_partial
-        if m == mode:
-            return
-        # reset both recognizers to avoid leakage
-        recognizer_cmd.Reset()
-        recognizer_free.Reset()
-        if m == "freestyle":
-            mode = "freestyle"
-            active_rec = recognizer_free
-            freestyle_buffer = []
-            window_deadline = None
-            freestyle_finalized = False
-            cur_partial = ""
-            print("🎤 Mode -> FREESTYLE")
-        else:
-            mode = "command"
-            active_rec = recognizer_cmd
-            window_deadline = None
-            freestyle_finalized = False
-            cur_partial = ""
-            print("🎮 Mode -> COMMAND")
+class AudioSource(ABC):
+    """Something that publishes BLOCKSIZE int16 blocks into a BroadcastRing.
+    Sessions only see subscribe()/unsubscribe() and now(), so the mic and
+    file/stdin replay feed exactly the same decode path."""
 
-    async def send_json(obj: Dict[str, Any]):
+    def __init__(self):
+        self.ring = BroadcastRing(RING_SLOTS, BLOCKSIZE * 2)
+
+    @abstractmethod
+    def start(self):
+        """Begin publishing blocks."""
+
+    def stop(self):
+        pass
+
+    def now(self) -> float:
+        """Current time on the same timeline as the block stamps."""
+        return monotonic()
+
+    def subscribe(self) -> Subscriber:
+        return self.ring.subscribe()
+
+    def unsubscribe(self, sub: Subscriber):
+        self.ring.unsubscribe(sub)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"blocks": self.ring.blocks}
+
+class CaptureService(AudioSource):
+    """Owns the single microphone stream and publishes blocks to all sessions.
+
+    With CAPTURE_NATIVE the device is opened at its default rate and channel
+    count and each callback block is downmixed/resampled to one BLOCKSIZE
+    16 kHz block (speech_resample), instead of leaving the conversion to the
+    host API."""
+
+    def __init__(self, device: Optional[Any] = INPUT_DEVICE):
+        super().__init__()
+        self.device = device
+        self.stream = None
+        self.resampler: Optional[Resampler] = None
+        self.rate = SAMPLE_RATE
+        self.input_overflows = 0       # PortAudio reported input overflow
+        self.adc_fallbacks = 0         # callbacks without a usable inputBufferAdcTime
+
+    def _captured_at(self, t, frames: int) -> float:
+        """Monotonic time the block's last sample hit the ADC, from PortAudio's
+        inputBufferAdcTime; callback entry when the host API doesn't report it."""
+        now = monotonic()
+        adc = getattr(t, "inputBufferAdcTime", 0.0)
+        age = getattr(t, "currentTime", 0.0) - adc
+        if adc > 0.0 and 0.0 <= age < 1.0:
+            end = now - age + frames / self.rate
+            metrics.observe("capture_latency_ms", (now - end) * 1000.0)
+            return end
+        self.adc_fallbacks += 1
+        return now
+
+    def _callback(self, indata, frames, t, status):
+        # copy (+ resample) only, never decode here
+        if status and status.input_overflow:
+            self.input_overflows += 1
+        stamp = self._captured_at(t, frames)
+        if self.resampler is None:
+            self.ring.push(indata, stamp)
+            return
+        t0 = perf_counter()
+        block = self.resampler.process(indata)
+        metrics.observe("resample_ms", (perf_counter() - t0) * 1000.0)
+        self.ring.push(block, stamp - self.resampler.delay_sec)
+
+    def _native_format(self) -> tuple:
+        """(rate, channels, frames per callback) to open the device with."""
+        if CAPTURE_NATIVE:
+            try:
+                dev = sd.query_devices(self.device, "input")
+                rate = int(dev["default_samplerate"])
+                channels = max(1, min(CAPTURE_MAX_CHANNELS, int(dev["max_input_channels"])))
+                frames = Resampler.block_for(rate, SAMPLE_RATE, BLOCKSIZE)
+                if frames is not None:
+                    return rate, channels, frames
+                log.warning("⚠️ %d Hz doesn't divide into %d-sample blocks; letting the host resample.", rate, BLOCKSIZE)
+            except Exception as e:
+                log.warning("⚠️ Couldn't query input device %r (%s); opening at %d Hz mono.", self.device, e, SAMPLE_RATE)
+        return SAMPLE_RATE, 1, BLOCKSIZE
+
+    def start(self):
+        if sd is None:
+            raise RuntimeError("sounddevice/PortAudio not available; use --input to replay a file")
+        rate, channels, frames = self._native_format()
+        self.rate = rate
+        if (rate, channels) != (SAMPLE_RATE, 1):
+            self.resampler = Resampler(rate, SAMPLE_RATE, channels, frames)
+        self.stream = sd.RawInputStream(
+            device=self.device,
+            samplerate=rate,
+            blocksize=frames,
+            dtype='int16',
+            channels=channels,
+            callback=self._callback
+        )
+        self.stream.start()
+        log.info("🎙️ Mic capture started (%d Hz x%d%s).", rate, channels,
+                 ", resampling to 16 kHz mono" if self.resampler else "")
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"blocks": self.ring.blocks, "input_overflows": self.input_overflows,
+                               "adc_fallbacks": self.adc_fallbacks}
+        if self.resampler is not None:
+            out["resampler"] = self.resampler.stats()
+        return out
+
+def pcm_blocks(path: str) -> Iterator[bytes]:
+    """Yield BLOCKSIZE int16 blocks from a 16-bit WAV (any rate/channels the
+    resampler handles), raw 16 kHz mono s16le PCM, or stdin ('-').
+    The last block is zero-padded."""
+    block_bytes = BLOCKSIZE * 2
+    resampler = None
+    if path == "-":
+        f, read = None, sys.stdin.buffer.read
+    elif path.lower().endswith(".wav"):
+        f = wave.open(path, "rb")
+        rate, channels = f.getframerate(), f.getnchannels()
+        frames = Resampler.block_for(rate, SAMPLE_RATE, BLOCKSIZE)
+        if f.getsampwidth() != 2 or frames is None:
+            f.close()
+            raise ValueError(f"{path}: need 16-bit WAV at a rate that resamples to {SAMPLE_RATE} Hz")
+        if (rate, channels) != (SAMPLE_RATE, 1):
+            resampler = Resampler(rate, SAMPLE_RATE, channels, frames)
+            block_bytes = frames * channels * 2
+        read = lambda n: f.readframes(n // (2 * channels))
+    else:
+        f = open(path, "rb")
+        read = f.read
+    try:
+        while True:
+            chunk = read(block_bytes)
+            if not chunk:
+                break
+            while len(chunk) < block_bytes:
+                more = read(block_bytes - len(chunk))
+                if not more:
+                    chunk += bytes(block_bytes - len(chunk))
+                    break
+                chunk += more
+            yield resampler.process(chunk).tobytes() if resampler is not None else chunk
+    finally:
+        if f is not None:
+            f.close()
+
+class FileSource(AudioSource):
+    """Replays a WAV/PCM file or stdin through the ring instead of the mic.
+    realtime=True paces blocks at capture speed; otherwise blocks go out as
+    fast as the slowest subscriber takes them (nothing is dropped) and are
+    stamped on a virtual clock so silence/cooldown timing stays correct."""
+
+    def __init__(self, path: str, realtime: bool = True, tail_silence_sec: float = 1.0):
+        super().__init__()
+        self.path = path
+        self.realtime = realtime
+        self.tail_blocks = int(math.ceil(tail_silence_sec / BLOCK_SEC))
+        self.done = threading.Event()
+        self._stop = threading.Event()
+        self._t0 = monotonic()
+        self._virtual_now = self._t0
+        self._thread = threading.Thread(target=self._run, name="file-source", daemon=True)
+
+    def now(self) -> float:
+        return monotonic() if self.realtime else self._virtual_now
+
+    def start(self):
+        self._thread.start()
+        pace = "real-time" if self.realtime else "fast"
+        log.info("📼 Replaying %s (%s)", self.path, pace)
+
+    def stop(self):
+        self._stop.set()
+        self.ring.wake()
+
+    def _blocks(self):
+        yield from pcm_blocks(self.path)
+        silence = bytes(BLOCKSIZE * 2)
+        for _ in range(self.tail_blocks):
+            yield silence
+
+    def _run(self):
+        self._t0 = monotonic()
         try:
-            await websocket.send(json.dumps(obj))
+            for i, block in enumerate(self._blocks()):
+                if self._stop.is_set():
+                    break
+                stamp = self._t0 + (i + 1) * BLOCK_SEC   # block is "captured" at its end
+                if self.realtime:
+                    delay = stamp - monotonic()
+                    if delay > 0:
+                        self._stop.wait(delay)
+                else:
+                    while not self.ring.wait_for_room(0.5):
+                        if self._stop.is_set():
+                            return
+                    self._virtual_now = stamp
+                self.ring.push(block, stamp)
         except Exception as e:
-            print("Send error:", e)
+            log.error("Replay error: %s", e)
+        finally:
+            self.done.set()
+            log.info("📼 Replay finished: %s", self.stats())
+
+
+class ClientAudioSource(AudioSource):
+    """Audio one websocket client streams to us as binary AUDIO_FRAME_HEADER
+    frames. Frames of any size are re-blocked into BLOCKSIZE blocks for the
+    session's ring, so decoding is the same as for the mic. Client capture
+    times map onto our monotonic clock by the smallest offset seen (the
+    least-delayed frame); missing sequence numbers are filled with silence
+    so word timings and listen windows stay aligned, and a gap too long to
+    fill (or a jump in client time) re-anchors the block stamps instead."""
+
+    def __init__(self):
+        super().__init__()
+        self._pending = bytearray()
+        self._pending_t = 0.0              # client time of _pending[0]
+        self.offset: Optional[float] = None
+        self.next_seq: Optional[int] = None
+        self.next_t = 0.0
+        self.frames = 0
+        self.frames_lost = 0
+        self.bad_frames = 0
+
+    def start(self):
+        pass
 
-    def score_and_send_freestyle():
-        """Finalize current freestyle buffer, compute judge scores, send."""
-        nonlocal freestyle_finalized
-        if freestyle_finalized:
+    def reconnect(self):
+        """A resumed client streams on a new connection: its sequence numbers
+        and capture clock start over, and a half-built block can't be joined up."""
+        self._pending.clear()
+        self.offset = None
+        self.next_seq = None
+
+    def feed(self, frame: bytes):
+        hdr = AUDIO_FRAME_HEADER
+        if len(frame) < hdr.size or (len(frame) - hdr.size) % 2:
+            self.bad_frames += 1
             return
-        freestyle_finalized = True
+        seq, t = hdr.unpack_from(frame)
+        pcm = memoryview(frame)[hdr.size:]
+        dur = len(pcm) / (2.0 * SAMPLE_RATE)
+        off = monotonic() - (t + dur)
+        self.offset = off if self.offset is None else min(self.offset, off)
+
+        if self.next_seq is not None:
+            if seq < self.next_seq:        # duplicate or too late to place
+                self.bad_frames += 1
+                return
+            if seq != self.next_seq:
+                self.frames_lost += seq - self.next_seq
+                metrics.inc("audio_frames_lost", seq - self.next_seq)
+                gap = t - self.next_t
+                if 0.0 < gap <= AUDIO_GAP_FILL_SEC:
+                    self._pending += bytes(int(gap * SAMPLE_RATE) * 2)
+        # _pending ends where this frame starts; anything not filled above
+        # (a long loss, a client clock jump) moves the stamps rather than
+        # leaving every later block late by the gap
+        self._pending_t = t - len(self._pending) / (2.0 * SAMPLE_RATE)
+        self.next_seq = seq + 1
+        self.next_t = t + dur
+        self.frames += 1
+        self._pending += pcm
+
+        block_bytes = BLOCKSIZE * 2
+        while len(self._pending) >= block_bytes:
+            self._pending_t += BLOCK_SEC
+            with memoryview(self._pending) as mv:
+                self.ring.push(mv[:block_bytes], self._pending_t + self.offset)
+            del self._pending[:block_bytes]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"blocks": self.ring.blocks, "frames": self.frames,
+                "frames_lost": self.frames_lost, "bad_frames": self.bad_frames,
+                "offset_ms": round(self.offset * 1000.0, 1) if self.offset is not None else None}
+
+class DecodeWorker:
+    """Drains a Subscriber on its own thread and hands each block to `handler(now, audio_bytes)`."""
+
+    def __init__(self, source: Subscriber, handler, name: str = "vosk-decode"):
+        self.source = source
+        self.handler = handler
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._seen_dropped = 0
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.source.wake()
+        self._thread.join(timeout=2.0)
+
+    def _run(self):
+        while not self._stop.is_set():
+            item = self.source.pop(timeout=BLOCK_SEC * 2)
+            if item is None:
+                continue
+            view, stamp, seq = item
+            metrics.observe("queue_depth_blocks", self.source.depth())
+            audio_bytes = bytes(view)  # Kaldi wants bytes; copy on this thread, not capture's
+            if not self.source.still_valid(seq):
+                self.source.dropped += 1
+                audio_bytes = None
+            if audio_bytes is not None:
+                try:
+                    self.handler(stamp, audio_bytes)
+                except Exception as e:
+                    log.error("Decode error: %s", e)
 
-        # Pull any last result from recognizer
-        try:
-            res = json.loads(active_rec.Result())
-            txt_piece = (res.get("text") or "").strip()
-            if txt_piece:
-                freestyle_buffer.append(txt_piece)
-        except Exception:
-            pass
+            if self.source.dropped != self._seen_dropped:
+                metrics.inc("blocks_dropped", self.source.dropped - self._seen_dropped)
+                self._seen_dropped = self.source.dropped
+                log.warning("⚠️ Decoder lagging, audio dropped: %s", self.source.stats())
 
-        text = " ".join(freestyle_buffer).strip()
-        words = tokenize_words(text)
-        lines = split_lines_for_rap(text)
+# =========================
+# Voice session (decode state for one client)
+# =========================
+class VoiceSession:
+    """Command/freestyle decode state for one client, independent of where the
+    audio comes from and where messages go. `emit(obj)` is called on the
+    decoder thread; the websocket handler and speech_bench.py supply their own.
+    `clock` must tick on the same timeline as the block stamps. `timer(delay, fn)`,
+    if given, runs fn off the decoder thread after `delay` seconds; it closes
+    listen windows on time when audio stalls. `model` is the LanguageModel the
+    recognizers came from (default: the default language's)."""
+
+    def __init__(self, recognizers: tuple, emit, clock=monotonic, timer=None,
+                 model: Optional[LanguageModel] = None, lang: Optional[str] = None):
+        self.model = model or registry.get(MODEL_DEFAULT_LANG)
+        self.lang = lang or self.model.lang
+        self.pair = recognizers
+        self.recognizer_cmd, self.recognizer_free = recognizers
+        self.pool_cmd = self.recognizer_cmd     # full-grammar recognizer from the pool pair
+        self.grammar_name = "all"
+        self.grammar_key: Optional[str] = None  # GrammarCache key while a set_grammar recognizer is active
+        self.trie = self.model.trie
+        self.emit = emit
+        self.clock = clock
+        self.timer = timer
+
+        # decode budget: EWMA of block decode time / block length
+        self.load = 0.0
+        self.shedding = False           # over SESSION_LOAD_BUDGET: no partials, no mid-freestyle command lane
+
+        # --- state
+        self.mode: str = "command"          # "command" | "freestyle"
+        self.active_rec = self.recognizer_cmd
+        self.last_final_text = ""
+        self.last_final_time = -math.inf   # clocks may start near 0 (file replay, bench)
+        self.last_sent_time  = -math.inf
+        self.last_voice_time: Optional[float] = None   # end of the latest speech frame
+
+        # VAD + silence skipping: Kaldi only sees speech, a little pre-roll
+        # and enough trailing silence to endpoint
+        self.vad = FrameVAD(SAMPLE_RATE, VAD_FRAME_MS, VAD_THRESHOLD_DB,
+                            min_speech_db=VAD_MIN_SPEECH_DB, hangover_ms=VAD_HANGOVER_MS)
+        self.preroll: collections.deque = collections.deque(maxlen=VAD_PREROLL_BLOCKS)
+        self.feeding = False            # Kaldi is receiving audio
+        self.utterance_voiced = False   # speech seen since the last freestyle segment
+        self.cmd_voiced = False         # speech seen since the last command final
+        self.skipped_blocks = 0
+
+        # freestyle window state
+        self.window_deadline: Optional[float] = None
+        self.window_start = 0.0
+        self.window_sec = 0.0
+        self.window_bpm = 92.0
+        self.window_grid = "eighth"
+        self.freestyle_buffer: List[str] = []
+        self.judge = self.new_judge()              # rolling scores, fed one final chunk at a time
+        self.judge_dirty = False                   # chunks landed since the last progress message
+        self.last_progress_time = -math.inf
+        # (recognizer fed_sec, capture time) at each point feeding resumed after a skip
+        self.timeline: List[tuple] = []
+        self.last_fed_end: Optional[float] = None
+        self.last_stamp: Optional[float] = None   # capture time of the newest block seen
+        self.freestyle_finalized: bool = False
+        self.window_id = 0              # bumps per listen_window, so a stale timer is a no-op
+        self.closed = False
+        self.cur_partial: str = ""
+
+        # command lane during freestyle (CONCURRENT_COMMANDS); created on first use
+        self.cmd_lane: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+        # latency tracing: the utterance each lane is decoding, and sent ones awaiting a client ack
+        self.traces: Dict[str, Optional[UtteranceTrace]] = {"command": None, "freestyle": None}
+        self.next_trace_id = 1
+        self.inflight: "collections.OrderedDict[int, UtteranceTrace]" = collections.OrderedDict()
+        self.trace_lock = threading.Lock()
+
+        # early command commit: phrase the partial resolves to, and for how many blocks
+        self.early_phrase: Optional[str] = None
+        self.early_blocks = 0
+
+        # partial subscription (set_partials)
+        self.partials_enabled = False
+        self.partial_interval = PARTIAL_MIN_INTERVAL_SEC
+        self.last_partial_text = ""
+        self.last_partial_time = -math.inf
+
+        # control messages (event loop) and the decoder thread both touch the state above
+        self.lock = threading.Lock()
+
+    def reset_command_lane(self):
+        self.traces["command"] = None
+        self.early_phrase = None
+        self.early_blocks = 0
+        self.cmd_voiced = False
+
+    def reset_vad_gate(self, keep_commands: bool = False):
+        """Fresh gate and freestyle segment state. keep_commands leaves the command
+        lane mid-utterance (concurrent mode: a "stop" said across a switch still lands)."""
+        self.traces["freestyle"] = None
+        self.preroll.clear()
+        self.timeline = []
+        self.last_fed_end = None
+        self.utterance_voiced = False
+        if keep_commands:
+            return
+        self.reset_command_lane()
+        self.feeding = False
+        self.vad.reset_utterance()
 
-        # --- judging ---
-        total_ms = 0.0
-        if window_deadline is not None:
-            # we don't know start_ms precisely here; approximate via last window length we were given
-            # The caller (Godot) knows "ms" and uses that for timing; we just evaluate content ratios.
-            pass
+    def switch_mode(self, m: str):
+        if m == self.mode:
+            return
+        # reset recognizers to avoid leakage; with CONCURRENT_COMMANDS the
+        # command recognizer never stops, so only dictation starts over
+        if not CONCURRENT_COMMANDS:
+            self.recognizer_cmd.Reset()
+        self.recognizer_free.Reset()
+        self.reset_vad_gate(keep_commands=CONCURRENT_COMMANDS)
+        if m == "freestyle":
+            self.mode = "freestyle"
+            self.active_rec = self.recognizer_free
+            self.freestyle_buffer = []
+            self.judge = self.new_judge()
+            self.window_deadline = None
+            self.freestyle_finalized = False
+            self.cur_partial = ""
+            log.info("🎤 Mode -> FREESTYLE")
+        else:
+            self.mode = "command"
+            self.active_rec = self.recognizer_cmd
+            self.window_deadline = None
+            self.freestyle_finalized = False
+            self.cur_partial = ""
+            log.info("🎮 Mode -> COMMAND")
+
+    def new_judge(self) -> FreestyleJudge:
+        return FreestyleJudge(self.window_sec, self.window_bpm, self.window_grid)
+
+    def send_progress(self, now: float):
+        """Throttled live judge snapshot while the window is open (only after new chunks)."""
+        if (not self.judge_dirty or FREESTYLE_PROGRESS_SEC <= 0 or self.freestyle_finalized
+                or now - self.last_progress_time < FREESTYLE_PROGRESS_SEC):
+            return
+        self.judge_dirty = False
+        self.last_progress_time = now
+        metrics.inc("freestyle_progress")
+        self.emit({
+            "type": "freestyle_progress",
+            "lane": "freestyle",
+            "elapsed": round(max(0.0, now - self.window_start), 3),
+            "window_sec": self.window_sec,
+            "words": len(self.judge.words),
+            "judge": self.judge.result(),
+        })
+
+    def expire_window(self, window_id: int):
+        """Timer path: close the window even if its last audio block never came."""
+        with self.lock:
+            if (self.closed or window_id != self.window_id or self.freestyle_finalized
+                    or self.window_deadline is None):
+                return
+            metrics.inc("windows_forced")
+            log.warning("⏰ Listen window closed by timer (audio %.0f ms short of the deadline).",
+                        max(0.0, self.window_deadline - (self.last_stamp or self.window_start)) * 1000.0)
+            self.score_and_send_freestyle()
+
+    def window_slice(self, stamp: float, chunk: bytes) -> Optional[tuple]:
+        """(stamp, chunk) cut to the listen window by capture time: audio from
+        before listen_window or after the deadline isn't judged."""
+        if self.window_deadline is None:
+            return stamp, chunk
+        start = stamp - len(chunk) / (2.0 * SAMPLE_RATE)
+        lo, hi = self.window_start, self.window_deadline
+        if stamp <= lo or start >= hi:
+            return None
+        if start < lo:
+            chunk = chunk[round((lo - start) * SAMPLE_RATE) * 2:]
+        if stamp > hi:
+            chunk = chunk[:max(0, len(chunk) - round((stamp - hi) * SAMPLE_RATE) * 2)]
+            stamp = hi
+        return (stamp, chunk) if chunk else None
+
+    def score_and_send_freestyle(self, now: Optional[float] = None):
+        """Finalize current freestyle buffer and send; the judge is already up to date."""
+        if self.freestyle_finalized:
+            return
+        self.freestyle_finalized = True
+        if self.window_deadline is not None:
+            # requested vs actual close, on the capture clock
+            jitter = self.clock() - self.window_deadline
+            metrics.observe("window_close_late_ms", max(0.0, jitter) * 1000.0)
+            if jitter < 0:
+                metrics.inc("windows_closed_early")
 
-        word_count = len(words)
-        uniq_ratio = (len(set(words)) / word_count) if word_count else 0.0
-        rhyme = rhyme_density(lines)
-
-        # on-beat: approximate target words-per-second from bpm and grid
-        # Assume 4/4, words per beat ~= 0.75 baseline (tweakable)
-        # words_per_sec_target = (bpm / 60.0) * 0.75
-        # Instead, infer from observed speaking rate vs a reasonable rap rate (2.5–4.5 wps).
-        # Without exact time here, we approximate by text structure: longer lines get a mild bonus.
-        avg_line_len = sum(len(tokenize_words(ln)) for ln in lines) / max(1, len(lines))
-        onbeat = clamp01((avg_line_len / 8.0))  # 8 words per line considered "on-beat" sweet spot
-
-        # completion: did they say "enough"? Use total word_count as proxy against a soft minimum.
-        completion = clamp01(word_count / 24.0)  # 24+ words ≈ full credit for a short (2-bar) turn
-
-        # weighted total
-        # You can tweak these. Keep simple and readable.
-        rhyme_w     = 0.35
-        onbeat_w    = 0.20
-        variety_w   = 0.20
-        complete_w  = 0.25
-
-        total = (rhyme * rhyme_w) + (onbeat * onbeat_w) + (uniq_ratio * variety_w) + (completion * complete_w)
-        total = clamp01(total)
-        rank  = rank_from_total(total)
-
-        judge = {
-            "rhyme": round(rhyme, 3),
-            "onbeat": round(onbeat, 3),
-            "variety": round(uniq_ratio, 3),
-            "complete": round(completion, 3),
-            "total": round(total, 3),
-            "rank": rank
-        }
+        # Pull any last result from recognizer
+        self.append_freestyle_result(self.active_rec)
 
-        print(f"[FREESTYLE FINAL] words={word_count} judge={judge}")
-        asyncio.run_coroutine_threadsafe(send_json({
+        text = " ".join(self.freestyle_buffer).strip()
+        words = self.judge.words
+        judge = self.judge.result()
+
+        log.info("[FREESTYLE FINAL] words=%d late=%.0fms judge=%s", len(words),
+                 max(0.0, self.clock() - self.window_deadline) * 1000.0 if self.window_deadline is not None else 0.0,
+                 judge)
+        self.finish_trace(self.clock() if now is None else now, "freestyle_finals", {
             "type": "freestyle_final",
+            "lane": "freestyle",
             "text": text,
             "words": words,
             "judge": judge
-        }), loop)
+        }, lane="freestyle")
 
         # reset recognizer after final to avoid carry over
-        active_rec.Reset()
+        self.active_rec.Reset()
 
-    def handle_command_final(now: float):
-        nonlocal last_final_text, last_final_time, last_sent_time
+    def handle_command_final(self, now: float):
+        self.early_phrase = None
+        self.early_blocks = 0
         try:
-            res  = json.loads(active_rec.Result())
+            res  = json.loads(self.recognizer_cmd.Result())
         except json.JSONDecodeError:
             return
         raw  = res.get("text") or ""
         text = normalize_final(raw)
         if not text:
+            self.finish_trace(now, "empty_finals")
             return
 
         if text == "[unk]":
-            print(f"[VOICE FINAL UNK]")
-            log_unmatched("[unk]")
-            active_rec.Reset()
+            log.debug("[VOICE FINAL UNK]")
+            if self.mode == "command":
+                self.finish_trace(now, "unk")
+                log_unmatched("[unk]")
+            else:
+                self.finish_trace(now, "freestyle_cmd_rejects")
+            self.recognizer_cmd.Reset()
             return
 
-        if text == last_final_text and (now - last_final_time) < MIN_GAP_BETWEEN_FINALS:
+        self.dispatch_command(now, text)
+        self.recognizer_cmd.Reset()
+
+    def dispatch_command(self, now: float, text: str, early: bool = False):
+        """Debounce, match and rate-limit one command, then send `final`. An
+        early commit goes through here too, so the real final that follows
+        it is dropped by the same debounce/cooldown."""
+        if early and self.traces["command"] is not None:
+            self.traces["command"].early = True
+        phrase = pick_phrase(text, self.trie)
+        if self.mode == "freestyle" and COMMAND_OF.get(phrase) not in FREESTYLE_COMMANDS:
+            # command lane running under a rap: lyrics aren't commands, and
+            # mustn't debounce a real one said right after
+            self.finish_trace(now, "freestyle_cmd_rejects")
             return
-        last_final_text = text
-        last_final_time = now
+        if text == self.last_final_text and (now - self.last_final_time) < MIN_GAP_BETWEEN_FINALS:
+            self.finish_trace(now, "debounced")
+            return
+        self.last_final_text = text
+        self.last_final_time = now
 
-        phrase = pick_phrase(text)
         if not phrase:
-            print(f"[VOICE FINAL UNMATCHED] {text}")
+            log.debug("[VOICE FINAL UNMATCHED] %s", text)
+            self.finish_trace(now, "unmatched")
             log_unmatched(text)
-            active_rec.Reset()
             return
 
-        if (now - last_sent_time) < SERVER_COOLDOWN:
+        if (now - self.last_sent_time) < SERVER_COOLDOWN:
+            self.finish_trace(now, "cooldown_drops")
             return
-        last_sent_time = now
-
-        print(f"[VOICE FINAL] {text}  ->  [{phrase}]")
-        asyncio.run_coroutine_threadsafe(send_json({"type": "final", "text": phrase}), loop)
-        active_rec.Reset()
+        self.last_sent_time = now
+
+        log.info("[VOICE %s] %s  ->  [%s]", "EARLY" if early else "FINAL", text, phrase)
+        if early:
+            metrics.inc("early_commits")
+        self.finish_trace(now, "finals_sent", {"type": "final", "text": phrase,
+                                                 "command": COMMAND_OF.get(phrase, phrase), "lane": "command"})
+
+    def check_early_commit(self, now: float, ptxt: str):
+        """Send `final` as soon as the partial has named one phrase, unambiguously,
+        for EARLY_COMMIT_BLOCKS blocks in a row; Kaldi keeps decoding to its endpoint."""
+        phrase = self.trie.resolve(normalize_final(ptxt)) if ptxt else None
+        if phrase != self.early_phrase:
+            self.early_phrase = phrase
+            self.early_blocks = 0
+        if phrase is None:
+            return
+        self.early_blocks += 1
+        if self.early_blocks == EARLY_COMMIT_BLOCKS:
+            self.dispatch_command(now, phrase, early=True)
+
+    # ----- latency tracing -----
+    def lanes(self) -> tuple:
+        if self.mode == "command":
+            return ("command",)
+        return ("freestyle", "command") if CONCURRENT_COMMANDS else ("freestyle",)
+
+    def start_trace(self, now: float):
+        """Called on each voiced block (decoder thread, before the lanes run):
+        opens a trace per lane at utterance onset and keeps last-voiced current."""
+        for lane in self.lanes():
+            tr = self.traces[lane]
+            if tr is None:
+                if lane == "command" and self.cmd_voiced:
+                    continue                    # rest of an utterance already committed early
+                tr = self.traces[lane] = UtteranceTrace(self.next_trace_id, lane, now - BLOCK_SEC)
+                self.next_trace_id += 1
+            tr.last_voiced = self.last_voice_time
+
+    def finish_trace(self, now: float, outcome: str, msg: Optional[Dict[str, Any]] = None,
+                     lane: str = "command"):
+        """Count the utterance outcome and close the lane's trace. A message that
+        goes out is tagged with the trace id so on_sent()/on_ack() can time it."""
+        metrics.inc(outcome)
+        tr, self.traces[lane] = self.traces[lane], None
+        if tr is not None:
+            tr.endpoint = now
+            tr.decoded = self.clock()
+            if msg is not None:
+                msg["id"] = tr.id
+                with self.trace_lock:
+                    self.inflight[tr.id] = tr
+                    while len(self.inflight) > TRACE_INFLIGHT_MAX:
+                        self.inflight.popitem(last=False)
+            else:
+                tr.record()
+        if msg is not None:
+            self.emit(msg)
+
+    def on_sent(self, uid: int):
+        """The message for trace `uid` was written to the socket (event loop)."""
+        with self.trace_lock:
+            tr = self.inflight.get(uid)
+        if tr is not None and tr.sent is None:
+            tr.sent = self.clock()
+            tr.record()
+            log.debug("⏱️ trace %d %s: %s", uid, tr.prefix(), tr.stages_ms())
+
+    def on_ack(self, uid: int):
+        """Client echoed {type:"ack", id} after acting on the message."""
+        with self.trace_lock:
+            tr = self.inflight.pop(uid, None)
+        if tr is not None and tr.sent is not None:
+            tr.ack = self.clock()
+            metrics.observe(f"{tr.prefix()}_ack_ms", (tr.ack - tr.sent) * 1000.0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "lang": self.lang,
+            "model": self.model.lang,
+            "grammar": self.grammar_name,
+            "vad": self.vad.stats(),
+            "skipped_blocks": self.skipped_blocks,
+            "awaiting_ack": len(self.inflight),
+            "load": round(self.load, 3),
+            "shedding": self.shedding,
+        }
 
-    def handle_freestyle_stream(now: float, audio_bytes: bytes, is_silence: bool):
-        nonlocal silence_start, cur_partial
-        got_final = active_rec.AcceptWaveform(audio_bytes)
-        if got_final:
-            # append final chunk text
+    def feed(self, rec, stamp: float, chunk: bytes) -> bool:
+        """AcceptWaveform, remembering where the recognizer's timeline jumps
+        relative to capture time (blocks skipped by the VAD gate)."""
+        start = stamp - len(chunk) / (2.0 * SAMPLE_RATE)
+        fed_sec = getattr(rec, "fed_sec", None)
+        if fed_sec is not None and (self.last_fed_end is None or abs(start - self.last_fed_end) > 1e-3):
+            self.timeline.append((fed_sec, start))
+        self.last_fed_end = stamp
+        return rec.AcceptWaveform(chunk)
+
+    def to_capture_time(self, rec_sec: float) -> float:
+        """Map a Vosk word time (recognizer timeline) to capture time."""
+        i = bisect.bisect_right(self.timeline, (rec_sec, math.inf)) - 1
+        if i < 0:
+            if not self.timeline:
+                return rec_sec
+            i = 0
+        fed, cap = self.timeline[i]
+        return cap + (rec_sec - fed)
+
+    def append_freestyle_result(self, rec):
+        try:
+            res = json.loads(rec.Result())
+        except Exception:
+            return
+        txt = (res.get("text") or "").strip()
+        if not txt:
+            return
+        self.freestyle_buffer.append(txt)
+        timed = []     # (word, start, end) in window seconds
+        for w in res.get("result") or ():
             try:
-                res = json.loads(active_rec.Result())
-                txt = (res.get("text") or "").strip()
-                if txt:
-                    freestyle_buffer.append(txt)
-            except Exception:
+                timed.append((str(w["word"]),
+                              self.to_capture_time(float(w["start"])) - self.window_start,
+                              self.to_capture_time(float(w["end"])) - self.window_start))
+            except (KeyError, TypeError, ValueError):
                 pass
-            silence_start = None
-            return
+        self.judge.add(txt, timed)
+        self.judge_dirty = True
+
+    def handle_freestyle_stream(self, now: float, chunks: List[tuple]):
+        rec = self.recognizer_free
+        if self.freestyle_finalized:
+            chunks = []                 # window already closed (timer); wait for the next one
+        elif self.window_deadline is not None:
+            chunks = [c for c in (self.window_slice(*c) for c in chunks) if c is not None]
+        for stamp, chunk in chunks:
+            if self.feed(rec, stamp, chunk):
+                # append final chunk text
+                self.append_freestyle_result(rec)
+                self.utterance_voiced = False
+
+        # track partial (only when a client subscribed or DEBUG logging is on)
+        if chunks:
+            self.poll_partial(now, rec, "freestyle")
+        self.send_progress(now)
 
-        # track partial (optional; not sent to client to keep bandwidth tiny)
+        # silence → nudge segment
+        if self.utterance_voiced and self.vad.trailing_silence >= END_SILENCE_SEC:
+            rec.AcceptWaveform(b"")
+            self.append_freestyle_result(rec)
+            self.utterance_voiced = False
+            self.vad.reset_utterance()
+
+        # window deadline check
+        if self.window_deadline is not None and now >= self.window_deadline:
+            self.score_and_send_freestyle(now)
+
+    def poll_partial(self, now: float, rec, lane: str):
+        """Read a lane's partial only if something uses it: early command commit,
+        a client subscription (set_partials) or DEBUG logging. Subscribed clients
+        get throttled `partial` messages for the session's own mode only."""
+        if self.shedding:
+            return
+        early = lane == "command" and EARLY_COMMIT_BLOCKS > 0
+        shown = lane == self.mode and (self.partials_enabled or log.isEnabledFor(logging.DEBUG))
+        if not (early or shown):
+            return
         try:
-            pres = json.loads(active_rec.PartialResult())
-            ptxt = (pres.get("partial") or "").strip().lower()
-            cur_partial = ptxt
-            if ptxt:
-                print(f"[FREESTYLE PARTIAL] {ptxt}")
+            pres = json.loads(rec.PartialResult())
         except json.JSONDecodeError:
-            pass
+            return
+        ptxt = (pres.get("partial") or "").strip().lower()
+        if early:
+            self.check_early_commit(now, ptxt)
+        if lane != self.mode:
+            return
+        self.cur_partial = ptxt
+        if not ptxt:
+            return
+        log.debug("[%s PARTIAL] %s", "VOICE" if lane == "command" else "FREESTYLE", ptxt)
+        if (self.partials_enabled and ptxt != self.last_partial_text
+                and (now - self.last_partial_time) >= self.partial_interval):
+            self.last_partial_text = ptxt
+            self.last_partial_time = now
+            self.emit({"type": "partial", "mode": lane, "text": ptxt})
+
+    def gate(self, now: float, audio_bytes: bytes, voiced: bool) -> List[tuple]:
+        """Decide which (stamp, block)s Kaldi gets: speech (plus pre-roll on onset)
+        and up to VAD_FEED_SILENCE_SEC of trailing silence. Long quiet stretches are skipped."""
+        if voiced or self.vad.in_speech:
+            chunks = [(now, audio_bytes)]
+            if not self.feeding:
+                chunks = list(self.preroll) + chunks
+                self.preroll.clear()
+            self.feeding = True
+            return chunks
+        if self.feeding and self.vad.trailing_silence < VAD_FEED_SILENCE_SEC:
+            return [(now, audio_bytes)]
+        self.feeding = False
+        self.preroll.append((now, audio_bytes))
+        self.skipped_blocks += 1
+        return []
+
+    def process_block(self, now: float, audio_bytes: bytes):
+        self.last_stamp = now
+        voiced = self.vad.process(audio_bytes)
+        if voiced:
+            self.last_voice_time = now - self.vad.trailing_silence
+            self.start_trace(now)
+            self.utterance_voiced = True
+            self.cmd_voiced = True
+        chunks = self.gate(now, audio_bytes, voiced)
+
+        if self.mode == "command":
+            self.command_step(now, chunks)
+        elif CONCURRENT_COMMANDS and not self.shedding:
+            # both recognizers on the same blocks at once. Vosk releases the GIL
+            # inside AcceptWaveform, so the command lane gets its own core. Shared
+            # state: mode only changes under self.lock (held for the block); the
+            # VAD ran above, and the freestyle lane's reset_utterance() only
+            # clears speech_frames, which the command lane never reads; each
+            # lane opens and closes only traces[lane]; metrics and emit lock.
+            fut = self.command_lane().submit(self.command_step, now, chunks)
+            try:
+                self.handle_freestyle_stream(now, chunks)
+            finally:
+                fut.result()
+        else:
+            self.handle_freestyle_stream(now, chunks)
+
+    def command_lane(self) -> concurrent.futures.ThreadPoolExecutor:
+        if self.cmd_lane is None:
+            self.cmd_lane = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="vosk-cmd")
+        return self.cmd_lane
+
+    def command_step(self, now: float, chunks: List[tuple]):
+        """Grammar recognizer on this block's chunks: finals, VAD endpoint, early commit."""
+        rec = self.recognizer_cmd
+        for _, chunk in chunks:
+            if rec.AcceptWaveform(chunk):
+                self.handle_command_final(now)
+                self.cmd_voiced = False
+
+        # VAD endpoint: speech then ENDPOINT_SILENCE_SEC of quiet → final now,
+        # instead of waiting for Kaldi's own (longer) endpoint rules
+        if self.cmd_voiced and self.vad.trailing_silence >= ENDPOINT_SILENCE_SEC:
+            rec.AcceptWaveform(b"")
+            self.handle_command_final(now)
+            self.cmd_voiced = False
+        elif chunks:
+            # partials are opt-in; skipped entirely when nobody listens
+            self.poll_partial(now, rec, "command")
+
+    def decode_block(self, now: float, audio_bytes: bytes):
+        """DecodeWorker handler: runs on the decoder thread."""
+        t0 = perf_counter()
+        with self.lock:
+            self.process_block(now, audio_bytes)
+        dt = perf_counter() - t0
+        metrics.observe("block_decode_ms", dt * 1000.0)
+        metrics.inc("blocks_decoded")
+        metrics.inc("decode_sec", dt)
+
+        self.load += (dt / BLOCK_SEC - self.load) * SESSION_LOAD_EWMA
+        over = self.load > SESSION_LOAD_BUDGET
+        if over != self.shedding:
+            self.shedding = over
+            if over:
+                metrics.inc("sessions_shedding")
+                log.warning("⚠️ Session over decode budget (load %.2f); shedding partials and the command lane.", self.load)
+            else:
+                log.info("✅ Session back under decode budget (load %.2f).", self.load)
+
+    def set_grammar(self, data: Dict[str, Any]):
+        """{name} picks one of the model's GRAMMAR_SETS, {phrases:[...]} an ad-hoc set.
+        May compile a recognizer on a cache miss, so the websocket handler
+        runs this off the event loop."""
+        name = data.get("name")
+        phrases = data.get("phrases")
+        if phrases is not None:
+            if not isinstance(phrases, list):
+                self.emit({"type": "grammar", "error": "phrases must be a list"})
+                return
+            phrases = sorted({normalize_final(str(p)) for p in phrases} - {"", "[unk]"})[:GRAMMAR_MAX_PHRASES]
+            name = str(name or "custom")
+            if not phrases:
+                self.emit({"type": "grammar", "error": "no phrases"})
+                return
+            use_pool = False
+        else:
+            name = str(name or "all")
+            phrases = self.model.sets.get(name)
+            if phrases is None:
+                self.emit({"type": "grammar", "error": f"unknown grammar set '{name}'",
+                           "sets": sorted(self.model.sets)})
+                return
+            use_pool = name == "all"
 
-        # silence → nudge segment
-        if is_silence:
-            if silence_start is None:
-                silence_start = now
-            if (now - silence_start) >= END_SILENCE_SEC:
-                active_rec.AcceptWaveform(b"")
-                try:
-                    res = json.loads(active_rec.Result())
-                    txt = (res.get("text") or "").strip()
-                    if txt:
-                        freestyle_buffer.append(txt)
-                except Exception:
-                    pass
-                silence_start = None
+        cache = self.model.grammars
+        if use_pool:
+            key, rec, trie, cached = None, self.pool_cmd, self.model.trie, True
+        elif grammar_key(phrases) == self.grammar_key:
+            key, rec, trie, cached = self.grammar_key, self.recognizer_cmd, self.trie, True
         else:
-            silence_start = None
+            key, rec, trie, cached = cache.checkout(phrases)
+
+        with self.lock:
+            old_key, old_rec = self.grammar_key, self.recognizer_cmd
+            self.grammar_key, self.grammar_name = key, name
+            self.recognizer_cmd, self.trie = rec, trie
+            if old_rec is not rec:
+                old_rec.Reset()
+                if self.mode == "command":
+                    self.active_rec = rec
+                    self.reset_vad_gate()
+                else:
+                    self.reset_command_lane()
+        if old_key is not None and old_rec is not rec:
+            cache.checkin(old_key, old_rec)
+
+        log.info("🧩 Grammar -> %s (%d phrases, %s)", name, len(phrases), "cached" if cached else "compiled")
+        self.emit({"type": "grammar", "name": name, "phrases": len(phrases), "cached": cached})
+
+    def release_grammar(self):
+        """Hand a set_grammar recognizer back to the cache (session end, language switch)."""
+        if self.grammar_key is not None:
+            self.model.grammars.checkin(self.grammar_key, self.recognizer_cmd)
+        self.grammar_key = None
+        self.recognizer_cmd = self.pool_cmd
+        self.trie = self.model.trie
+
+    def set_language(self, data: Dict[str, Any]):
+        """{lang}: move the session onto the model that serves that language,
+        loading it on first use (seconds), so the websocket handler runs this
+        off the event loop. Refused in freestyle: dictation would start over."""
+        lang = str(data.get("lang") or MODEL_DEFAULT_LANG).lower()
+        lang = MODEL_LANG_ALIASES.get(lang, lang)
+        pick = None
+        try:
+            if self.mode == "freestyle":
+                raise RuntimeError("finish the listen window first")
+            if registry.model_lang(lang) != self.model.lang:
+                pick = registry.checkout(lang, new_session=False)
+                if pick is None:
+                    raise RuntimeError("recognizer pool exhausted")
+        except Exception as e:             # unknown, over the memory budget, or the model failed to load
+            log.warning("⚠️ Language %s unavailable: %s", lang, e)
+            self.emit({"type": "language", "error": str(e), "lang": self.lang,
+                       "languages": registry.languages()})
+            return
 
-        # window deadline check
-        if window_deadline is not None and now >= window_deadline:
-            score_and_send_freestyle()
+        grammar = self.grammar_name
+        if pick is not None:
+            model, pair = pick
+            with self.lock:
+                moved = self.mode != "freestyle"   # a listen window may have opened while the model loaded
+                if moved:
+                    self.release_grammar()
+                    model, self.model = self.model, model
+                    pair, self.pair = self.pair, pair
+                    self.recognizer_cmd, self.recognizer_free = self.pair
+                    self.pool_cmd = self.active_rec = self.recognizer_cmd
+                    self.trie = self.model.trie
+                    self.grammar_name = "all"
+                    self.reset_vad_gate()
+            registry.checkin(model, pair, end_session=False)   # whichever pair the session isn't using
+            if not moved:
+                self.emit({"type": "language", "error": "finish the listen window first", "lang": self.lang,
+                           "languages": registry.languages()})
+                return
+        self.lang = lang
 
-    # ---- audio callback ----
-    def callback(indata, frames, t, status):
-        nonlocal silence_start
-        audio_bytes = bytes(indata)
-        now = monotonic()
+        log.info("🌐 Language -> %s (model %s, %d phrases)", lang, self.model.lang, len(self.model.grammar) - 1)
+        self.emit({"type": "language", "lang": lang, "model": self.model.lang,
+                   "phrases": len(self.model.grammar) - 1, "switched": pick is not None})
+        if pick is not None and grammar != "all" and grammar in self.model.sets:
+            self.set_grammar({"name": grammar})    # same scene set, this language's phrases
 
-        try:
-            rms = audioop.rms(audio_bytes, 2)
-        except Exception:
-            rms = 0
-        is_silence = rms < SILENCE_RMS
-
-        if mode == "command":
-            got_final = active_rec.AcceptWaveform(audio_bytes)
-            if got_final:
-                handle_command_final(now)
-                silence_start = None
-                return
+    def handle_control(self, data: Dict[str, Any]):
+        """Apply one control message from the client. Takes the session lock, which
+        the decoder holds per block, so the websocket handler runs this off the loop."""
+        typ = data.get("type")
 
-            # segment on long silence to avoid buffering forever
-            if is_silence:
-                if silence_start is None:
-                    silence_start = now
-                if (now - silence_start) >= END_SILENCE_SEC:
-                    active_rec.AcceptWaveform(b"")
-                    handle_command_final(now)
-                    silence_start = None
-            else:
-                silence_start = None
+        if typ == "set_mode":
+            m = str(data.get("mode", "command"))
+            with self.lock:
+                self.switch_mode(m)
+
+        elif typ == "set_grammar":
+            self.set_grammar(data)
+
+        elif typ == "set_language":
+            self.set_language(data)
 
-            # lightweight partial logging
+        elif typ == "ack":
             try:
-                pres = json.loads(active_rec.PartialResult())
-                ptxt = (pres.get("partial") or "").strip().lower()
-                if ptxt:
-                    print(f"[VOICE PARTIAL] {ptxt}")
-            except json.JSONDecodeError:
+                self.on_ack(int(data.get("id")))
+            except (TypeError, ValueError):
                 pass
 
-        else:  # freestyle
-            handle_freestyle_stream(now, audio_bytes, is_silence)
+        elif typ == "set_partials":
+            # {enabled, interval_ms}
+            with self.lock:
+                self.partials_enabled = bool(data.get("enabled", True))
+                ms = data.get("interval_ms")
+                self.partial_interval = (max(0, int(ms)) / 1000.0) if ms is not None else PARTIAL_MIN_INTERVAL_SEC
+                self.last_partial_text = ""
+            log.info("💬 Partials %s (every >= %.2fs)",
+                     "on" if self.partials_enabled else "off", self.partial_interval)
+
+        elif typ == "listen_window":
+            # {ms, bpm, bars, grid}
+            ms   = int(data.get("ms", 4000))
+            bpm  = float(data.get("bpm", 92.0))
+            bars = int(data.get("bars", 2))
+            grid = str(data.get("grid", "eighth"))
+            log.info("🎧 LISTEN WINDOW: %dms, bpm=%s, bars=%d, grid=%s", ms, bpm, bars, grid)
+            with self.lock:
+                self.switch_mode("freestyle")
+                # start a fresh window
+                self.recognizer_free.Reset()
+                self.reset_vad_gate(keep_commands=CONCURRENT_COMMANDS)
+                self.freestyle_finalized = False
+                self.freestyle_buffer = []
+                start = self.clock()
+                self.window_start = start
+                self.window_sec = ms / 1000.0
+                self.window_bpm = bpm
+                self.window_grid = grid
+                self.window_deadline = start + (ms / 1000.0)
+                self.judge = self.new_judge()
+                self.judge_dirty = False
+                self.last_progress_time = start
+                self.window_id += 1
+                if self.timer is not None:
+                    wid = self.window_id
+                    self.timer(ms / 1000.0 + WINDOW_TIMER_SLACK_SEC, lambda: self.expire_window(wid))
+
+        else:
+            # unknown control message; ignore
+            pass
+
+    def close(self):
+        """Call after the decoder thread has stopped."""
+        with self.lock:
+            self.closed = True          # pending window timers become no-ops
+        # If they disconnect mid-window, finalize what we have
+        if self.mode == "freestyle":
+            log.warning("⚠️ Client disconnected during freestyle; finalizing.")
+            # best-effort final send
+            try:
+                # push a final empty buffer to flush
+                self.recognizer_free.AcceptWaveform(b"")
+            except Exception:
+                pass
+        if self.cmd_lane is not None:
+            self.cmd_lane.shutdown(wait=True)
+            self.cmd_lane = None
+        self.release_grammar()
+
+# =========================
+# Outbound queue
+# - emit() serializes on the caller's (decoder) thread and only wakes the loop
+#   when the queue goes from empty to non-empty
+# - one writer task per connection drains everything queued in one pass
+# - partial / freestyle_progress are latest-wins per lane: a newer one replaces
+#   the queued one, and a final for that lane drops it (stale under backpressure)
+# =========================
+DROPPABLE = frozenset(["partial", "freestyle_progress"])
+
+class Outbox:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self._lock = threading.Lock()
+        self._items: collections.deque = collections.deque()   # [key, payload, id, stale_at]; key set = droppable
+        self._latest: Dict[tuple, list] = {}
+        self._wake = asyncio.Event()
+        self._armed = False            # a wake-up is pending on the loop
+        self.attached = False
+
+    def put(self, obj: Dict[str, Any]):
+        payload = json.dumps(obj)
+        typ = obj.get("type")
+        lane = obj.get("lane") or obj.get("mode")
+        with self._lock:
+            if typ in DROPPABLE:
+                if not self.attached:
+                    metrics.inc("outbox_dropped")
+                    return
+                key = (typ, lane)
+                self._drop_queued(key)
+                item = self._latest[key] = [key, payload, None, None]
+            else:
+                for typ_ in DROPPABLE:
+                    self._drop_queued((typ_, lane))
+                stale_at = monotonic() + OUTBOX_FINAL_TTL_SEC if typ == "final" else None
+                item = [None, payload, obj.get("id"), stale_at]
+                if not self.attached and len(self._items) >= OUTBOX_DETACHED_MAX:
+                    self._items.popleft()
+                    metrics.inc("outbox_dropped")
+            self._items.append(item)
+            wake = self.attached and not self._armed
+            self._armed = self._armed or wake
+        if wake:
+            self.loop.call_soon_threadsafe(self._wake.set)
+
+    def _drop_queued(self, key: tuple):
+        old = self._latest.pop(key, None)
+        if old is not None:
+            old[1] = None
+            metrics.inc("outbox_coalesced")
+
+    def _take(self) -> List[list]:
+        with self._lock:
+            batch = list(self._items)
+            self._items.clear()
+            self._latest.clear()
+            self._armed = False
+        return batch
+
+    def _requeue(self, items: List[list]):
+        """Unsent reliable messages go back to the front (for a resumed client)."""
+        keep = [it for it in items if it[0] is None and it[1] is not None]
+        with self._lock:
+            self._items.extendleft(reversed(keep))
+
+    def attach(self, first: Optional[Dict[str, Any]] = None):
+        """Start delivering; `first` goes out ahead of anything held while detached."""
+        now = monotonic()
+        with self._lock:
+            for item in self._items:
+                if item[3] is not None and item[3] < now and item[1] is not None:
+                    item[1] = None         # a late "stop" or "load_level" is worse than none
+                    metrics.inc("outbox_expired")
+            if first is not None:
+                self._items.appendleft([None, json.dumps(first), None, None])
+            self.attached = True
+            self._armed = bool(self._items)
+        if self._armed:
+            self._wake.set()
+
+    def detach(self):
+        with self._lock:
+            self.attached = False
+            for key in list(self._latest):
+                self._drop_queued(key)
+        self._wake.clear()
+
+    async def run(self, websocket, on_sent):
+        """Writer task: drain the queue onto `websocket` until cancelled or closed."""
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            batch = self._take()
+            i = 0
+            try:
+                metrics.observe("outbox_batch", len(batch))
+                for i, (key, payload, mid, _) in enumerate(batch):
+                    if payload is None:
+                        continue
+                    await websocket.send(payload)
+                    metrics.inc("messages_sent")
+                    if mid is not None:
+                        on_sent(mid)
+                i = len(batch)
+            except websockets.ConnectionClosed:
+                return
+            except Exception as e:
+                log.warning("Send error: %s", e)
+                return
+            finally:
+                if i < len(batch):
+                    self._requeue(batch[i:])
+
+# =========================
+# Live sessions (resumable)
+# - a session outlives its websocket for RESUME_GRACE_SEC: decoding goes on,
+#   finals are held in the outbox, and a reconnect with ?resume=<token>
+#   reattaches instead of starting cold; command finals older than
+#   OUTBOX_FINAL_TTL_SEC by then are dropped rather than acted on late
+# =========================
+class LiveSession:
+    """A VoiceSession with its recognizers, decoder thread and outbox (and,
+    for a streaming client, its own ClientAudioSource)."""
+
+    def __init__(self, model: LanguageModel, pair: tuple, lang: str, source: "AudioSource",
+                 loop: asyncio.AbstractEventLoop):
+        self.token = secrets.token_urlsafe(12)
+        self.source = source
+        self.loop = loop
+        self.stream = source if isinstance(source, ClientAudioSource) else None
+        self.outbox = Outbox(loop)
+        self.session = VoiceSession(pair, self.outbox.put, clock=source.now, timer=self.schedule,
+                                    model=model, lang=lang)
+        self.sub = source.subscribe()
+        self.worker = DecodeWorker(self.sub, self.session.decode_block)
+        self.expiry: Optional[asyncio.TimerHandle] = None
+        self.worker.start()
+        live_sessions.add(self)
+
+    def schedule(self, delay: float, fn):
+        """VoiceSession timer: fn on a worker thread after `delay` s (any thread may call).
+        The loop's clock is monotonic, like the capture stamps."""
+        loop = self.loop
+        loop.call_soon_threadsafe(loop.call_later, delay, loop.run_in_executor, None, fn)
+
+    def audio_stats(self) -> Dict[str, Any]:
+        out = self.sub.stats()
+        if self.stream is not None:
+            out["stream"] = self.stream.stats()
+        return out
+
+    def close(self):
+        live_sessions.discard(self)
+        self.worker.stop()
+        self.source.unsubscribe(self.sub)
+        self.session.close()
+        registry.checkin(self.session.model, self.session.pair)   # set_language may have moved it
+        log.info("📊 Audio pipeline: %s source=%s vad=%s skipped=%d",
+                 self.sub.stats(), self.source.stats(), self.session.vad.stats(), self.session.skipped_blocks)
+
+parked: "collections.OrderedDict[str, LiveSession]" = collections.OrderedDict()
+live_sessions: set = set()         # attached and parked
+metrics.gauge("sessions_parked", lambda: len(parked))
+metrics.gauge("sessions_live", lambda: len(live_sessions))
+
+def decode_load() -> float:
+    return sum(live.session.load for live in list(live_sessions))
+
+metrics.gauge("decode_load", lambda: round(decode_load(), 3))
+
+class Admission:
+    """Decode-load admission control. Every session reserves at least
+    ADMIT_SESSION_LOAD (quiet stations still talk eventually), and sessions
+    still being set up count too, so a burst of connects can't all slip in
+    before the first one shows up in live_sessions."""
+
+    def __init__(self):
+        self.pending = 0
+
+    def reserved(self) -> float:
+        live = sum(max(l.session.load, ADMIT_SESSION_LOAD) for l in list(live_sessions))
+        return live + self.pending * ADMIT_SESSION_LOAD
+
+    def room(self) -> bool:
+        return self.reserved() + ADMIT_SESSION_LOAD <= ADMIT_LOAD_FRACTION * (os.cpu_count() or 1)
+
+    def reserve(self) -> bool:
+        if not self.room():
+            return False
+        self.pending += 1
+        return True
+
+    def release(self):
+        self.pending -= 1
+
+admission = Admission()
+metrics.gauge("decode_reserved", lambda: round(admission.reserved(), 3))
+
+def park(live: LiveSession, loop: asyncio.AbstractEventLoop):
+    live.expiry = loop.call_later(RESUME_GRACE_SEC, expire, live.token)
+    parked[live.token] = live
+    log.info("⏸️ Session parked for %.0fs (token %s…)", RESUME_GRACE_SEC, live.token[:4])
+
+def unpark(token: str) -> Optional[LiveSession]:
+    live = parked.pop(token, None)
+    if live is not None and live.expiry is not None:
+        live.expiry.cancel()
+        live.expiry = None
+    return live
+
+def expire(token: str) -> Optional[asyncio.Future]:
+    """Close a parked session off the loop (joins its decoder thread)."""
+    live = unpark(token)
+    if live is None:
+        return None
+    log.info("⌛ Parked session expired.")
+    return asyncio.get_running_loop().run_in_executor(None, live.close)
+
+async def evict_oldest():
+    """Free a parked session's recognizers and load for a new client."""
+    fut = expire(next(iter(parked)))
+    if fut is not None:
+        await fut
+
+def query_params(websocket) -> Dict[str, str]:
+    """Query parameters of the websocket request path (?resume=<token>&audio=stream)."""
+    req = getattr(websocket, "request", None)
+    path = getattr(req, "path", None) or getattr(websocket, "path", None) or ""
+    return {k: v[0] for k, v in parse_qs(urlsplit(path).query).items()}
+
+# =========================
+# Client session handler
+# =========================
+async def handle_client(websocket, source: "AudioSource"):
+    loop = asyncio.get_running_loop()
+
+    async def send_json(obj: Dict[str, Any]):
+        try:
+            await websocket.send(json.dumps(obj))
+        except Exception as e:
+            log.warning("Send error: %s", e)
+
+    # Fast-start handshake: the port is open before the model is, so tell the
+    # client where we are and hold its control messages until ready.
+    if loader.state != "ready":
+        await send_json(loader.status())
+        ready = asyncio.ensure_future(loader.wait_ready())
+        closed = asyncio.ensure_future(websocket.wait_closed())
+        await asyncio.wait({ready, closed}, return_when=asyncio.FIRST_COMPLETED)
+        closed.cancel()
+        if not ready.done():
+            ready.cancel()
+            return
+    await send_json(loader.status())
+    if loader.state != "ready":
+        await websocket.close(1011, "speech model failed to load")
+        return
+
+    params = query_params(websocket)
+    token = params.get("resume")
+    live = unpark(token) if token else None
+    resumed = live is not None
+    if live is None:
+        streamed = CLIENT_AUDIO_ONLY or params.get("audio") == "stream"
+        lang = params.get("lang", MODEL_DEFAULT_LANG).lower()
+        lang = MODEL_LANG_ALIASES.get(lang, lang)
+
+        def checkout() -> Optional[tuple]:
+            # may load the language's model or build a recognizer pair; a language
+            # we can't serve (unknown, over the memory budget) gets the default
+            nonlocal lang
+            try:
+                return registry.checkout(lang)
+            except Exception as e:
+                log.warning("⚠️ Language %s unavailable, using %s: %s", lang, MODEL_DEFAULT_LANG, e)
+                lang = MODEL_DEFAULT_LANG
+                return registry.checkout(lang)
+
+        # a fresh client beats a parked one nobody came back for
+        while parked and not admission.room():
+            await evict_oldest()
+        if admission.reserve():
+            try:
+                pick = await loop.run_in_executor(None, checkout)
+                while pick is None and parked:
+                    await evict_oldest()
+                    pick = await loop.run_in_executor(None, checkout)
+                if pick is not None:
+                    live = LiveSession(*pick, lang, ClientAudioSource() if streamed else source, loop)
+            finally:
+                admission.release()
+        if live is None:
+            metrics.inc("sessions_rejected")
+            log.warning("⛔ Client rejected, load %.2f (reserved %.2f) on %d cores, %d/%d sessions",
+                        decode_load(), admission.reserved(), os.cpu_count() or 1, registry.sessions, POOL_MAX)
+            await websocket.close(1013, "speech server busy")
+            return
+        log.info("🟢 Client connected%s [%s]. pool=%s", " (streaming audio)" if streamed else "",
+                 lang, live.session.model.pool.stats())
+    else:
+        if live.stream is not None:
+            live.stream.reconnect()
+        metrics.inc("sessions_resumed")
+        log.info("▶️ Client resumed session (mode=%s).", live.session.mode)
+    session = live.session
+
+    live.outbox.attach({"type": "session", "token": live.token, "resumed": resumed,
+                        "mode": session.mode, "lang": session.lang, "grace_sec": RESUME_GRACE_SEC})
+    writer = asyncio.ensure_future(live.outbox.run(websocket, session.on_sent))
+
+    # ---- control messages run off the loop, one at a time and in order:
+    # they take the session lock, which the decoder holds for a whole block
+    # (and set_grammar / set_language may compile or load for seconds) ----
+    controls: asyncio.Queue = asyncio.Queue()
+
+    async def control_loop():
+        while True:
+            data = await controls.get()
+            if data is None:
+                return
+            try:
+                await loop.run_in_executor(None, session.handle_control, data)
+            except Exception as e:
+                log.error("Control message %s failed: %s", data.get("type"), e)
 
-    # ---- incoming control messages from Godot ----
+    control_task = asyncio.ensure_future(control_loop())
+
+    # ---- incoming messages from Godot ----
     async def recv_loop():
-        nonlocal window_deadline, freestyle_finalized
         async for msg in websocket:
+            if isinstance(msg, bytes):
+                if live.stream is not None:
+                    live.stream.feed(msg)
+                continue
             try:
                 data = json.loads(msg)
             except Exception:
                 continue
-            typ = data.get("type")
-
-            if typ == "set_mode":
-                m = str(data.get("mode", "command"))
-                switch_mode(m)
-
-            elif typ == "listen_window":
-                # {ms, bpm, bars, grid}
-                ms   = int(data.get("ms", 4000))
-                bpm  = float(data.get("bpm", 92.0))
-                bars = int(data.get("bars", 2))
-                grid = str(data.get("grid", "eighth"))
-                print(f"🎧 LISTEN WINDOW: {ms}ms, bpm={bpm}, bars={bars}, grid={grid}")
-                switch_mode("freestyle")
-                # start a fresh window
-                recognizer_free.Reset()
-                freestyle_finalized = False
-                start = monotonic()
-                window_deadline = start + (ms / 1000.0)
-
+            if not isinstance(data, dict):
+                continue
+            if data.get("type") == "stats":
+                live.outbox.put({"type": "stats", **server_stats(),
+                                 "session": {**session.stats(), "audio": live.audio_stats()}})
             else:
-                # unknown control message; ignore
-                pass
+                controls.put_nowait(data)
 
-    # Open mic stream + run recv loop
-    with sd.RawInputStream(
-        samplerate=SAMPLE_RATE,
-        blocksize=BLOCKSIZE,
-        dtype='int16',
-        channels=1,
-        callback=callback
-    ):
-        # Run the recv loop until the client disconnects
-        try:
-            await recv_loop()
-        except websockets.ConnectionClosed:
-            pass
-        finally:
-            # If they disconnect mid-window, finalize what we have
-            if mode == "freestyle":
-                print("⚠️ Client disconnected during freestyle; finalizing.")
-                # best-effort final send
-                try:
-                    # push a final empty buffer to flush
-                    recognizer_free.AcceptWaveform(b"")
-                except Exception:
-                    pass
+    try:
+        await recv_loop()
+    except websockets.ConnectionClosed:
+        pass
+    finally:
+        live.outbox.detach()
+        writer.cancel()
+        controls.put_nowait(None)      # apply what the client already sent (a parked session keeps it)
+        await control_task
+        if RESUME_GRACE_SEC > 0:
+            park(live, loop)
+        else:
+            await loop.run_in_executor(None, live.close)
+
+    log.info("🔴 Client disconnected.")
+
+# =========================
+# Stats
+# - {"type":"stats"} over the websocket, or GET /stats (JSON) and /metrics (text)
+#   on STATS_PORT when enabled
+# =========================
+def _rate(num: str, *den: str) -> float:
+    c = metrics.counters
+    total = sum(c.get(k, 0) for k in den)
+    return round(c.get(num, 0) / total, 4) if total else 0.0
+
+metrics.gauge("rtf", lambda: round(metrics.counters.get("decode_sec", 0.0)
+                                   / max(1e-9, metrics.counters.get("blocks_decoded", 0) * BLOCK_SEC), 4))
+_OUTCOMES = ("finals_sent", "unmatched", "unk", "cooldown_drops", "debounced", "empty_finals")
+metrics.gauge("unmatched_rate", lambda: _rate("unmatched", *_OUTCOMES))
+metrics.gauge("unk_rate", lambda: _rate("unk", *_OUTCOMES))
 
-    print("🔴 Client disconnected.")
+def server_stats() -> Dict[str, Any]:
+    return {"state": loader.state, "startup": loader.phases, **metrics.snapshot()}
 
-async def main():
-    async with websockets.serve(handle_client, HOST, PORT):
-        print(f"🟢 Voice server running on ws://{HOST}:{PORT}")
-        await asyncio.Future()
+async def handle_stats_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request = await asyncio.wait_for(reader.readline(), 5.0)
+        while (await asyncio.wait_for(reader.readline(), 5.0)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request.decode("latin-1").split()
+        path = parts[1] if len(parts) > 1 else "/"
+        if path.startswith("/metrics"):
+            status, ctype, body = "200 OK", "text/plain; version=0.0.4", metrics.render_text()
+        elif path in ("/", "/stats"):
+            status, ctype, body = "200 OK", "application/json", json.dumps(server_stats())
+        else:
+            status, ctype, body = "404 Not Found", "text/plain", "not found\n"
+        data = body.encode("utf-8")
+        writer.write(f"HTTP/1.0 {status}\r\nContent-Type: {ctype}\r\nContent-Length: {len(data)}\r\n"
+                     f"Connection: close\r\n\r\n".encode("latin-1") + data)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def main(source: Optional[AudioSource], warmup_sec: float = MODEL_WARMUP_SEC, stats_port: Optional[int] = STATS_PORT):
+    """source=None: no shared input (CLIENT_AUDIO_ONLY); every client streams its own."""
+    unmatched_log.start()              # loads the aggregate on its own thread, not on the first miss
+    if source is not None:
+        source.start()
+        metrics.gauge("source", source.stats)
+    stats_server = None
+    try:
+        async with websockets.serve(lambda ws: handle_client(ws, source), HOST, PORT):
+            log.info("🟢 Voice server running on ws://%s:%d (bound %.1f ms after start)",
+                     HOST, PORT, (perf_counter() - _T_SCRIPT) * 1000.0)
+            if stats_port:
+                stats_server = await asyncio.start_server(handle_stats_http, HOST, stats_port)
+                log.info("📈 Stats on http://%s:%d/stats and /metrics", HOST, stats_port)
+            loader.start_background(asyncio.get_running_loop(), warmup_sec)
+            await asyncio.Future()
+    finally:
+        if stats_server is not None:
+            stats_server.close()
+        for token in list(parked):
+            unpark(token).close()
+        if source is not None:
+            source.stop()
+        unmatched_log.stop()
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Vosk voice command / freestyle server")
+    ap.add_argument("--input", metavar="PATH",
+                    help="replay a 16-bit WAV (resampled to 16 kHz mono) or raw 16 kHz s16le PCM file ('-' for stdin) instead of the mic")
+    ap.add_argument("--device", default=INPUT_DEVICE, metavar="ID",
+                    help="input device index or name substring (see --list-devices)")
+    ap.add_argument("--list-devices", action="store_true",
+                    help="print the audio devices PortAudio sees and exit")
+    ap.add_argument("--client-audio", action="store_true",
+                    help="don't open a mic; each client streams its own audio as binary frames (shared recognition box)")
+    ap.add_argument("--host", default=HOST, help="interface to listen on (0.0.0.0 to serve other machines)")
+    ap.add_argument("--max-sessions", type=int, default=POOL_MAX, metavar="N",
+                    help="cap on concurrent sessions (recognizer pairs); admission also checks decode load")
+    ap.add_argument("--model-budget-mb", type=float, default=MODEL_RSS_BUDGET_MB, metavar="MB",
+                    help="evict idle language models (least recently used) to keep RSS under this; 0 = no cap")
+    ap.add_argument("--fast", action="store_true",
+                    help="with --input: replay as fast as decoding allows instead of real time")
+    ap.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                    help="console log level (default INFO, WARNING in the frozen build; env SPEECH_LOG_LEVEL)")
+    ap.add_argument("--no-warmup", action="store_true",
+                    help="skip the synthetic-silence warmup pass after the model loads")
+    ap.add_argument("--stats-port", type=int, default=STATS_PORT, metavar="PORT",
+                    help="serve /stats (JSON) and /metrics (text) on this local HTTP port")
+    return ap.parse_args(argv)
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    setup_logging(args.log_level)
+    if args.list_devices:
+        print(sd.query_devices() if sd is not None else "sounddevice/PortAudio not available")
+        sys.exit(0)
+    HOST, POOL_MAX = args.host, args.max_sessions
+    registry.budget_mb = args.model_budget_mb
+    if args.client_audio:
+        CLIENT_AUDIO_ONLY = True
+        source = None
+    elif args.input:
+        source = FileSource(args.input, realtime=not args.fast)
+    else:
+        device = args.device
+        source = CaptureService(int(device) if isinstance(device, str) and device.isdigit() else device)
+    asyncio.run(main(source, 0.0 if args.no_warmup else MODEL_WARMUP_SEC, args.stats_port))
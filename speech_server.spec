@@ -5,7 +5,7 @@ a = Analysis(
     ['speech_server.py'],
     pathex=[],
     binaries=[('/home/noro/vosk_buildenv/lib/python3.12/site-packages/vosk/libvosk.so', 'vosk')],
-    datas=[('/home/noro/Downloads/Chrysalis/vosk_models/vosk-model-small-en-us-0.15', 'vosk_models/vosk-model-small-en-us-0.15')],
+    datas=[('/home/noro/Downloads/Chrysalis/vosk_models', 'vosk_models')],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
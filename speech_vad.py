@@ -0,0 +1,120 @@
+"""Frame-level voice activity detection for speech_server.
+
+Replaces the old audioop.rms-per-block check (audioop is gone in Python 3.13)
+with per-frame log energy against an adaptive noise floor, plus hangover so
+short gaps inside a word don't count as silence. The floor also follows the
+quietest frame of the last few seconds (minimum statistics), so a step up in
+room noise can't lock the detector into "speech" for good. Energies for a whole block
+are computed in one vectorized NumPy pass; only the tiny floor/hangover state
+machine walks the frames.
+"""
+import collections
+import numpy as np
+
+class FrameVAD:
+    """Energy VAD with noise-floor tracking and hangover.
+
+    Feed int16 mono blocks with process(); afterwards:
+      in_speech         speech (or hangover) at the end of the last block
+      trailing_silence  seconds since the last speech frame (hangover included)
+      speech_frames     speech frames seen since the last reset_utterance()
+    """
+
+    def __init__(self,
+                 sample_rate: int = 16000,
+                 frame_ms: int = 20,
+                 threshold_db: float = 10.0,     # speech = this far above the noise floor...
+                 min_speech_db: float = 50.0,    # ...and above this absolute level (~rms 300)
+                 hangover_ms: int = 120,
+                 floor_init_db: float = 40.0,
+                 floor_rise: float = 0.02,       # per-frame adaptation towards louder noise (slow)
+                 floor_fall: float = 0.30,       # ...and towards quieter noise (fast)
+                 min_window_sec: float = 3.0,    # minimum-statistics window: speech always pauses within this
+                 min_sub_sec: float = 0.5):
+        self.sample_rate = sample_rate
+        self.frame_len = max(1, sample_rate * frame_ms // 1000)
+        self.frame_sec = self.frame_len / sample_rate
+        self.threshold_db = threshold_db
+        self.min_speech_db = min_speech_db
+        self.hangover_frames = max(0, int(round(hangover_ms / frame_ms)))
+        self.floor_rise = floor_rise
+        self.floor_fall = floor_fall
+        # quietest frame per sub-window; the oldest drops off as a new one fills
+        self.min_sub_frames = max(1, int(round(min_sub_sec / self.frame_sec)))
+        self._mins: collections.deque = collections.deque(maxlen=max(1, int(round(min_window_sec / min_sub_sec))))
+        self._sub_min = np.inf
+        self._sub_n = 0
+
+        self.noise_db = floor_init_db
+        self.last_db = 0.0
+        self.in_speech = False
+        self.trailing_silence = 0.0
+        self.speech_frames = 0
+        self._hang = 0
+        self._carry = np.zeros(0, dtype=np.int16)   # samples left over from a non-multiple block
+
+    def frame_db(self, samples: np.ndarray) -> np.ndarray:
+        """Log energy (dB re 1 LSB) of each whole frame in `samples`."""
+        n = len(samples) // self.frame_len
+        if n == 0:
+            return np.zeros(0, dtype=np.float32)
+        frames = samples[:n * self.frame_len].reshape(n, self.frame_len).astype(np.float32)
+        energy = np.einsum("ij,ij->i", frames, frames) / self.frame_len
+        return 10.0 * np.log10(energy + 1e-3)
+
+    def process(self, block) -> bool:
+        """Classify one block; returns True if any frame in it was speech."""
+        samples = np.frombuffer(block, dtype=np.int16)
+        if len(self._carry):
+            samples = np.concatenate((self._carry, samples))
+        dbs = self.frame_db(samples)
+        used = len(dbs) * self.frame_len
+        self._carry = samples[used:].copy() if used < len(samples) else self._carry[:0]
+
+        any_speech = False
+        floor = self.noise_db
+        for db in dbs.tolist():
+            self._sub_min = min(self._sub_min, db)
+            self._sub_n += 1
+            if self._sub_n >= self.min_sub_frames:
+                self._mins.append(self._sub_min)
+                self._sub_min, self._sub_n = np.inf, 0
+            loud = db > floor + self.threshold_db and db > self.min_speech_db
+            if loud and len(self._mins) == self._mins.maxlen:
+                # no quiet frame for a whole window: that's the room, not a voice
+                quietest = min(self._mins)
+                if quietest > floor:
+                    floor += (quietest - floor) * self.floor_rise
+                    loud = db > floor + self.threshold_db
+            if loud:
+                self._hang = self.hangover_frames
+                self.speech_frames += 1
+                self.trailing_silence = 0.0
+                any_speech = True
+                self.in_speech = True
+            else:
+                # only track the floor on non-speech frames
+                alpha = self.floor_fall if db < floor else self.floor_rise
+                floor += (db - floor) * alpha
+                self.trailing_silence += self.frame_sec
+                if self._hang > 0:
+                    self._hang -= 1
+                    self.in_speech = True
+                else:
+                    self.in_speech = False
+        self.noise_db = floor
+        if len(dbs):
+            self.last_db = float(dbs[-1])
+        return any_speech
+
+    def reset_utterance(self):
+        """Forget the current utterance (after a final); keeps the noise floor."""
+        self.speech_frames = 0
+
+    def stats(self) -> dict:
+        return {
+            "noise_db": round(self.noise_db, 1),
+            "last_db": round(self.last_db, 1),
+            "in_speech": self.in_speech,
+            "trailing_silence": round(self.trailing_silence, 3),
+        }
@@ -7,6 +7,39 @@ class_name VoiceReceiver
 const SPEECH_URL := "ws://localhost:8765"
 var ws := WebSocketPeer.new()
 
+# Server readiness: "connecting" → "loading" (model still loading) → "ready" | "error"; "closed" once disconnected
+signal speech_status_changed(state: String)
+var server_state: String = "connecting"
+
+# The frozen server binary may still be unpacking when the game starts
+const CONNECT_RETRY_DELAY := 1.0 # seconds
+const CONNECT_MAX_ATTEMPTS := 30
+var _connect_attempts: int = 0
+var _was_open: bool = false
+
+# Resumable session: after a drop, reconnect with ?resume=<token> within the
+# server's grace period to get the same mode / listen window back
+var session_token: String = ""
+var resume_grace_sec: float = 0.0
+var _resume_deadline: float = 0.0
+
+# Live partial transcripts are opt-in (server skips them entirely otherwise)
+signal speech_partial(mode: String, text: String)
+
+# Echo {type:"ack", id} after acting on a final so the server can time the full round trip
+const SEND_ACKS := true
+signal speech_stats(stats: Dictionary)
+
+# Active command phrase set on the server ("all", "combat", "travel", "rap" or a custom name)
+signal speech_grammar_changed(name: String)
+var grammar_name: String = "all"
+
+# Spoken language ("en", "no", "fi", "se", "de", "es"). The server loads that
+# language's own model on first use, or listens for its phonetic spellings on
+# the English one; finals carry the English `command` either way
+signal speech_language_changed(lang: String)
+var language: String = "en"
+
 # Command-mode cooldowns (per exact phrase)
 var last_trigger_time: Dictionary = {}
 const COOLDOWN := 1.5 # seconds per word/phrase
@@ -45,14 +78,23 @@ var pending_round_idx: int = -1
 func _ready() -> void:
 	# Put the singleton in a group so other scenes can find it robustly
 	add_to_group("VoiceReceiver")
-
-	var err := ws.connect_to_url(SPEECH_URL)
+	_connect()
+
+func _connect() -> void:
+	_connect_attempts += 1
+	ws = WebSocketPeer.new()
+	var url := SPEECH_URL
+	if not session_token.is_empty():
+		url += "/?resume=" + session_token.uri_encode()
+	elif language != "en":
+		url += "/?lang=" + language.uri_encode()
+	var err := ws.connect_to_url(url)
 	if err != OK:
 		push_error("Failed to connect to speech server: %s" % err)
 		set_process(false)
 		return
 
-	print("🟢 VoiceReceiver connecting to ", SPEECH_URL)
+	print("🟢 VoiceReceiver connecting to ", url, " (attempt ", _connect_attempts, ")")
 	set_process(true)
 
 func _process(_delta: float) -> void:
@@ -60,6 +102,9 @@ func _process(_delta: float) -> void:
 
 	match ws.get_ready_state():
 		WebSocketPeer.STATE_OPEN:
+			if not _was_open:
+				_connect_attempts = 0  # the retry budget is per outage, not per game
+			_was_open = true
 			while ws.get_available_packet_count() > 0:
 				var pkt := ws.get_packet()
 				if not ws.was_string_packet():
@@ -75,10 +120,30 @@ func _process(_delta: float) -> void:
 					data = {"type":"final", "text": raw}
 
 				_handle_message(data)
+				if SEND_ACKS and data.has("id"):
+					_send_json({"type":"ack", "id": data["id"]})
 
 		WebSocketPeer.STATE_CLOSED:
-			print("🔴 Speech connection closed")
 			set_process(false)
+			if (_was_open or _resume_deadline > 0.0) and not session_token.is_empty():
+				# Dropped mid-session: retry with the resume token until the grace period runs out
+				var now := Time.get_ticks_msec() / 1000.0
+				if _resume_deadline <= 0.0:
+					_resume_deadline = now + resume_grace_sec
+				if now < _resume_deadline:
+					_was_open = false
+					await get_tree().create_timer(CONNECT_RETRY_DELAY).timeout
+					_connect()
+					return
+				session_token = ""
+				_resume_deadline = 0.0
+			if not _was_open and _connect_attempts < CONNECT_MAX_ATTEMPTS:
+				# Server not listening yet; try again shortly
+				await get_tree().create_timer(CONNECT_RETRY_DELAY).timeout
+				_connect()
+				return
+			print("🔴 Speech connection closed")
+			_set_server_state("closed")
 
 # -------------------------------------------------
 # Incoming message handler
@@ -87,15 +152,67 @@ func _handle_message(data: Dictionary) -> void:
 	var mtype: String = str(data.get("type", ""))
 	match mtype:
 		"final":
-			_handle_command_final(str(data.get("text","")))
+			# `command` is the English command whatever language was spoken
+			_handle_command_final(str(data.get("command", data.get("text",""))))
 		"hotphrase":
 			_handle_hotphrase(str(data.get("text","")))
 		"freestyle_final":
 			_handle_freestyle_final(data)
+		"freestyle_progress":
+			_handle_freestyle_progress(data)
+		"status":
+			_handle_status(data)
+		"partial":
+			speech_partial.emit(str(data.get("mode", "")), str(data.get("text", "")))
+		"grammar":
+			_handle_grammar(data)
+		"language":
+			_handle_language(data)
+		"stats":
+			speech_stats.emit(data)
+		"session":
+			_handle_session(data)
 		_:
 			# Unknown message type → ignore quietly
 			pass
 
+# -------------------------------------------------
+# Server readiness
+# -------------------------------------------------
+# { type:"status", state:"loading"|"ready"|"error", startup:{phase_ms...}, error? }
+func _handle_status(data: Dictionary) -> void:
+	var state := str(data.get("state", ""))
+	if state == "ready":
+		print("✅ Speech server ready: ", data.get("startup", {}))
+	elif state == "error":
+		push_error("Speech server failed to load: %s" % str(data.get("error", "")))
+	else:
+		print("⏳ Speech server ", state, "...")
+	_set_server_state(state)
+
+# { type:"session", token:String, resumed:bool, mode:String, lang:String, grace_sec:float }
+func _handle_session(data: Dictionary) -> void:
+	session_token = str(data.get("token", ""))
+	resume_grace_sec = float(data.get("grace_sec", 0.0))
+	_resume_deadline = 0.0
+	var lang := str(data.get("lang", language))
+	if lang != language:
+		language = lang
+		speech_language_changed.emit(language)
+	if bool(data.get("resumed", false)):
+		# the server kept our mode / listen window; follow it instead of resetting
+		mode = str(data.get("mode", mode))
+		print("▶️ Speech session resumed (mode=", mode, ")")
+
+func _set_server_state(state: String) -> void:
+	if state == server_state:
+		return
+	server_state = state
+	speech_status_changed.emit(state)
+
+func is_speech_ready() -> bool:
+	return server_state == "ready"
+
 # -------------------------------------------------
 # Command / hotphrase path (grammar-mode)
 # -------------------------------------------------
@@ -363,6 +480,51 @@ func set_mode(new_mode: String) -> void:
 	_send_json({"type":"set_mode", "mode": new_mode})
 	print("[VoiceReceiver] mode -> ", new_mode)
 
+# Ask for server counters/latency histograms; the reply arrives via speech_stats.
+func request_stats() -> void:
+	_send_json({"type":"stats"})
+
+# Narrow the command grammar for the current scene (fewer false hits, faster decode).
+# Pass a set name from the server's GRAMMAR_SETS, or a name plus an explicit phrase list.
+func set_grammar(set_name: String, phrases: Array = []) -> void:
+	var payload := {"type":"set_grammar", "name": set_name}
+	if not phrases.is_empty():
+		payload["phrases"] = phrases
+	_send_json(payload)
+
+# { type:"grammar", name, phrases:int, cached:bool } or { type:"grammar", error }
+func _handle_grammar(data: Dictionary) -> void:
+	if data.has("error"):
+		push_warning("Speech grammar rejected: %s" % str(data.get("error", "")))
+		return
+	grammar_name = str(data.get("name", "all"))
+	print("[VoiceReceiver] grammar -> ", grammar_name, " (", data.get("phrases", 0), " phrases)")
+	speech_grammar_changed.emit(grammar_name)
+
+# Switch the spoken language; the first switch to a language may take a few
+# seconds while the server loads its model. Not honoured mid listen window.
+func set_language(lang: String) -> void:
+	language = lang
+	_send_json({"type":"set_language", "lang": lang})
+
+# { type:"language", lang, model, phrases:int, switched:bool } or { type:"language", error, lang, languages }
+func _handle_language(data: Dictionary) -> void:
+	if data.has("error"):
+		push_warning("Speech language rejected: %s" % str(data.get("error", "")))
+	language = str(data.get("lang", language))
+	print("[VoiceReceiver] language -> ", language, " (model ", data.get("model", "?"), ")")
+	speech_language_changed.emit(language)
+
+# Ask the server for throttled "partial" messages (e.g. for a live subtitle).
+func set_partials(enabled: bool, interval_ms: int = 250) -> void:
+	_send_json({"type":"set_partials", "enabled": enabled, "interval_ms": interval_ms})
+
+func _handle_freestyle_progress(data: Dictionary) -> void:
+	# Expected: { type:"freestyle_progress", elapsed:float, window_sec:float, words:int, judge:Dictionary }
+	if pending_round_idx < 0 or not data.has("judge") or typeof(data["judge"]) != TYPE_DICTIONARY:
+		return
+	Events.rap_player_progress.emit(pending_round_idx, data["judge"])
+
 func _handle_freestyle_final(data: Dictionary) -> void:
 	# Expected: { type:"freestyle_final", text:String, words:Array, judge:Dictionary }
 	battle_active = false